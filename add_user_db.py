@@ -11,7 +11,7 @@ from pathlib import Path
 # Добавляем путь к API модулям
 sys.path.append(str(Path(__file__).parent / "api"))
 
-from database import get_db, init_db
+from database import get_sync_db, init_db
 from models import User
 from auth import get_password_hash
 from sqlalchemy.orm import Session
@@ -23,7 +23,7 @@ def add_user_directly(username: str, email: str, password: str):
         init_db()
         
         # Получаем сессию базы данных
-        db = next(get_db())
+        db = next(get_sync_db())
         
         # Проверяем, существует ли пользователь
         existing_user = db.query(User).filter(
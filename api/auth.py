@@ -1,10 +1,25 @@
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
 
+# Стоимость bcrypt для новых хэшей (2^rounds итераций). Старые хэши проверяются
+# с той стоимостью, с которой были созданы.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt занимает 100–300 мс CPU и отпускает GIL, поэтому считается в отдельном
+# ограниченном пуле потоков, а не в event loop
+AUTH_WORKERS = max(int(os.getenv("AUTH_WORKERS", str(min(4, os.cpu_count() or 1)))), 1)
+
 # Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_auth_executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="auth")
+
+async def run_auth(func, *args):
+    """Выполняет блокирующую работу с паролями (bcrypt) в пуле auth"""
+    return await asyncio.get_running_loop().run_in_executor(_auth_executor, func, *args)
 
 # JWT settings
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
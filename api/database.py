@@ -1,21 +1,95 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 # Database URL - using SQLite for simplicity, can be changed to PostgreSQL
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./plaud.db")
 
+# Пул соединений: API держит до DB_POOL_SIZE + DB_MAX_OVERFLOW соединений,
+# pre-ping отбрасывает соединения, закрытые сервером БД за время простоя
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# SQLite: WAL позволяет читать во время записи, busy_timeout — ждать блокировку,
+# а не сразу падать с "database is locked"
+SQLITE_WAL = os.getenv("SQLITE_WAL", "true").lower() == "true"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+def _async_url(url: str) -> str:
+    """URL для асинхронного драйвера: sqlite -> aiosqlite, postgresql -> asyncpg"""
+    scheme, sep, rest = url.partition("://")
+    if "+" in scheme and scheme.split("+", 1)[1] in ("aiosqlite", "asyncpg"):
+        return url
+    base = scheme.split("+", 1)[0]
+    if base == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if base in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+_is_sqlite = DATABASE_URL.startswith("sqlite")
+_is_memory = DATABASE_URL in ("sqlite://", "sqlite:///:memory:")
+
+def _engine_options(sqlite_connect_args: dict, **extra) -> dict:
+    options = {"pool_pre_ping": True, **extra}
+    if _is_sqlite:
+        options["connect_args"] = sqlite_connect_args
+    if not _is_memory:
+        # in-memory SQLite живёт в одном соединении, размер пула к нему неприменим
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return options
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    if SQLITE_WAL and not _is_memory:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # В WAL достаточно синхронизировать журнал на контрольных точках
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+# Синхронный движок: init_db, миграции и скрипты управления пользователями
 engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+    DATABASE_URL,
+    **_engine_options({"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000})
 )
 
+# Асинхронный движок: все запросы к БД из обработчиков API
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    # aiosqlite по умолчанию без пула (NullPool) — открывал бы файл на каждый запрос
+    **_engine_options({"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+                      **({"poolclass": AsyncAdaptedQueuePool} if _is_sqlite and not _is_memory else {}))
+)
+
+if _is_sqlite:
+    event.listen(engine, "connect", _sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: после commit атрибуты читаются без повторного запроса
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
+async def get_db():
+    """Асинхронная сессия для зависимостей FastAPI"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_sync_db():
+    """Синхронная сессия для скриптов (next(get_sync_db()))"""
     db = SessionLocal()
     try:
         yield db
@@ -24,4 +98,7 @@ def get_db():
 
 def init_db():
     from models import Base
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+
+async def close_db():
+    await async_engine.dispose()
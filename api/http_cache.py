@@ -0,0 +1,147 @@
+"""
+HTTP-кэширование ответов с результатами задач (/result, /history/{job_id}).
+
+ETag строится из хешей файлов-артефактов (транскрипт, summary.json) и
+полей ответа, не зависящих от файлов, — без разбора JSON. Хеш файла
+считается один раз и кэшируется по (путь, inode, mtime, размер): артефакты
+пишутся атомарной заменой (tasks/storage.py), поэтому новая версия файла
+всегда даёт новый ключ. Запрос с совпадающим If-None-Match получает 304.
+
+Тело сжимается brotli (если установлен пакет brotli) или gzip по
+Accept-Encoding клиента. ETag сжатого варианта получает суффикс кодировки
+("<hash>-br"), If-None-Match сравнивается без него.
+
+Готовые задачи (summarized) отдаются с Cache-Control на RESULT_CACHE_MAX_AGE
+секунд, остальные — no-cache: клиент каждый раз переспрашивает, но при
+неизменном результате получает 304 без тела.
+"""
+
+import os
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+RESULT_CACHE_MAX_AGE = int(os.getenv("RESULT_CACHE_MAX_AGE", str(30 * 86400)))
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+DIGEST_CACHE_SIZE = int(os.getenv("DIGEST_CACHE_SIZE", "4096"))
+
+# Меняется вместе с форматом ответа, чтобы старые ETag клиентов не совпали
+ETAG_VERSION = b"1"
+
+_lock = threading.Lock()
+_digests = OrderedDict()  # (путь, inode, mtime_ns, размер) -> sha256
+
+def file_digest(path: Path) -> str:
+    """sha256 содержимого файла, из кэша, если файл не менялся"""
+    stat = path.stat()
+    key = (str(path), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        digest = _digests.get(key)
+        if digest is not None:
+            _digests.move_to_end(key)
+            return digest
+
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _lock:
+        _digests[key] = digest
+        while len(_digests) > DIGEST_CACHE_SIZE:
+            _digests.popitem(last=False)
+    return digest
+
+def make_etag(files: list, *parts) -> str:
+    """Сильный ETag по содержимому файлов и дополнительным частям ответа"""
+    h = hashlib.sha256(ETAG_VERSION)
+    for path in files:
+        h.update(b"\0" + path.name.encode() + b"\0" + file_digest(path).encode())
+    for part in parts:
+        h.update(b"\0" + str(part).encode("utf-8"))
+    return f'"{h.hexdigest()[:32]}"'
+
+def _base_tag(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in ("-br", "-gzip"):
+        if tag.endswith(f'{suffix}"'):
+            return tag[:-len(suffix) - 1] + '"'
+    return tag
+
+def not_modified(request: Request, etag: str):
+    """Совпавший тег из If-None-Match (с суффиксом кодировки, как его прислал клиент) или None"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    if header.strip() == "*":
+        return etag
+    for tag in header.split(","):
+        if _base_tag(tag) == etag:
+            return tag.strip()
+    return None
+
+def cache_control(finished: bool) -> str:
+    # private — ответ зависит от пользователя, общим прокси кэшировать нельзя
+    if finished and RESULT_CACHE_MAX_AGE > 0:
+        return f"private, max-age={RESULT_CACHE_MAX_AGE}"
+    return "private, no-cache"
+
+def _choose_encoding(request: Request):
+    accepted = {}
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+def _headers(etag: str, finished: bool) -> dict:
+    return {"ETag": etag, "Cache-Control": cache_control(finished), "Vary": "Accept-Encoding"}
+
+def not_modified_response(request: Request, etag: str, finished: bool):
+    """
+    Ответ 304, если у клиента актуальная версия, иначе None. Вызывается до
+    чтения артефактов, чтобы повторный запрос не трогал их содержимое.
+    """
+    matched = not_modified(request, etag)
+    if not matched:
+        return None
+    return Response(status_code=304, headers=_headers(matched, finished))
+
+def respond(request: Request, body: bytes, etag: str, finished: bool,
+            media_type: str = "application/json") -> Response:
+    """Ответ 200, тело сжато, если клиент это поддерживает и тело не слишком маленькое"""
+    headers = _headers(etag, finished)
+    encoding = _choose_encoding(request) if len(body) >= COMPRESS_MIN_SIZE else None
+    if encoding == "br":
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+    return Response(body, media_type=media_type, headers=headers)
@@ -1,69 +1,85 @@
-import os, uuid, shutil, json
+import os, uuid, shutil, json, time, logging
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Depends, Header, Form
-from fastapi.responses import JSONResponse
-from redis import Redis
-from rq import Queue
-import httpx
+from fastapi import FastAPI, HTTPException, Query, Depends, Header, Form, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Optional
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 import secrets
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # Import our modules
-from database import get_db, init_db
+from database import get_db, init_db, close_db, AsyncSessionLocal
 from models import User
-from auth import verify_password, get_password_hash, create_access_token, decode_access_token
+from auth import verify_password, get_password_hash, create_access_token, decode_access_token, run_auth
+import transcribe_client
+import user_cache
+import http_cache
+import uploads
+from tasks import job_index, dedup, summary_cache, storage, paths, transcript_store
+
+logger = logging.getLogger(__name__)
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
 DATA_DIR  = Path(os.getenv("DATA_DIR", "/data"))
 LANG_DEFAULT = "ru"
-TRANSCRIBE_SERVER_URL = os.getenv("TRANSCRIBE_SERVER_URL", "http://worker_transcribe:8002")
-
-def require_auth(authorization: str = Header(default=None), db: Session = Depends(get_db)):
+# "path" — API и сервер транскрибации делят DATA_DIR, передаём только путь к файлу;
+# "upload" — отправляем файл через multipart (сервер на другой машине)
+TRANSCRIBE_HANDOFF = os.getenv("TRANSCRIBE_HANDOFF", "path")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(2 * 1024 * 1024 * 1024)))  # 0 — без ограничения
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+PARTIAL_MAX_BYTES = int(os.getenv("PARTIAL_MAX_BYTES", str(256 * 1024)))
+# Сколько сегментов итогового транскрипта /partial отдаёт за раз (сегмент в JSON — около 256 байт)
+PARTIAL_FINAL_SEGMENTS = max(PARTIAL_MAX_BYTES // 256, 1)
+RESULT_MAX_SEGMENTS = int(os.getenv("RESULT_MAX_SEGMENTS", "1000"))
+RESULT_PARTS = ("summary", "text", "segments")
+
+async def require_auth(authorization: str = Header(default=None)):
     """
     Проверяет JWT токен в заголовке Authorization: Bearer <token>.
     Токен должен быть валидным JWT токеном с информацией о пользователе.
+    Возвращает снимок пользователя (user_cache.AuthUser); проверенные токены и
+    пользователи кэшируются, так что БД запрашивается только при промахе кэша.
     """
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Authorization header required")
     
-    # Логируем попытку доступа
-    import logging
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-    
     token = authorization.split(" ", 1)[1].strip()
     
-    # Проверяем JWT токен
-    payload = decode_access_token(token)
-    if payload and "sub" in payload:
-        username = payload.get("sub")
-        user = db.query(User).filter(User.username == username).first()
-        if user and user.is_active:
-            logger.info(f"Successful JWT auth for user: {username}")
-            return user
-        else:
-            logger.warning(f"Invalid JWT token for user: {username}")
-    else:
-        logger.warning(f"Invalid JWT token: {token[:8]}...")
-    
-    # Логируем неудачную попытку
-    logger.error("Unauthorized access attempt")
-    
-    # иначе — 401
-    raise HTTPException(status_code=401, detail="Unauthorized")
+    username = user_cache.get_token_subject(token)
+    if username is None:
+        # Проверяем JWT токен
+        payload = decode_access_token(token)
+        if not payload or "sub" not in payload:
+            logger.warning(f"Invalid JWT token: {token[:8]}...")
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        username = payload["sub"]
+        user_cache.put_token(token, username, payload.get("exp"))
+
+    user = user_cache.get_user(username)
+    if user is None:
+        async with AsyncSessionLocal() as db:
+            db_user = (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
+            if db_user and db_user.is_active:
+                user = user_cache.put_user(db_user)
+
+    if user is None:
+        logger.warning(f"Invalid JWT token for user: {username}")
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return user
 
-def require_admin(authorization: str = Header(default=None), db: Session = Depends(get_db)):
+async def require_admin(authorization: str = Header(default=None)):
     """
     Проверяет JWT токен и права администратора.
     Возвращает объект пользователя-администратора.
     """
     # require_auth уже проверяет авторизацию и возвращает пользователя или выбрасывает исключение
-    user = require_auth(authorization, db)
+    user = await require_auth(authorization)
     
     # Если мы дошли до этой точки, значит пользователь авторизован
     if not user.is_admin:
@@ -72,12 +88,17 @@ def require_admin(authorization: str = Header(default=None), db: Session = Depen
     return user
 
 
-app = FastAPI(title="Whisper+DeepSeek API (variant B)")
-
-# Initialize database on startup
-@app.on_event("startup")
-async def startup_event():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Initialize database on startup
     init_db()
+    # Общий пул соединений к серверу транскрибации (см. transcribe_client.py)
+    await transcribe_client.start()
+    yield
+    await transcribe_client.stop()
+    await close_db()
+
+app = FastAPI(title="Whisper+DeepSeek API (variant B)", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -95,32 +116,53 @@ if not os.path.exists(static_dir):
 app.mount("/app", StaticFiles(directory=static_dir, html=True), name="app")
 
 def jobs_dir(job_id: str) -> Path:
-    return DATA_DIR / "jobs" / job_id
+    return paths.job_dir(job_id, DATA_DIR)
 
 def ensure_dirs(p: Path):
     p.mkdir(parents=True, exist_ok=True)
 
-async def send_to_transcribe_server(job_id: str, audio_path: str, language: str):
-    """Отправляет аудиофайл в сервер транскрибации через HTTP"""
+def require_job_access(job_id: str, user: User) -> dict:
+    """
+    Возвращает запись задачи из индекса, если она принадлежит пользователю.
+    Администраторы видят любые задачи. Чужие задачи отдают 404, а не 403,
+    чтобы не раскрывать существование job_id.
+    """
+    record = job_index.get_job(job_id)
+    if not record:
+        raise HTTPException(404, "job not found")
+    if record.get("owner_id") != str(user.id) and not user.is_admin:
+        raise HTTPException(404, "job not found")
+    return record
+
+async def send_to_transcribe_server(job_id: str, audio_path: str, language: str, sha256: str = None):
+    """Передаёт задачу в сервер транскрибации через общий пул соединений"""
     try:
-        # Открываем файл для отправки
-        with open(audio_path, "rb") as audio_file:
-            files = {"file": audio_file}
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{TRANSCRIBE_SERVER_URL}/transcribe?job_id={job_id}&language={language}",
-                    files=files,
-                    timeout=30.0
+        if TRANSCRIBE_HANDOFF == "path":
+            # Файл уже лежит на общем томе — передаём только путь относительно DATA_DIR
+            response = await transcribe_client.post(
+                "/transcribe/local",
+                json={
+                    "job_id": job_id,
+                    "language": language,
+                    "path": str(Path(audio_path).relative_to(DATA_DIR)),
+                    "sha256": sha256,
+                },
+            )
+        else:
+            with open(audio_path, "rb") as audio_file:
+                response = await transcribe_client.post(
+                    "/transcribe",
+                    params={"job_id": job_id, "language": language, "sha256": sha256},
+                    files={"file": audio_file},
                 )
-                
-                if response.status_code == 200:
-                    print(f"Файл успешно отправлен в сервер транскрибации для job_id: {job_id}")
-                    return True
-                else:
-                    print(f"Ошибка отправки в сервер транскрибации: {response.status_code} - {response.text}")
-                    return False
-                    
+
+        if response.status_code == 200:
+            print(f"Задача успешно передана в сервер транскрибации для job_id: {job_id}")
+            return True
+        else:
+            print(f"Ошибка отправки в сервер транскрибации: {response.status_code} - {response.text}")
+            return False
+
     except Exception as e:
         print(f"Ошибка при отправке в сервер транскрибации: {e}")
         return False
@@ -133,7 +175,7 @@ def enqueue_asr(job_id: str, audio_path: str, language: str):
 
 @app.get("/healthz")
 def healthz(_auth=Depends(require_auth)):
-    return {"status": "ok"}
+    return {"status": "ok", "transcribe_server": transcribe_client.health()}
 
 # New authentication endpoints
 @app.post("/auth/register")
@@ -141,13 +183,13 @@ async def register_user(
     username: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Регистрация нового пользователя"""
     # Check if user already exists
-    existing_user = db.query(User).filter(
+    existing_user = (await db.execute(select(User).where(
         (User.username == username) | (User.email == email)
-    ).first()
+    ))).scalars().first()
     
     if existing_user:
         raise HTTPException(
@@ -155,8 +197,8 @@ async def register_user(
             detail="Пользователь с таким именем или email уже существует"
         )
     
-    # Hash password
-    hashed_password = get_password_hash(password)
+    # Hash password (bcrypt не должен блокировать event loop)
+    hashed_password = await run_auth(get_password_hash, password)
     
     # Create new user
     new_user = User(
@@ -166,8 +208,8 @@ async def register_user(
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     
     return {
         "message": "Пользователь успешно зарегистрирован",
@@ -179,12 +221,12 @@ async def register_user(
 async def login_user(
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Аутентификация пользователя"""
-    user = db.query(User).filter(User.username == username).first()
+    user = (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
     
-    if not user or not verify_password(password, user.hashed_password):
+    if not user or not await run_auth(verify_password, password, user.hashed_password):
         raise HTTPException(
             status_code=401,
             detail="Неверное имя пользователя или пароль"
@@ -209,7 +251,7 @@ async def login_user(
 @app.get("/auth/me")
 async def get_current_user(
     authorization: str = Header(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение информации о текущем пользователе"""
     # Проверяем JWT токен
@@ -220,7 +262,7 @@ async def get_current_user(
     payload = decode_access_token(token)
     if payload and "sub" in payload:
         username = payload.get("sub")
-        user = db.query(User).filter(User.username == username).first()
+        user = (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
         if user and user.is_active:
             return {
                 "user_id": user.id,
@@ -254,124 +296,197 @@ def check_auth(authorization: str = Header(...)):
     raise HTTPException(status_code=401, detail="Invalid token")
 
 @app.get("/stats")
-def get_stats(_auth=Depends(require_auth)):
-    """Получение статистики обработки"""
-    import os
-    from pathlib import Path
-    
-    jobs_dir = DATA_DIR / "jobs"
-    if not jobs_dir.exists():
-        return {"total_jobs": 0, "completed_jobs": 0, "processing_jobs": 0}
-    
-    total_jobs = 0
-    completed_jobs = 0
-    processing_jobs = 0
-    
-    for job_dir in jobs_dir.iterdir():
-        if job_dir.is_dir():
-            total_jobs += 1
-            if (job_dir / "summary.json").exists():
-                completed_jobs += 1
-            elif (job_dir / "transcript.json").exists():
-                processing_jobs += 1
-    
+def get_stats(user=Depends(require_auth)):
+    """Получение статистики обработки задач текущего пользователя"""
+    counts = job_index.job_counts(owner_id=user.id)
+
+    total_jobs = sum(counts.values())
+    completed_jobs = counts["summarized"]
+    processing_jobs = counts["transcribed"]
+
     return {
         "total_jobs": total_jobs,
         "completed_jobs": completed_jobs,
         "processing_jobs": processing_jobs,
-        "queued_jobs": total_jobs - completed_jobs - processing_jobs
+        "error_jobs": counts["error"],
+        "queued_jobs": total_jobs - completed_jobs - processing_jobs - counts["error"]
     }
 
-@app.post("/upload")
+@app.post("/upload", openapi_extra=uploads.OPENAPI_BODY)
 async def upload(
-    file: UploadFile = File(...),
+    request: Request,
     language: str = Query(LANG_DEFAULT),
-    _auth=Depends(require_auth),                   # 🔐 защита
+    user=Depends(require_auth),                    # 🔐 защита
 ):
     job_id = str(uuid.uuid4())
     jdir = jobs_dir(job_id)
     ensure_dirs(jdir)
 
-    suffix = Path(file.filename).suffix or ".wav"
-    audio_path = jdir / f"input{suffix}"
-
-    with audio_path.open("wb") as f:
-        shutil.copyfileobj(file.file, f)
+    # Файл пишется в каталог задачи прямо из тела запроса (см. api/uploads.py);
+    # MAX_UPLOAD_SIZE обрывает загрузку, как только превышен
+    try:
+        audio_path, filename, size, sha256 = await uploads.receive_audio(
+            request, jdir, MAX_UPLOAD_SIZE, UPLOAD_CHUNK_SIZE)
+    except Exception:
+        # И при обрыве соединения клиентом — каталог задачи не остаётся
+        shutil.rmtree(jdir, ignore_errors=True)
+        raise
 
     # Помечаем метаданные
-    meta = {"job_id": job_id, "filename": file.filename, "language": language}
-    (jdir / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), "utf-8")
+    meta = {"job_id": job_id, "filename": filename, "language": language, "size": size,
+            "sha256": sha256, "created_at": time.time(), "owner_id": str(user.id)}
+    storage.write_json(jdir / "meta.json", meta)
+    job_index.create_job(job_id, filename=filename, language=language, size=size,
+                         audio_sha256=sha256, created_at=meta["created_at"], owner_id=meta["owner_id"])
 
-    # Отправляем файл в сервер транскрибации
-    success = await send_to_transcribe_server(job_id, str(audio_path), language)
+    # Отправляем файл в сервер транскрибации (повторная загрузка того же аудио
+    # там не распознаётся заново — см. tasks/dedup.py)
+    success = await send_to_transcribe_server(job_id, str(audio_path), language, sha256)
     
     if success:
         return {"job_id": job_id, "status": "processing"}
     else:
         # Если не удалось отправить в сервер транскрибации, возвращаем ошибку
+        job_index.set_status(job_id, "error", error="Failed to send to transcription server")
+        wait = transcribe_client.retry_after()
         return JSONResponse(
             {"job_id": job_id, "status": "error", "error": "Failed to send to transcription server"}, 
-            status_code=500
+            status_code=500,
+            headers={"Retry-After": str(int(wait) + 1)} if wait else None
         )
 
 @app.get("/status/{job_id}")
-async def status(job_id: str, _auth=Depends(require_auth)): 
-    jdir = jobs_dir(job_id)
-    if not jdir.exists():
-        raise HTTPException(404, "job not found")
+def status(job_id: str, user=Depends(require_auth)):
+    # Статус — из записи задачи в Redis, без проверки файлов и запроса к серверу транскрибации
+    record = require_job_access(job_id, user)
+    return job_index.event_payload(record)
 
-    transcript = jdir / "transcript.json"
-    summary    = jdir / "summary.json"
-    
-    # Если есть готовый результат, возвращаем его
-    if summary.exists():
-        return {"job_id": job_id, "status": "done"}
-    if transcript.exists():
-        return {"job_id": job_id, "status": "transcribed_waiting_summary"}
-    
-    # Если нет готового результата, проверяем статус в сервере транскрибации
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{TRANSCRIBE_SERVER_URL}/status/{job_id}",
-                timeout=10.0
-            )
-            
-            if response.status_code == 200:
-                server_status = response.json()
-                return {
-                    "job_id": job_id,
-                    "status": server_status.get("status", "processing"),
-                    "server_status": server_status
-                }
-    except Exception as e:
-        print(f"Ошибка при проверке статуса в сервере транскрибации: {e}")
-    
-    return {"job_id": job_id, "status": "processing"}
+def _sse(event: dict) -> str:
+    return f"event: status\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.get("/events/{job_id}")
+def job_events(job_id: str, user=Depends(require_auth)):
+    """
+    Поток Server-Sent Events со сменами статуса задачи.
+    Первым событием приходит текущее состояние, поток закрывается,
+    когда задача завершена (done) или упала с ошибкой.
+    Проверка доступа (синхронный Redis) идёт в пуле потоков, сам поток
+    читает Redis только через асинхронное соединение.
+    """
+    require_job_access(job_id, user)
+
+    async def stream():
+        pubsub = job_index.get_async_redis().pubsub()
+        # Подписываемся до чтения текущего состояния, чтобы не пропустить переход между ними
+        await pubsub.subscribe(job_index.events_channel(job_id))
+        try:
+            record = await job_index.get_job_async(job_id)
+            if not record:
+                return
+            yield _sse(job_index.event_payload(record))
+            if record["status"] in job_index.TERMINAL_STATUSES:
+                return
+
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=SSE_KEEPALIVE_SECONDS
+                )
+                if message is None:
+                    yield ": keepalive\n\n"
+                    continue
+                event = json.loads(message["data"])
+                yield _sse(event)
+                if event.get("stage") in job_index.TERMINAL_STATUSES:
+                    return
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _json_with_transcript(out: dict, transcript) -> bytes:
+    """
+    Тело JSON-ответа с транскриптом: готовый JSON из transcript_store.render_json
+    вставляется в ответ как есть, без разбора и повторной сериализации.
+    """
+    body = json.dumps(out, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    if transcript is None:
+        return body
+    separator = b"," if out else b""
+    return body[:-1] + separator + b'"transcript":' + transcript + b"}"
 
 @app.get("/result/{job_id}")
-def result(job_id: str, _auth=Depends(require_auth)): 
+def result(
+    job_id: str,
+    request: Request,
+    parts: Optional[str] = Query(None, description="Части ответа через запятую: summary, text, segments"),
+    offset: int = Query(0, ge=0, description="Номер первого сегмента (next_offset из предыдущего ответа)"),
+    limit: Optional[int] = Query(None, ge=1, le=RESULT_MAX_SEGMENTS, description="Сколько сегментов вернуть"),
+    start: Optional[float] = Query(None, ge=0, description="Сегменты, заканчивающиеся после start (сек)"),
+    end: Optional[float] = Query(None, ge=0, description="Сегменты, начинающиеся до end (сек)"),
+    user=Depends(require_auth)
+):
+    """
+    Результат задачи. Без параметров — весь транскрипт и резюме. parts выбирает
+    части ответа (экран списка берёт только summary), offset/limit и start/end —
+    окно сегментов. Если сегменты выбраны так, в transcript добавляются
+    segments_total и next_offset для следующей страницы.
+    """
+    if parts:
+        selected = {p.strip() for p in parts.split(",") if p.strip()}
+        unknown = selected - set(RESULT_PARTS)
+        if unknown:
+            raise HTTPException(400, f"Unknown parts: {', '.join(sorted(unknown))}")
+    else:
+        selected = set(RESULT_PARTS)
+    projected = selected != set(RESULT_PARTS) or offset > 0 or limit is not None \
+        or start is not None or end is not None
+
+    record = require_job_access(job_id, user)
     jdir = jobs_dir(job_id)
     if not jdir.exists():
         raise HTTPException(404, "job not found")
     
-    transcript = jdir / "transcript.json"
     summary = jdir / "summary.json"
     
     # Проверяем, что транскрипт готов
-    if not transcript.exists():
+    transcript_file = transcript_store.path_of(jdir)
+    if transcript_file is None:
         return JSONResponse({"error": "transcript_not_ready"}, status_code=202)
     
+    # Повторный запрос с актуальным ETag — 304 без чтения транскрипта и резюме
+    with_transcript = "text" in selected or "segments" in selected
+    artifacts = []
+    if with_transcript:
+        artifacts.append(transcript_file)
+    if "summary" in selected and summary.exists():
+        artifacts.append(summary)
+    finished = record["status"] == "summarized"
+    etag = http_cache.make_etag(artifacts, job_id, sorted(selected), offset, limit, start, end)
+    cached = http_cache.not_modified_response(request, etag, finished)
+    if cached is not None:
+        return cached
+    
     out = {"job_id": job_id}
     
-    # Загружаем транскрипт
+    # Загружаем транскрипт: целиком или только запрошенные части
+    transcript = None
     try:
-        out["transcript"] = json.loads(transcript.read_text("utf-8"))
+        if with_transcript and projected:
+            transcript = transcript_store.render_projection(
+                jdir, text="text" in selected, segments="segments" in selected,
+                offset=offset, limit=limit, t_from=start, t_to=end)
+        elif with_transcript:
+            transcript = transcript_store.render_json(jdir)
     except Exception as e:
         return JSONResponse({"error": f"transcript_read_error: {str(e)}"}, status_code=500)
     
     # Загружаем саммари, если оно готово
-    if summary.exists():
+    if "summary" in selected and summary.exists():
         try:
             summary_data = json.loads(summary.read_text("utf-8"))
             out["summary"] = summary_data
@@ -379,139 +494,200 @@ def result(job_id: str, _auth=Depends(require_auth)):
             # Если саммари повреждено, возвращаем только транскрипт
             out["summary_error"] = f"summary_read_error: {str(e)}"
     
-    return out
+    return http_cache.respond(request, _json_with_transcript(out, transcript), etag, finished)
 
-@app.get("/history")
-def get_history(_auth=Depends(require_auth)):
-    """Получение истории всех задач с их статусами и результатами"""
-    jobs_dir_path = DATA_DIR / "jobs"
-    if not jobs_dir_path.exists():
-        return {"jobs": []}
-    
-    jobs = []
-    for job_dir in jobs_dir_path.iterdir():
-        if not job_dir.is_dir():
-            continue
-            
-        job_id = job_dir.name
-        meta_file = job_dir / "meta.json"
-        transcript_file = job_dir / "transcript.json"
-        summary_file = job_dir / "summary.json"
-        
-        job_info = {
-            "job_id": job_id,
-            "status": "unknown"
-        }
-        
-        # Определяем статус
-        if summary_file.exists():
-            job_info["status"] = "done"
-        elif transcript_file.exists():
-            job_info["status"] = "transcribed_waiting_summary"
-        else:
-            job_info["status"] = "processing"
-        
-        # Загружаем метаданные
-        if meta_file.exists():
-            try:
-                meta = json.loads(meta_file.read_text("utf-8"))
-                job_info.update(meta)
-            except:
-                job_info["filename"] = "unknown"
-                job_info["language"] = "unknown"
-        
-        # Добавляем информацию о файлах
-        job_info["has_transcript"] = transcript_file.exists()
-        job_info["has_summary"] = summary_file.exists()
-        
-        # Добавляем размеры файлов
-        if transcript_file.exists():
-            job_info["transcript_size"] = transcript_file.stat().st_size
-        if summary_file.exists():
-            job_info["summary_size"] = summary_file.stat().st_size
-        
-        # Добавляем время создания (из имени папки или метаданных)
+@app.get("/partial/{job_id}")
+def partial_transcript(
+    job_id: str,
+    offset: int = Query(0, ge=0, description="next_offset из предыдущего ответа"),
+    segment: int = Query(0, ge=0, description="next_segment из предыдущего ответа"),
+    user=Depends(require_auth)
+):
+    """
+    Частичный транскрипт, пока Whisper ещё работает. Возвращает сегменты,
+    дописанные после offset (байтовая позиция в transcript.partial.jsonl),
+    и next_offset для следующего запроса — клиент не скачивает уже полученное.
+
+    После сохранения итогового транскрипта сервер удаляет transcript.partial.jsonl;
+    тогда оставшиеся сегменты (начиная с номера segment — next_segment из
+    предыдущего ответа) берутся из итогового транскрипта порциями по
+    PARTIAL_FINAL_SEGMENTS, а complete приходит с последней порцией.
+    """
+    record = require_job_access(job_id, user)
+    jdir = jobs_dir(job_id)
+    partial_file = jdir / transcript_store.PARTIAL_NAME
+
+    segments = []
+    next_offset = offset
+    partial_size = None
+    try:
+        with partial_file.open("rb") as f:
+            partial_size = os.fstat(f.fileno()).st_size
+            f.seek(offset)
+            while next_offset - offset < PARTIAL_MAX_BYTES:
+                line = f.readline()
+                # Строка без перевода строки ещё дописывается — отдадим её в следующий раз
+                if not line.endswith(b"\n"):
+                    break
+                next_offset += len(line)
+                if line.strip():
+                    segments.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+
+    finished = record["status"] != "transcribing" and record["status"] != "uploaded"
+    complete = finished and (partial_size is None or next_offset >= partial_size)
+    if partial_size is None and finished and record.get("has_transcript"):
         try:
-            # Пытаемся извлечь время из UUID
-            import time
-            timestamp = int(job_id.split('-')[0], 16) / 10000000 - 11644473600
-            job_info["created_at"] = timestamp
-        except:
-            job_info["created_at"] = None
-        
-        jobs.append(job_info)
-    
-    # Сортируем по времени создания (новые сначала)
-    jobs.sort(key=lambda x: x.get("created_at", 0) or 0, reverse=True)
-    
-    return {"jobs": jobs}
+            window = json.loads(transcript_store.render_projection(
+                jdir, text=False, offset=segment, limit=PARTIAL_FINAL_SEGMENTS))
+            segments = window["segments"]
+            complete = window["next_offset"] is None
+        except FileNotFoundError:
+            pass
+
+    return {
+        "job_id": job_id,
+        "status": job_index.PUBLIC_STATUS.get(record["status"], "unknown"),
+        "progress": record.get("progress", 1.0 if finished else 0.0),
+        "segments": segments,
+        "next_offset": next_offset,
+        "next_segment": segments[-1]["id"] + 1 if segments else segment,
+        "complete": complete
+    }
+
+# Поля, которые реально показывают списки истории в веб-клиенте и Android приложении
+HISTORY_DEFAULT_FIELDS = ["job_id", "filename", "status", "language", "created_at",
+                          "has_transcript", "has_summary"]
+HISTORY_EXTRA_FIELDS = ["size", "transcript_size", "summary_size", "updated_at", "progress", "error",
+                        *job_index.STAGE_TIME_FIELDS.values()]
+HISTORY_MAX_LIMIT = int(os.getenv("HISTORY_MAX_LIMIT", "200"))
+HISTORY_PAGE_SIZE = min(50, HISTORY_MAX_LIMIT)
+# Служебные поля записи задачи (дедупликация), которые не отдаются клиентам
+INTERNAL_FIELDS = ("audio_sha256", "deduplicated_from")
+
+def _history_item(record: dict, fields: list) -> dict:
+    """Запись индекса в формате, который ждут клиенты истории"""
+    item = {}
+    for key in fields:
+        if key == "status":
+            item[key] = job_index.PUBLIC_STATUS.get(record.get("status"), "unknown")
+        elif key in ("has_transcript", "has_summary"):
+            item[key] = record.get(key, False)
+        elif key in ("filename", "language"):
+            item[key] = record.get(key, "unknown")
+        elif key in record or key == "created_at":
+            item[key] = record.get(key)
+    return item
+
+@app.get("/history")
+def get_history(
+    limit: Optional[int] = Query(None, ge=1, le=HISTORY_MAX_LIMIT,
+                                 description=f"Размер страницы (по умолчанию {HISTORY_PAGE_SIZE} с cursor)"),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    status: Optional[str] = Query(None, description="Фильтр по статусу"),
+    language: Optional[str] = Query(None, description="Фильтр по языку"),
+    fields: Optional[str] = Query(None, description="Список полей через запятую"),
+    user=Depends(require_auth)
+):
+    """
+    История задач текущего пользователя (новые сначала). Без limit и cursor
+    отдаются все задачи одним ответом, как до постраничного режима (этого ждёт
+    Android-клиент); с limit или cursor — страница и next_cursor.
+    """
+    if limit is None and cursor is not None:
+        limit = HISTORY_PAGE_SIZE
+    if fields:
+        selected = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = set(selected) - set(HISTORY_DEFAULT_FIELDS) - set(HISTORY_EXTRA_FIELDS)
+        if unknown:
+            raise HTTPException(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+        selected = list(dict.fromkeys(["job_id"] + selected))
+    else:
+        selected = HISTORY_DEFAULT_FIELDS
+
+    try:
+        records, next_cursor = job_index.list_jobs(
+            limit=limit, cursor=cursor, status=status, language=language, fields=selected,
+            owner_id=user.id
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    return {
+        "jobs": [_history_item(record, selected) for record in records],
+        "next_cursor": next_cursor
+    }
 
 @app.get("/history/{job_id}")
-def get_job_history(job_id: str, _auth=Depends(require_auth)):
+def get_job_history(job_id: str, request: Request, user=Depends(require_auth)):
     """Получение детальной информации о конкретной задаче"""
+    record = require_job_access(job_id, user)
     jdir = jobs_dir(job_id)
-    if not jdir.exists():
-        raise HTTPException(404, "job not found")
-    
-    job_info = {"job_id": job_id}
     
-    # Загружаем метаданные
-    meta_file = jdir / "meta.json"
-    if meta_file.exists():
-        try:
-            meta = json.loads(meta_file.read_text("utf-8"))
-            job_info.update(meta)
-        except:
-            pass
+    # Метаданные, статус и время этапов — из записи задачи в Redis
+    job_info = {k: v for k, v in record.items() if k not in INTERNAL_FIELDS}
+    job_info["stage"] = record["status"]
+    job_info["status"] = job_index.PUBLIC_STATUS.get(record["status"], "unknown")
+    
+    # ETag — по записи задачи и файлам результатов, без их разбора
+    artifacts = []
+    if record.get("has_transcript"):
+        artifacts.append(transcript_store.path_of(jdir))
+    if record.get("has_summary"):
+        artifacts.append(jdir / "summary.json")
+    finished = record["status"] == "summarized"
+    etag = http_cache.make_etag([p for p in artifacts if p is not None and p.exists()],
+                                json.dumps(job_info, sort_keys=True, default=str))
+    cached = http_cache.not_modified_response(request, etag, finished)
+    if cached is not None:
+        return cached
     
     # Загружаем транскрипт
-    transcript_file = jdir / "transcript.json"
-    if transcript_file.exists():
+    transcript = None
+    if record.get("has_transcript"):
         try:
-            transcript = json.loads(transcript_file.read_text("utf-8"))
-            job_info["transcript"] = transcript
+            transcript = transcript_store.render_json(jdir)
         except:
             job_info["transcript_error"] = "Failed to read transcript"
     
     # Загружаем саммари
     summary_file = jdir / "summary.json"
-    if summary_file.exists():
+    if record.get("has_summary"):
         try:
             summary = json.loads(summary_file.read_text("utf-8"))
             job_info["summary"] = summary
         except:
             job_info["summary_error"] = "Failed to read summary"
     
-    # Определяем статус
-    if summary_file.exists():
-        job_info["status"] = "done"
-    elif transcript_file.exists():
-        job_info["status"] = "transcribed_waiting_summary"
-    else:
-        job_info["status"] = "processing"
-    
-    return job_info
+    return http_cache.respond(request, _json_with_transcript(job_info, transcript), etag, finished)
 
 @app.delete("/history/{job_id}")
-def delete_job(job_id: str, _auth=Depends(require_auth)):
+def delete_job(job_id: str, user=Depends(require_auth)):
     """Удаление задачи и всех связанных файлов"""
+    require_job_access(job_id, user)
     jdir = jobs_dir(job_id)
     if not jdir.exists():
         raise HTTPException(404, "job not found")
     
     try:
-        import shutil
         shutil.rmtree(jdir)
+        job_index.delete_job(job_id)
         return {"message": "Job deleted successfully"}
     except Exception as e:
         raise HTTPException(500, f"Failed to delete job: {str(e)}")
 
 # User management endpoints (только для администраторов)
+@app.get("/cache/stats")
+def cache_stats(admin_user=Depends(require_admin)):
+    """Счётчики попаданий/промахов кэшей обработки (только для администраторов)"""
+    return {"transcripts": dedup.stats(), "summaries": summary_cache.stats()}
+
 @app.get("/users")
-def list_users(admin_user=Depends(require_admin), db: Session = Depends(get_db)):
+async def list_users(admin_user=Depends(require_admin), db: AsyncSession = Depends(get_db)):
     """Получение списка всех пользователей (только для администраторов)"""
     try:
-        users = db.query(User).all()
+        users = (await db.execute(select(User))).scalars().all()
         return {
             "users": [
                 {
@@ -531,9 +707,9 @@ def list_users(admin_user=Depends(require_admin), db: Session = Depends(get_db))
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 @app.delete("/users/{user_id}")
-def delete_user(user_id: int, admin_user=Depends(require_admin), db: Session = Depends(get_db)):
+async def delete_user(user_id: int, admin_user=Depends(require_admin), db: AsyncSession = Depends(get_db)):
     """Удаление пользователя по ID (только для администраторов)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -543,8 +719,10 @@ def delete_user(user_id: int, admin_user=Depends(require_admin), db: Session = D
         raise HTTPException(status_code=400, detail="Нельзя удалить самого себя")
     
     try:
-        db.delete(user)
-        db.commit()
+        username = user.username
+        await db.delete(user)
+        await db.commit()
+        user_cache.invalidate(username)
         return {
             "message": "Пользователь успешно удален",
             "deleted_user": {
@@ -554,13 +732,13 @@ def delete_user(user_id: int, admin_user=Depends(require_admin), db: Session = D
             }
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка при удалении пользователя: {str(e)}")
 
 @app.delete("/users/by-username/{username}")
-def delete_user_by_username(username: str, admin_user=Depends(require_admin), db: Session = Depends(get_db)):
+async def delete_user_by_username(username: str, admin_user=Depends(require_admin), db: AsyncSession = Depends(get_db)):
     """Удаление пользователя по имени пользователя (только для администраторов)"""
-    user = db.query(User).filter(User.username == username).first()
+    user = (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
     
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -570,8 +748,10 @@ def delete_user_by_username(username: str, admin_user=Depends(require_admin), db
         raise HTTPException(status_code=400, detail="Нельзя удалить самого себя")
     
     try:
-        db.delete(user)
-        db.commit()
+        username = user.username
+        await db.delete(user)
+        await db.commit()
+        user_cache.invalidate(username)
         return {
             "message": "Пользователь успешно удален",
             "deleted_user": {
@@ -581,13 +761,13 @@ def delete_user_by_username(username: str, admin_user=Depends(require_admin), db
             }
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка при удалении пользователя: {str(e)}")
 
 @app.patch("/users/{user_id}/deactivate")
-def deactivate_user(user_id: int, admin_user=Depends(require_admin), db: Session = Depends(get_db)):
+async def deactivate_user(user_id: int, admin_user=Depends(require_admin), db: AsyncSession = Depends(get_db)):
     """Деактивация пользователя (мягкое удаление) (только для администраторов)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -598,7 +778,8 @@ def deactivate_user(user_id: int, admin_user=Depends(require_admin), db: Session
     
     try:
         user.is_active = False
-        db.commit()
+        await db.commit()
+        user_cache.invalidate(user.username)
         return {
             "message": "Пользователь деактивирован",
             "user": {
@@ -609,20 +790,21 @@ def deactivate_user(user_id: int, admin_user=Depends(require_admin), db: Session
             }
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка при деактивации пользователя: {str(e)}")
 
 @app.patch("/users/{user_id}/activate")
-def activate_user(user_id: int, admin_user=Depends(require_admin), db: Session = Depends(get_db)):
+async def activate_user(user_id: int, admin_user=Depends(require_admin), db: AsyncSession = Depends(get_db)):
     """Активация пользователя (только для администраторов)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
     try:
         user.is_active = True
-        db.commit()
+        await db.commit()
+        user_cache.invalidate(user.username)
         return {
             "message": "Пользователь активирован",
             "user": {
@@ -633,20 +815,21 @@ def activate_user(user_id: int, admin_user=Depends(require_admin), db: Session =
             }
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка при активации пользователя: {str(e)}")
 
 @app.patch("/users/{user_id}/make-admin")
-def make_admin(user_id: int, admin_user=Depends(require_admin), db: Session = Depends(get_db)):
+async def make_admin(user_id: int, admin_user=Depends(require_admin), db: AsyncSession = Depends(get_db)):
     """Назначение пользователя администратором (только для администраторов)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
     try:
         user.is_admin = True
-        db.commit()
+        await db.commit()
+        user_cache.invalidate(user.username)
         return {
             "message": "Пользователь назначен администратором",
             "user": {
@@ -657,13 +840,13 @@ def make_admin(user_id: int, admin_user=Depends(require_admin), db: Session = De
             }
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка при назначении администратора: {str(e)}")
 
 @app.patch("/users/{user_id}/remove-admin")
-def remove_admin(user_id: int, admin_user=Depends(require_admin), db: Session = Depends(get_db)):
+async def remove_admin(user_id: int, admin_user=Depends(require_admin), db: AsyncSession = Depends(get_db)):
     """Снятие прав администратора (только для администраторов)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -674,7 +857,8 @@ def remove_admin(user_id: int, admin_user=Depends(require_admin), db: Session =
     
     try:
         user.is_admin = False
-        db.commit()
+        await db.commit()
+        user_cache.invalidate(user.username)
         return {
             "message": "Права администратора сняты",
             "user": {
@@ -685,5 +869,5 @@ def remove_admin(user_id: int, admin_user=Depends(require_admin), db: Session =
             }
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка при снятии прав администратора: {str(e)}")
\ No newline at end of file
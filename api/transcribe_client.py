@@ -0,0 +1,112 @@
+"""
+HTTP-клиент API к серверу транскрибации.
+
+Один httpx.AsyncClient на всё приложение: создаётся в lifespan FastAPI,
+держит keep-alive соединения, поэтому загрузка не платит за TCP-рукопожатие
+и настройку пула на каждый запрос.
+
+Клиент помнит состояние сервера: после ошибки соединения или 5xx следующие
+попытки откладываются с экспоненциальной паузой (или на Retry-After из ответа),
+и пока пауза не истекла, API отвечает сразу, не дёргая лежащий сервер.
+"""
+
+import os
+import time
+from typing import Optional
+
+import httpx
+
+TRANSCRIBE_SERVER_URL = os.getenv("TRANSCRIBE_SERVER_URL", "http://worker_transcribe:8002")
+TRANSCRIBE_MAX_CONNECTIONS = int(os.getenv("TRANSCRIBE_MAX_CONNECTIONS", "20"))
+TRANSCRIBE_MAX_KEEPALIVE = int(os.getenv("TRANSCRIBE_MAX_KEEPALIVE", "10"))
+TRANSCRIBE_KEEPALIVE_EXPIRY = float(os.getenv("TRANSCRIBE_KEEPALIVE_EXPIRY", "30"))
+TRANSCRIBE_CONNECT_TIMEOUT = float(os.getenv("TRANSCRIBE_CONNECT_TIMEOUT", "5"))
+TRANSCRIBE_REQUEST_TIMEOUT = float(os.getenv("TRANSCRIBE_REQUEST_TIMEOUT", "30"))
+TRANSCRIBE_BACKOFF_BASE = float(os.getenv("TRANSCRIBE_BACKOFF_BASE", "1"))
+TRANSCRIBE_BACKOFF_MAX = float(os.getenv("TRANSCRIBE_BACKOFF_MAX", "60"))
+
+class TranscribeServerUnavailable(Exception):
+    """Сервер транскрибации недоступен, повторить стоит через retry_after секунд"""
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+_client: Optional[httpx.AsyncClient] = None
+_failures = 0
+_down_until = 0.0
+_last_error = None
+
+async def start():
+    global _client
+    _client = httpx.AsyncClient(
+        base_url=TRANSCRIBE_SERVER_URL,
+        limits=httpx.Limits(
+            max_connections=TRANSCRIBE_MAX_CONNECTIONS,
+            max_keepalive_connections=TRANSCRIBE_MAX_KEEPALIVE,
+            keepalive_expiry=TRANSCRIBE_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(TRANSCRIBE_REQUEST_TIMEOUT, connect=TRANSCRIBE_CONNECT_TIMEOUT),
+    )
+
+async def stop():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+
+def _record_success():
+    global _failures, _down_until, _last_error
+    if _failures:
+        print("Сервер транскрибации снова отвечает")
+    _failures = 0
+    _down_until = 0.0
+    _last_error = None
+
+def _record_failure(error: str, retry_after: float = None):
+    global _failures, _down_until, _last_error
+    _failures += 1
+    if retry_after is None:
+        retry_after = min(TRANSCRIBE_BACKOFF_BASE * 2 ** (_failures - 1), TRANSCRIBE_BACKOFF_MAX)
+    _down_until = time.monotonic() + retry_after
+    _last_error = error
+    print(f"Сервер транскрибации недоступен ({error}), следующая попытка через {retry_after:.0f}s")
+
+def retry_after() -> float:
+    """Сколько секунд ещё действует пауза после ошибки (0 — можно отправлять)"""
+    return max(_down_until - time.monotonic(), 0.0)
+
+def health() -> dict:
+    return {
+        "url": TRANSCRIBE_SERVER_URL,
+        "available": retry_after() == 0,
+        "consecutive_failures": _failures,
+        "retry_after": round(retry_after(), 1),
+        "last_error": _last_error,
+    }
+
+async def post(path: str, **kwargs) -> httpx.Response:
+    """
+    POST к серверу транскрибации через общий пул. Ошибки соединения и 5xx
+    переводят клиент в паузу и поднимают TranscribeServerUnavailable.
+    """
+    wait = retry_after()
+    if wait > 0:
+        raise TranscribeServerUnavailable(f"transcription server unavailable: {_last_error}", wait)
+    if _client is None:
+        raise RuntimeError("transcribe client is not started")
+
+    try:
+        response = await _client.post(path, **kwargs)
+    except httpx.TransportError as e:
+        _record_failure(f"{type(e).__name__}: {e}")
+        raise TranscribeServerUnavailable(f"transcription server unavailable: {e}", retry_after())
+
+    if response.status_code >= 500:
+        header = response.headers.get("Retry-After")
+        _record_failure(f"HTTP {response.status_code}",
+                        float(header) if header and header.isdigit() else None)
+        raise TranscribeServerUnavailable(
+            f"transcription server error {response.status_code}: {response.text[:200]}", retry_after())
+
+    _record_success()
+    return response
@@ -0,0 +1,143 @@
+"""
+Потоковый приём загружаемого аудио (POST /upload).
+
+Тело multipart/form-data разбирается по мере поступления парсером
+python-multipart (тем же, что у Starlette) и пишется сразу в input.<ext>
+задачи через storage.atomic_open, попутно считается SHA-256. С UploadFile
+Starlette сначала складывал весь файл во временный файл, после чего он
+копировался на диск второй раз, а MAX_UPLOAD_SIZE проверялся только после
+получения всего тела. Здесь файл пишется один раз, а загрузка обрывается
+с 413, как только превышен лимит (или сразу — по Content-Length).
+"""
+
+import hashlib
+from contextlib import ExitStack
+from pathlib import Path
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from tasks import storage
+
+FILE_FIELD = "file"
+# Запас на разделители и заголовки частей multipart при проверке Content-Length
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Схема тела для OpenAPI: эндпоинт читает request сам, FastAPI её не выводит
+OPENAPI_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {FILE_FIELD: {"type": "string", "format": "binary"}},
+            "required": [FILE_FIELD],
+        }}},
+    }
+}
+
+def _too_large(max_size: int) -> HTTPException:
+    return HTTPException(413, f"File too large (max {max_size} bytes)")
+
+class _AudioPart:
+    """Колбэки парсера: содержимое поля FILE_FIELD пишется в файл задачи, остальные поля пропускаются"""
+
+    def __init__(self, job_dir: Path, stack: ExitStack, max_size: int):
+        self.job_dir = job_dir
+        self.stack = stack
+        self.max_size = max_size
+        self.headers = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.file = None
+        self.writing = False
+        self.path = None
+        self.filename = None
+        self.size = 0
+        self.digest = hashlib.sha256()
+
+    def on_part_begin(self):
+        self.headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        if options.get(b"name") != FILE_FIELD.encode() or self.file is not None:
+            return
+        self.filename = options.get(b"filename", b"").decode("utf-8", "replace")
+        self.path = self.job_dir / f"input{Path(self.filename).suffix or '.wav'}"
+        # Во временный файл с переименованием в конце: обрыв загрузки не оставит обрезанного input.*
+        self.file = self.stack.enter_context(storage.atomic_open(self.path, "wb"))
+        self.writing = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if not self.writing:
+            return
+        self.size += end - start
+        if self.max_size and self.size > self.max_size:
+            raise _too_large(self.max_size)
+        chunk = data[start:end]
+        self.file.write(chunk)
+        self.digest.update(chunk)
+
+    def on_part_end(self):
+        if self.writing:
+            self.writing = False
+            # Закрывает atomic_open: fsync и переименование во input.<ext>
+            self.stack.close()
+
+async def receive_audio(request: Request, job_dir: Path, max_size: int = 0,
+                        chunk_size: int = 1024 * 1024) -> tuple:
+    """
+    Принимает файл из тела запроса в job_dir. Возвращает (path, filename, size, sha256).
+    max_size — лимит размера файла в байтах, 0 — без ограничения.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(422, "multipart/form-data with a file field is required")
+    length = request.headers.get("content-length")
+    if max_size and length and length.isdigit() and int(length) > max_size + MULTIPART_OVERHEAD:
+        raise _too_large(max_size)
+
+    with ExitStack() as stack:
+        part = _AudioPart(job_dir, stack, max_size)
+        parser = MultipartParser(boundary, {
+            "on_part_begin": part.on_part_begin,
+            "on_header_field": part.on_header_field,
+            "on_header_value": part.on_header_value,
+            "on_header_end": part.on_header_end,
+            "on_headers_finished": part.on_headers_finished,
+            "on_part_data": part.on_part_data,
+            "on_part_end": part.on_part_end,
+        })
+        # Запись на диск и fsync — в пуле потоков, куски тела копятся до chunk_size
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer += chunk
+            if len(buffer) >= chunk_size:
+                await run_in_threadpool(parser.write, bytes(buffer))
+                buffer.clear()
+        await run_in_threadpool(parser.write, bytes(buffer))
+        parser.finalize()
+        if part.writing:
+            # Тело кончилось посреди файла — исключение внутри with, чтобы ExitStack удалил временный файл
+            raise HTTPException(400, "Upload is truncated")
+
+    if part.file is None:
+        raise HTTPException(422, f"{FILE_FIELD} field is required")
+    return part.path, part.filename, part.size, part.digest.hexdigest()
@@ -0,0 +1,88 @@
+"""
+Кэш проверки токенов в памяти процесса API.
+
+require_auth вызывается на каждый опрос статуса, поэтому декодирование JWT
+и запрос пользователя в БД кэшируются:
+    токен    -> subject (username) до истечения exp токена;
+    username -> снимок активного пользователя на AUTH_CACHE_TTL секунд.
+Оба кэша — LRU с ограничением размера AUTH_CACHE_SIZE.
+
+Админские эндпоинты, меняющие пользователя (блокировка, удаление, права),
+вызывают invalidate(username). Кэш у каждого процесса свой, поэтому изменения,
+сделанные в другом процессе (второй воркер uvicorn, manage-скрипты), видны
+не позже чем через AUTH_CACHE_TTL.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+
+# Снимок пользователя, не привязанный к сессии SQLAlchemy
+AuthUser = namedtuple("AuthUser", ["id", "username", "email", "is_active", "is_admin"])
+
+_lock = threading.Lock()
+_users = OrderedDict()   # username -> (AuthUser, expires_at)
+_tokens = OrderedDict()  # token -> (username, expires_at)
+
+def _get(cache: OrderedDict, key):
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    value, expires_at = entry
+    if expires_at <= time.time():
+        del cache[key]
+        return None
+    cache.move_to_end(key)
+    return value
+
+def _put(cache: OrderedDict, key, value, expires_at: float):
+    cache[key] = (value, expires_at)
+    cache.move_to_end(key)
+    while len(cache) > AUTH_CACHE_SIZE:
+        cache.popitem(last=False)
+
+def snapshot(user) -> AuthUser:
+    return AuthUser(user.id, user.username, user.email, bool(user.is_active), bool(user.is_admin))
+
+def get_token_subject(token: str):
+    """Username из ранее проверенного токена или None"""
+    if AUTH_CACHE_TTL <= 0:
+        return None
+    with _lock:
+        return _get(_tokens, token)
+
+def put_token(token: str, username: str, exp=None):
+    if AUTH_CACHE_TTL <= 0:
+        return
+    # Токен живёт в кэше не дольше, чем он действителен
+    expires_at = float(exp) if exp else time.time() + AUTH_CACHE_TTL
+    with _lock:
+        _put(_tokens, token, username, expires_at)
+
+def get_user(username: str):
+    """Снимок активного пользователя или None, если его нет в кэше"""
+    if AUTH_CACHE_TTL <= 0:
+        return None
+    with _lock:
+        return _get(_users, username)
+
+def put_user(user) -> AuthUser:
+    cached = snapshot(user)
+    if AUTH_CACHE_TTL > 0:
+        with _lock:
+            _put(_users, cached.username, cached, time.time() + AUTH_CACHE_TTL)
+    return cached
+
+def invalidate(username: str):
+    """Сбрасывает снимок пользователя после изменения через админские эндпоинты"""
+    with _lock:
+        _users.pop(username, None)
+
+def clear():
+    with _lock:
+        _users.clear()
+        _tokens.clear()
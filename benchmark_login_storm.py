@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест: шторм логинов и задержка остальных эндпоинтов API.
+
+Пока идут параллельные /auth/login (каждый — проверка bcrypt), скрипт
+равномерно опрашивает /healthz и сравнивает его задержку с замером без
+нагрузки. Если bcrypt выполняется в event loop, p95 /healthz во время шторма
+вырастает до сотен миллисекунд; с пулом auth остаётся на уровне базового.
+
+Использование:
+    python benchmark_login_storm.py http://localhost:8000 --logins 200 --concurrency 20
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+import httpx
+
+BENCH_USER = "bench_login_storm"
+BENCH_PASSWORD = "bench-password"
+
+def _report(name: str, latencies: list):
+    if not latencies:
+        print(f"{name}: нет данных")
+        return
+    ordered = sorted(latencies)
+    p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+    print(f"{name}: n={len(ordered)}  p50={statistics.median(ordered) * 1000:.1f} мс  "
+          f"p95={p95 * 1000:.1f} мс  max={ordered[-1] * 1000:.1f} мс")
+
+async def _login(client: httpx.AsyncClient) -> str:
+    response = await client.post("/auth/login", data={"username": BENCH_USER, "password": BENCH_PASSWORD})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+async def _probe(client: httpx.AsyncClient, token: str, latencies: list, stop: asyncio.Event, interval: float):
+    headers = {"Authorization": f"Bearer {token}"}
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get("/healthz", headers=headers)
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+async def run(base_url: str, logins: int, concurrency: int, baseline_seconds: float, interval: float):
+    limits = httpx.Limits(max_connections=concurrency + 5)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        # Пользователь для теста (если уже есть — регистрация вернёт 400)
+        await client.post("/auth/register", data={
+            "username": BENCH_USER, "email": f"{BENCH_USER}@example.com", "password": BENCH_PASSWORD
+        })
+        token = await _login(client)
+
+        print(f"Замер /healthz без нагрузки ({baseline_seconds:.0f}s)...")
+        baseline = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(_probe(client, token, baseline, stop, interval))
+        await asyncio.sleep(baseline_seconds)
+        stop.set()
+        await probe
+
+        print(f"Шторм: {logins} логинов, {concurrency} одновременно...")
+        storm = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(_probe(client, token, storm, stop, interval))
+        login_latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one_login():
+            async with semaphore:
+                started = time.perf_counter()
+                await _login(client)
+                login_latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe
+
+    print()
+    _report("/healthz без нагрузки ", baseline)
+    _report("/healthz во время шторма", storm)
+    _report("/auth/login            ", login_latencies)
+    print(f"Пропускная способность логина: {logins / elapsed:.1f} в секунду")
+
+def main():
+    parser = argparse.ArgumentParser(description="Шторм логинов против API Plaud Local")
+    parser.add_argument("base_url", nargs="?", default="http://localhost:8000")
+    parser.add_argument("--logins", type=int, default=200, help="сколько логинов выполнить")
+    parser.add_argument("--concurrency", type=int, default=20, help="сколько логинов одновременно")
+    parser.add_argument("--baseline", type=float, default=3, help="длительность замера без нагрузки, сек")
+    parser.add_argument("--interval", type=float, default=0.05, help="пауза между запросами /healthz, сек")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run(args.base_url.rstrip("/"), args.logins, args.concurrency, args.baseline, args.interval))
+    except httpx.HTTPError as e:
+        print(f"❌ Ошибка запроса: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -17,7 +17,7 @@ def test_imports():
         from sqlalchemy.orm import Session
         print("   ✅ SQLAlchemy импортирован")
         
-        from database import get_db, init_db
+        from database import get_sync_db, init_db
         print("   ✅ database модуль импортирован")
         
         from models import User
@@ -38,13 +38,13 @@ def test_database():
     try:
         print("2. Тестируем базу данных...")
         
-        from database import get_db, init_db
+        from database import get_sync_db, init_db
         from models import User
         
         init_db()
         print("   ✅ База данных инициализирована")
         
-        db = next(get_db())
+        db = next(get_sync_db())
         users = db.query(User).all()
         print(f"   ✅ Подключение к БД работает, найдено пользователей: {len(users)}")
         
@@ -60,11 +60,11 @@ def test_auth():
     try:
         print("3. Тестируем аутентификацию...")
         
-        from database import get_db
+        from database import get_sync_db
         from models import User
         from auth import verify_password, create_access_token
         
-        db = next(get_db())
+        db = next(get_sync_db())
         user = db.query(User).filter(User.username == "qwe").first()
         
         if not user:
@@ -96,7 +96,7 @@ def test_fastapi_app():
         print("4. Тестируем создание FastAPI приложения...")
         
         from fastapi import FastAPI
-        from database import get_db, init_db
+        from database import get_sync_db, init_db
         from models import User
         from auth import verify_password, get_password_hash, create_access_token, decode_access_token
         from sqlalchemy.orm import Session
@@ -10,7 +10,7 @@ from pathlib import Path
 # Добавляем путь к API модулям
 sys.path.append(str(Path(__file__).parent / "api"))
 
-from database import get_db, init_db, engine
+from database import get_sync_db, init_db, engine
 from models import User
 from sqlalchemy.orm import Session
 from sqlalchemy import text
@@ -47,7 +47,7 @@ def make_user_admin(username: str):
         init_db()
         
         # Получаем сессию базы данных
-        db = next(get_db())
+        db = next(get_sync_db())
         
         # Находим пользователя
         user = db.query(User).filter(User.username == username).first()
@@ -92,7 +92,7 @@ def list_users():
         init_db()
         
         # Получаем сессию базы данных
-        db = next(get_db())
+        db = next(get_sync_db())
         
         # Получаем всех пользователей
         users = db.query(User).all()
@@ -11,6 +11,10 @@ from redis import Redis
 from rq import Queue, Worker, Connection
 from rq.job import Job
 
+from tasks.job_index import rebuild_index, reset_fields
+from tasks import paths, summary_queue
+from tasks.migrate_layout import migrate
+
 # Настройки
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
 DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
@@ -89,6 +93,9 @@ def retry_failed_job(job_id):
         return
     
     print(f"🔄 Повторяю задачу {job_id}...")
+    if job.func_name == summary_queue.FUNC_NAME and job.args:
+        # Ручной повтор суммаризации начинает бюджет попыток заново
+        reset_fields(job.args[0], *summary_queue.RETRY_FIELDS)
     job.requeue()
     print(f"✅ Задача {job_id} добавлена в очередь повторно")
 
@@ -110,7 +117,7 @@ def clear_failed_jobs():
 
 def show_job_files(job_id):
     """Показывает файлы задачи"""
-    job_dir = DATA_DIR / "jobs" / job_id
+    job_dir = paths.job_dir(job_id, DATA_DIR)
     
     if not job_dir.exists():
         print(f"❌ Директория задачи {job_id} не найдена")
@@ -122,6 +129,20 @@ def show_job_files(job_id):
             size = file_path.stat().st_size
             print(f"  {file_path.name}: {size} байт")
 
+def rebuild_job_index():
+    """Перестраивает индекс задач в Redis по содержимому DATA_DIR"""
+    default_owner = input("ID владельца для задач без владельца (Enter — пропустить): ").strip() or None
+    print(f"🔄 Перестраиваю индекс задач по {DATA_DIR / 'jobs'}...")
+    count = rebuild_index(DATA_DIR, default_owner=default_owner)
+    print(f"✅ Индекс перестроен: {count} задач")
+
+def migrate_job_layout():
+    """Переносит задачи из jobs/<job_id> в шарды jobs/ab/cd/<job_id>"""
+    print(f"🔄 Переношу задачи в шардированную раскладку {DATA_DIR / 'jobs'}...")
+    report = migrate(DATA_DIR)
+    print(f"✅ Перенесено: {report['moved']}, пропущено активных: {report['skipped_active']}, "
+          f"конфликтов: {report['conflicts']}")
+
 def main():
     """Главная функция"""
     print("=" * 50)
@@ -136,6 +157,8 @@ def main():
         print("4. Повторить неудачную задачу")
         print("5. Очистить неудачные задачи")
         print("6. Показать файлы задачи")
+        print("7. Перестроить индекс задач")
+        print("8. Перенести задачи в шардированную раскладку")
         print("0. Выход")
         
         choice = input("\nВаш выбор: ").strip()
@@ -160,6 +183,10 @@ def main():
             job_id = input("Введите ID задачи: ").strip()
             if job_id:
                 show_job_files(job_id)
+        elif choice == "7":
+            rebuild_job_index()
+        elif choice == "8":
+            migrate_job_layout()
         elif choice == "0":
             print("👋 До свидания!")
             break
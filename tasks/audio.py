@@ -0,0 +1,130 @@
+"""
+Декодирование аудио для Whisper в памяти, без промежуточного WAV на диске.
+
+ffmpeg пишет 16 кГц mono PCM в stdout, поток читается чанками сразу в
+float32 буфер NumPy, который передаётся в model.transcribe. Таймаут
+декодирования зависит от длительности записи, так что длинные файлы
+не обрываются на фиксированной минуте.
+"""
+
+import os
+import wave
+import subprocess
+import threading
+from pathlib import Path
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Таймаут = база + коэффициент * длительность записи в секундах
+DECODE_TIMEOUT_BASE = float(os.getenv("DECODE_TIMEOUT_BASE", "60"))
+DECODE_TIMEOUT_PER_SECOND = float(os.getenv("DECODE_TIMEOUT_PER_SECOND", "0.5"))
+# Если длительность узнать не удалось
+DECODE_TIMEOUT_UNKNOWN = float(os.getenv("DECODE_TIMEOUT_UNKNOWN", "3600"))
+# Сохранять input_converted.wav рядом с задачей (только для отладки)
+DEBUG_WAV = os.getenv("TRANSCRIBE_DEBUG_WAV", "false").lower() == "true"
+
+def probe_duration(path: Path):
+    """Длительность записи в секундах по ffprobe или None"""
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", str(path)],
+            capture_output=True, text=True, timeout=30
+        )
+        return float(result.stdout.strip())
+    except Exception:
+        return None
+
+def decode_timeout(duration) -> float:
+    if not duration:
+        return DECODE_TIMEOUT_UNKNOWN
+    return DECODE_TIMEOUT_BASE + DECODE_TIMEOUT_PER_SECOND * duration
+
+def _decode_ffmpeg(path: Path, duration=None) -> np.ndarray:
+    timeout = decode_timeout(duration)
+    proc = subprocess.Popen(
+        ["ffmpeg", "-nostdin", "-v", "error", "-i", str(path),
+         "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+
+    # stderr читаем в отдельном потоке, чтобы ffmpeg не встал на заполненном pipe
+    errors = []
+    stderr_reader = threading.Thread(target=lambda: errors.append(proc.stderr.read()), daemon=True)
+    stderr_reader.start()
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+
+    # Буфер заранее размечен по длительности и при необходимости растёт
+    audio = np.empty(int((duration or 60) * SAMPLE_RATE) + SAMPLE_RATE, dtype=np.float32)
+    pos = 0
+    tail = b""
+    try:
+        while True:
+            chunk = proc.stdout.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunk = tail + chunk
+            usable = len(chunk) - len(chunk) % 2
+            tail = chunk[usable:]
+            samples = np.frombuffer(chunk[:usable], dtype=np.int16)
+            if pos + len(samples) > len(audio):
+                audio = np.resize(audio, max(len(audio) * 2, pos + len(samples)))
+            audio[pos:pos + len(samples)] = samples
+            pos += len(samples)
+        proc.wait()
+    finally:
+        timer.cancel()
+        stderr_reader.join(timeout=5)
+
+    if timed_out.is_set():
+        raise TimeoutError(f"ffmpeg decoding timed out after {timeout:.0f}s")
+    if proc.returncode != 0:
+        message = (errors[0] if errors else b"").decode("utf-8", "replace").strip()
+        raise RuntimeError(f"ffmpeg exited with code {proc.returncode}: {message[-500:]}")
+
+    audio = audio[:pos]
+    audio /= 32768.0
+    return audio
+
+def _write_debug_wav(audio: np.ndarray, output_path: Path):
+    with wave.open(str(output_path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes((audio * 32767).astype(np.int16).tobytes())
+
+def decode_audio(path: Path, debug_wav: Path = None) -> np.ndarray:
+    """
+    Декодирует файл в float32 mono 16 кГц. Если ffmpeg недоступен или не смог
+    прочитать файл, пробует встроенный декодер faster-whisper (PyAV).
+    Таймаут ffmpeg не обходится — такая ошибка пробрасывается наверх.
+    При TRANSCRIBE_DEBUG_WAV=true результат дополнительно пишется в debug_wav.
+    """
+    path = Path(path)
+    duration = probe_duration(path)
+    print(f"Декодирую {path} (длительность: {f'{duration:.1f}s' if duration else 'неизвестна'})")
+
+    try:
+        audio = _decode_ffmpeg(path, duration)
+    except TimeoutError:
+        raise
+    except Exception as e:
+        print(f"ffmpeg decode error: {e}, пробую декодер faster-whisper")
+        from faster_whisper import decode_audio as pyav_decode_audio
+        audio = pyav_decode_audio(str(path), sampling_rate=SAMPLE_RATE)
+
+    if DEBUG_WAV and debug_wav is not None:
+        _write_debug_wav(audio, debug_wav)
+        print(f"Отладочный WAV сохранён: {debug_wav}")
+
+    return audio
@@ -0,0 +1,92 @@
+"""
+Дедупликация транскрипций по содержимому аудио.
+
+API считает SHA-256 файла прямо при загрузке и передаёт его серверу
+транскрибации. Готовый транскрипт запоминается в Redis под ключом
+
+    dedup:transcript:<sha256>:<language>:<model>:<compute_type> -> job_id
+
+Если тот же файл загружают ещё раз с теми же параметрами распознавания,
+транскрипт (и резюме, если оно уже есть) копируется из исходной задачи
+вместо повторного прогона Whisper.
+
+Счётчики попаданий/промахов: hash dedup:stats (hits, misses).
+"""
+
+import os
+from pathlib import Path
+
+from tasks import job_index, storage, paths, transcript_store
+
+DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_TTL_DAYS = int(os.getenv("DEDUP_TTL_DAYS", "30"))
+
+STATS_KEY = "dedup:stats"
+
+def cache_key(sha256: str, language: str, model: str, compute_type: str) -> str:
+    return f"dedup:transcript:{sha256}:{language}:{model}:{compute_type}"
+
+def _valid_transcript(job_dir: Path) -> bool:
+    """Транскрипт исходной задачи на месте и не является записью об ошибке"""
+    try:
+        header = transcript_store.read_header(job_dir)
+    except Exception:
+        return False
+    return "error" not in header
+
+def lookup(sha256: str, language: str, model: str, compute_type: str):
+    """
+    Возвращает job_id задачи с готовым транскриптом того же аудио или None.
+    Устаревшие записи (исходную задачу удалили или она упала) удаляются.
+    """
+    if not DEDUP_ENABLED or not sha256:
+        return None
+
+    r = job_index.get_redis()
+    key = cache_key(sha256, language, model, compute_type)
+    source_id = r.get(key)
+    if source_id and not _valid_transcript(paths.job_dir(source_id, DATA_DIR)):
+        r.delete(key)
+        source_id = None
+
+    if source_id:
+        r.expire(key, DEDUP_TTL_DAYS * 86400)
+        r.hincrby(STATS_KEY, "hits", 1)
+    else:
+        r.hincrby(STATS_KEY, "misses", 1)
+    return source_id
+
+def remember(sha256: str, language: str, model: str, compute_type: str, job_id: str):
+    """Запоминает задачу с успешно готовым транскриптом"""
+    if not DEDUP_ENABLED or not sha256:
+        return
+    job_index.get_redis().set(cache_key(sha256, language, model, compute_type), job_id,
+                              ex=DEDUP_TTL_DAYS * 86400)
+
+def copy_results(source_id: str, job_id: str) -> dict:
+    """
+    Копирует transcript.* и summary.* из исходной задачи (атомарно, см.
+    tasks/storage.py). Возвращает поля для индекса задачи.
+    """
+    src = paths.job_dir(source_id, DATA_DIR)
+    dst = paths.job_dir(job_id, DATA_DIR)
+    dst.mkdir(parents=True, exist_ok=True)
+
+    fields = {"deduplicated_from": source_id}
+    for name in (transcript_store.COMPACT_NAME, transcript_store.JSON_NAME, transcript_store.TEXT_NAME,
+                 "summary.json", "summary.txt"):
+        if (src / name).exists():
+            storage.copy_file(src / name, dst / name)
+
+    fields["transcript_size"] = transcript_store.path_of(dst).stat().st_size
+    if (dst / "summary.json").exists():
+        fields["summary_size"] = (dst / "summary.json").stat().st_size
+    return fields
+
+def stats() -> dict:
+    raw = job_index.get_redis().hgetall(STATS_KEY)
+    hits = int(raw.get("hits", 0))
+    misses = int(raw.get("misses", 0))
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": round(hits / total, 4) if total else None}
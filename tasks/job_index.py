@@ -0,0 +1,556 @@
+"""
+Индекс задач в Redis — вместо обхода DATA_DIR/jobs на каждый запрос.
+
+Запись в Redis — единственный источник статуса задачи: она обновляется
+на каждом шаге жизненного цикла (uploaded -> transcribing -> transcribed ->
+summarized, либо error), поэтому /status, /history и /stats читают только
+Redis, а не проверяют наличие файлов транскрипта и резюме.
+
+Переходы проверяются атомарно в Lua по таблице TRANSITIONS: запоздавшее
+или повторное событие воркера не откатит задачу назад (например, из
+summarized в error). При входе в статус записывается его время —
+поле <status>_at (uploaded_at, transcribing_at, ..., error_at).
+
+Ключи:
+  job:<job_id>             — hash с полями задачи
+  <scope>:by_created       — zset job_id -> created_at (история, новые сначала)
+  <scope>:status:<status>  — zset job_id -> created_at для каждого статуса (фильтр истории)
+  <scope>:counts           — hash status -> количество задач (для /stats)
+
+Каждая смена статуса публикуется в канал job:<job_id>:events (Redis pub/sub),
+из которого API отдаёт клиентам поток /events/{job_id}.
+
+Scope — "jobs" для всех задач и "jobs:owner:<user_id>" для задач одного
+пользователя, так что выборка истории пользователя по (owner_id, created_at)
+читает только его zset.
+
+Перестроение индекса по существующим данным (без остановки сервисов:
+записи обновляются по одной, индекс не очищается):
+  python -m tasks.job_index rebuild [--default-owner USER_ID]
+"""
+
+import os
+import sys
+import json
+import time
+from pathlib import Path
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+from tasks import paths
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
+DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
+
+STATUSES = ("uploaded", "transcribing", "transcribed", "summarized", "error")
+
+# Статусы в том виде, в котором их ждут веб-клиент и Android приложение
+PUBLIC_STATUS = {
+    "uploaded": "processing",
+    "transcribing": "processing",
+    "transcribed": "transcribed_waiting_summary",
+    "summarized": "done",
+    "error": "error",
+}
+
+GLOBAL_SCOPE = "jobs"
+
+# Допустимые переходы: статус -> в какие статусы из него можно перейти.
+# Повтор того же статуса — обновление полей (прогресс, откладывание суммаризации).
+# Из error можно перезапустить задачу (manage_jobs.py retry), из summarized — нет.
+TRANSITIONS = {
+    "uploaded": {"transcribing", "transcribed", "error"},
+    "transcribing": {"transcribing", "transcribed", "error"},
+    "transcribed": {"transcribed", "summarized", "error"},
+    "summarized": {"summarized"},
+    "error": {"transcribing", "transcribed", "summarized", "error"},
+}
+
+TERMINAL_STATUSES = ("summarized", "error")
+
+# Время входа в каждый статус
+STAGE_TIME_FIELDS = {status: f"{status}_at" for status in STATUSES}
+
+_INT_FIELDS = {"size", "transcript_size", "summary_size", "partial_segments",
+               "summary_attempts", "llm_retries"}
+_FLOAT_FIELDS = {"created_at", "updated_at", "progress", "summary_retry_at",
+                 *STAGE_TIME_FIELDS.values()}
+_BOOL_FIELDS = {"has_transcript", "has_summary"}
+
+# Общий для скриптов Lua список scope задачи: все задачи + задачи владельца
+_SCOPES_LUA = """
+local scopes = {'jobs'}
+local owner = redis.call('HGET', KEYS[1], 'owner_id')
+if owner then
+    table.insert(scopes, 'jobs:owner:' .. owner)
+end
+"""
+
+# Меняет статус и счётчики атомарно и публикует событие в том же порядке,
+# в каком происходят переходы. Для удалённых задач ничего не делает,
+# чтобы запоздавшее событие воркера не воскресило запись; недопустимый
+# переход (ARGV[4] — список допустимых исходных статусов) возвращает -1.
+_SET_STATUS_LUA = """
+local old = redis.call('HGET', KEYS[1], 'status')
+if not old then
+    return 0
+end
+if not string.find(ARGV[4], ',' .. old .. ',', 1, true) then
+    return -1
+end
+if old ~= ARGV[1] then
+    redis.call('HSET', KEYS[1], ARGV[1] .. '_at', ARGV[5])
+""" + _SCOPES_LUA + """
+    local score = redis.call('HGET', KEYS[1], 'created_at')
+    for _, scope in ipairs(scopes) do
+        redis.call('HINCRBY', scope .. ':counts', old, -1)
+        redis.call('HINCRBY', scope .. ':counts', ARGV[1], 1)
+        redis.call('ZREM', scope .. ':status:' .. old, ARGV[2])
+        redis.call('ZADD', scope .. ':status:' .. ARGV[1], score, ARGV[2])
+    end
+end
+redis.call('HSET', KEYS[1], 'status', ARGV[1], unpack(ARGV, 6))
+redis.call('PUBLISH', 'job:' .. ARGV[2] .. ':events', ARGV[3])
+return 1
+"""
+
+_DELETE_LUA = """
+local old = redis.call('HGET', KEYS[1], 'status')
+if not old then
+    return 0
+end
+""" + _SCOPES_LUA + """
+for _, scope in ipairs(scopes) do
+    redis.call('HINCRBY', scope .. ':counts', old, -1)
+    redis.call('ZREM', scope .. ':by_created', ARGV[1])
+    redis.call('ZREM', scope .. ':status:' .. old, ARGV[1])
+end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+# Пересоздаёт запись задачи по файлам (rebuild_index) атомарно, не удаляя
+# её из индекса. ARGV[2] — поля, не меняющиеся за жизнь задачи (владелец,
+# время создания, имя файла...): пишутся, только если их нет в записи;
+# ARGV[3] — состояние по файлам (статус, наличие и размеры результатов):
+# заменяет прежнее, ARGV[4] — поля состояния, которых по файлам нет (удаляются).
+# Задача убирается из всех zset статусов своих scope и добавляется заново.
+# Счётчики rebuild_index пересчитывает в конце (_RECOUNT_LUA).
+_UPSERT_LUA = """
+local old = redis.call('HGET', KEYS[1], 'status')
+local state = cjson.decode(ARGV[3])
+-- Транскрипция идёт, файлов ещё нет — по ним её не видно, статус не откатывается
+if old == 'transcribing' and state['status'] == 'uploaded' then
+    state['status'] = old
+end
+if old then
+""" + _SCOPES_LUA + """
+    for _, scope in ipairs(scopes) do
+        redis.call('ZREM', scope .. ':by_created', ARGV[1])
+        for status in string.gmatch(ARGV[5], '[^,]+') do
+            redis.call('ZREM', scope .. ':status:' .. status, ARGV[1])
+        end
+    end
+end
+for field, value in pairs(cjson.decode(ARGV[2])) do
+    redis.call('HSETNX', KEYS[1], field, value)
+end
+for _, field in ipairs(cjson.decode(ARGV[4])) do
+    redis.call('HDEL', KEYS[1], field)
+end
+for field, value in pairs(state) do
+    redis.call('HSET', KEYS[1], field, value)
+end
+""" + _SCOPES_LUA + """
+local score = redis.call('HGET', KEYS[1], 'created_at')
+for _, scope in ipairs(scopes) do
+    redis.call('ZADD', scope .. ':by_created', score, ARGV[1])
+    redis.call('ZADD', scope .. ':status:' .. state['status'], score, ARGV[1])
+end
+return 1
+"""
+
+# Счётчики scope (ARGV[1]) по размерам zset статусов
+_RECOUNT_LUA = """
+for i = 2, #ARGV do
+    redis.call('HSET', ARGV[1] .. ':counts', ARGV[i],
+               redis.call('ZCARD', ARGV[1] .. ':status:' .. ARGV[i]))
+end
+return 1
+"""
+
+# Поля записи, которые rebuild_index берёт из файлов задачи, а не из прежней записи
+_REBUILT_STATE_FIELDS = ("status", "updated_at", "has_transcript", "has_summary", "error",
+                         "transcript_size", "transcribed_at", "error_at", "summary_size", "summarized_at")
+
+_redis = None
+_async_redis = None
+
+def get_redis() -> Redis:
+    """Возвращает общее соединение с Redis (с пулом внутри)"""
+    global _redis
+    if _redis is None:
+        _redis = Redis.from_url(REDIS_URL, decode_responses=True)
+    return _redis
+
+def get_async_redis() -> AsyncRedis:
+    """Асинхронное соединение с Redis для подписки на события в API"""
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = AsyncRedis.from_url(REDIS_URL, decode_responses=True)
+    return _async_redis
+
+def events_channel(job_id: str) -> str:
+    return f"job:{job_id}:events"
+
+def event_payload(record: dict) -> dict:
+    """Событие о состоянии задачи в том виде, в каком его получают клиенты"""
+    event = {
+        "job_id": record["job_id"],
+        "status": PUBLIC_STATUS.get(record.get("status"), "unknown"),
+        "stage": record.get("status"),
+    }
+    for key in ("updated_at", "progress", "partial_segments", "error"):
+        if key in record:
+            event[key] = record[key]
+    return event
+
+def _job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+def _scope(owner_id=None) -> str:
+    return f"{GLOBAL_SCOPE}:owner:{owner_id}" if owner_id is not None else GLOBAL_SCOPE
+
+def _scopes_of(record: dict) -> list:
+    scopes = [GLOBAL_SCOPE]
+    if record.get("owner_id") is not None:
+        scopes.append(_scope(record["owner_id"]))
+    return scopes
+
+def _index_record(pipe, record: dict):
+    """Добавляет уже закодированную запись во все её scope"""
+    job_id, created_at, status = record["job_id"], record["created_at"], record["status"]
+    pipe.hset(_job_key(job_id), mapping=record)
+    for scope in _scopes_of(record):
+        pipe.zadd(f"{scope}:by_created", {job_id: created_at})
+        pipe.zadd(f"{scope}:status:{status}", {job_id: created_at})
+        pipe.hincrby(f"{scope}:counts", status, 1)
+
+def statuses_for(name: str) -> set:
+    """Внутренние статусы по имени фильтра (внутреннему или публичному)"""
+    if name in STATUSES:
+        return {name}
+    statuses = {status for status, public in PUBLIC_STATUS.items() if public == name}
+    if not statuses:
+        raise ValueError(f"Unknown job status: {name}")
+    return statuses
+
+def _encode(fields: dict) -> dict:
+    out = {}
+    for key, value in fields.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = int(value)
+        out[key] = value
+    return out
+
+def _decode(record: dict) -> dict:
+    out = {}
+    for key, value in record.items():
+        if key in _INT_FIELDS:
+            out[key] = int(value)
+        elif key in _FLOAT_FIELDS:
+            out[key] = float(value)
+        elif key in _BOOL_FIELDS:
+            out[key] = value == "1"
+        else:
+            out[key] = value
+    return out
+
+def create_job(job_id: str, status: str = "uploaded", **fields):
+    """Добавляет задачу в индекс"""
+    now = time.time()
+    record = {"job_id": job_id, "status": status, "created_at": now, "updated_at": now,
+              "has_transcript": False, "has_summary": False}
+    record.update(fields)
+    record.setdefault(STAGE_TIME_FIELDS[status], record["created_at"])
+
+    pipe = get_redis().pipeline(transaction=True)
+    _index_record(pipe, _encode(record))
+    pipe.execute()
+
+def set_status(job_id: str, status: str, force: bool = False, **fields) -> bool:
+    """
+    Переводит задачу в новый статус и обновляет дополнительные поля.
+    Возвращает False, если задачи нет или переход не допускается TRANSITIONS
+    (тогда запись не меняется и событие не публикуется). force=True пропускает
+    проверку перехода — для восстановления после сбоя (tasks/storage.py).
+    """
+    if status not in STATUSES:
+        raise ValueError(f"Unknown job status: {status}")
+
+    now = time.time()
+    fields["updated_at"] = now
+    allowed_from = [old for old, targets in TRANSITIONS.items() if force or status in targets]
+    event = event_payload({"job_id": job_id, "status": status, **fields})
+    args = [status, job_id, json.dumps(event, ensure_ascii=False), f",{','.join(allowed_from)},", now]
+    for key, value in _encode(fields).items():
+        args.extend([key, value])
+
+    r = get_redis()
+    result = r.eval(_SET_STATUS_LUA, 1, _job_key(job_id), *args)
+    if result == -1:
+        print(f"Задача {job_id}: переход в '{status}' из '{r.hget(_job_key(job_id), 'status')}' "
+              f"не допускается, пропускаю")
+        return False
+    return bool(result)
+
+def increment(job_id: str, field: str, amount: int = 1) -> int:
+    """Увеличивает числовой счётчик задачи (без смены статуса и без события)"""
+    r = get_redis()
+    if not r.exists(_job_key(job_id)):
+        return 0
+    return r.hincrby(_job_key(job_id), field, amount)
+
+def reset_fields(job_id: str, *fields: str):
+    """Удаляет поля задачи (счётчики повторов и т.п.) без смены статуса и без события"""
+    if fields:
+        get_redis().hdel(_job_key(job_id), *fields)
+
+def get_job(job_id: str) -> dict:
+    """Возвращает запись задачи или None"""
+    record = get_redis().hgetall(_job_key(job_id))
+    return _decode(record) if record else None
+
+async def get_job_async(job_id: str) -> dict:
+    """get_job через асинхронное соединение — для корутин API (поток /events)"""
+    record = await get_async_redis().hgetall(_job_key(job_id))
+    return _decode(record) if record else None
+
+def encode_cursor(created_at: float, job_id: str) -> str:
+    return f"{created_at!r}:{job_id}"
+
+def decode_cursor(cursor: str) -> tuple:
+    score, _, job_id = cursor.partition(":")
+    try:
+        return float(score), job_id
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def list_jobs(limit: int = 50, cursor: str = None, status: str = None, language: str = None,
+              fields: list = None, owner_id=None, batch_size: int = 200) -> tuple:
+    """
+    Страница задач, новые сначала. Возвращает (jobs, next_cursor).
+
+    Порядок задаётся created_at из zset, при равных временах — job_id.
+    Фильтр по одному статусу читает свой zset, остальные фильтры
+    применяются к пачкам записей, пока страница не заполнится.
+    fields ограничивает набор читаемых из hash полей, owner_id —
+    задачи одного пользователя (иначе все задачи). limit=None — все
+    подходящие задачи одним списком (next_cursor тогда всегда None).
+    """
+    r = get_redis()
+    scope = _scope(owner_id)
+
+    statuses = statuses_for(status) if status else None
+    key = f"{scope}:by_created"
+    if statuses and len(statuses) == 1:
+        key = f"{scope}:status:{next(iter(statuses))}"
+        statuses = None
+
+    wanted = list(dict.fromkeys(["job_id"] + list(fields or [])))
+    fetch = list(wanted)
+    if statuses and "status" not in fetch:
+        fetch.append("status")
+    if language and "language" not in fetch:
+        fetch.append("language")
+
+    max_score, last_id = decode_cursor(cursor) if cursor else (float("inf"), None)
+
+    jobs = []
+    while limit is None or len(jobs) < limit:
+        # Берём пачку начиная с курсора; записи с тем же временем,
+        # что и курсор, уже отданы, если их job_id не меньше
+        num = batch_size
+        while True:
+            raw = r.zrevrangebyscore(key, max_score, "-inf", start=0, num=num, withscores=True)
+            fresh = [(job_id, score) for job_id, score in raw
+                     if last_id is None or score < max_score or job_id < last_id]
+            if fresh or len(raw) < num:
+                break
+            num *= 2
+
+        if not fresh:
+            return jobs, None
+
+        pipe = r.pipeline(transaction=False)
+        for job_id, _ in fresh:
+            pipe.hmget(_job_key(job_id), fetch)
+        values = pipe.execute()
+
+        for (job_id, score), row in zip(fresh, values):
+            max_score, last_id = score, job_id
+            record = {k: v for k, v in zip(fetch, row) if v is not None}
+            if not record:
+                continue
+            if statuses and record.get("status") not in statuses:
+                continue
+            if language and record.get("language") != language:
+                continue
+            jobs.append(_decode({k: v for k, v in record.items() if k in wanted}))
+            if len(jobs) == limit:
+                return jobs, encode_cursor(score, job_id)
+
+        if len(raw) < num:
+            return jobs, None
+
+    return jobs, None
+
+def job_counts(owner_id=None) -> dict:
+    """Количество задач по статусам (всех или одного пользователя)"""
+    counts = get_redis().hgetall(f"{_scope(owner_id)}:counts")
+    return {status: max(int(counts.get(status, 0)), 0) for status in STATUSES}
+
+def delete_job(job_id: str) -> bool:
+    """Удаляет задачу из индекса"""
+    r = get_redis()
+    return bool(r.eval(_DELETE_LUA, 1, _job_key(job_id), job_id))
+
+def _record_from_dir(job_dir: Path, default_owner=None) -> dict:
+    """Восстанавливает запись индекса по файлам задачи"""
+    from tasks import transcript_store  # transcript_store -> storage -> job_index
+
+    meta = {}
+    meta_file = job_dir / "meta.json"
+    if meta_file.exists():
+        try:
+            meta = json.loads(meta_file.read_text("utf-8"))
+        except Exception:
+            pass
+
+    transcript_file = transcript_store.path_of(job_dir)
+    summary_file = job_dir / "summary.json"
+
+    # Ошибка транскрибации сохраняется как транскрипт с полем error;
+    # transcription_status в meta.json писали старые версии сервера
+    error = meta.get("transcription_error")
+    if transcript_file is not None and not summary_file.exists():
+        try:
+            error = transcript_store.read_header(job_dir).get("error") or error
+        except Exception:
+            pass
+
+    if summary_file.exists():
+        status = "summarized"
+    elif error or meta.get("transcription_status") == "error":
+        status = "error"
+    elif transcript_file is not None:
+        status = "transcribed"
+    elif meta.get("transcription_status") == "processing":
+        status = "transcribing"
+    else:
+        status = "uploaded"
+
+    mtimes = [p.stat().st_mtime for p in job_dir.iterdir() if p.is_file()]
+    created_at = meta.get("created_at") or (min(mtimes) if mtimes else job_dir.stat().st_mtime)
+
+    record = {
+        "job_id": job_dir.name,
+        "status": status,
+        "owner_id": meta.get("owner_id", default_owner),
+        "filename": meta.get("filename"),
+        "language": meta.get("language"),
+        "size": meta.get("size"),
+        "created_at": created_at,
+        "updated_at": max(mtimes) if mtimes else created_at,
+        "has_transcript": transcript_file is not None and status != "error",
+        "has_summary": summary_file.exists(),
+        "error": error,
+        "uploaded_at": created_at,
+        "audio_sha256": meta.get("sha256"),
+    }
+    if transcript_file is not None:
+        stat = transcript_file.stat()
+        record["transcript_size"] = stat.st_size
+        record["error_at" if status == "error" else "transcribed_at"] = stat.st_mtime
+    if summary_file.exists():
+        stat = summary_file.stat()
+        record["summary_size"] = stat.st_size
+        record["summarized_at"] = stat.st_mtime
+    return record
+
+def _upsert_record(r: Redis, record: dict):
+    """Записывает восстановленную по файлам запись задачи в индекс (см. _UPSERT_LUA)"""
+    encoded = {k: str(v) for k, v in _encode(record).items()}
+    identity = {k: v for k, v in encoded.items() if k not in _REBUILT_STATE_FIELDS}
+    state = {k: v for k, v in encoded.items() if k in _REBUILT_STATE_FIELDS}
+    missing = [k for k in _REBUILT_STATE_FIELDS if k not in state]
+    r.eval(_UPSERT_LUA, 1, _job_key(record["job_id"]), record["job_id"],
+           json.dumps(identity), json.dumps(state), json.dumps(missing), ",".join(STATUSES))
+
+def _scopes_in_index(r: Redis) -> list:
+    scopes = set()
+    for key in r.scan_iter(match=f"{GLOBAL_SCOPE}:*", count=1000):
+        if key.endswith(":by_created"):
+            scopes.add(key[:-len(":by_created")])
+        elif key.endswith(":counts"):
+            scopes.add(key[:-len(":counts")])
+    return sorted(scopes)
+
+def _drop_orphans(r: Redis, scope: str, batch_size: int) -> int:
+    """Удаляет из zset scope задачи, записей которых больше нет"""
+    removed = 0
+    for key in [f"{scope}:by_created"] + [f"{scope}:status:{status}" for status in STATUSES]:
+        members = [job_id for job_id, _ in r.zscan_iter(key, count=1000)]
+        for i in range(0, len(members), batch_size):
+            batch = members[i:i + batch_size]
+            pipe = r.pipeline(transaction=False)
+            for job_id in batch:
+                pipe.exists(_job_key(job_id))
+            orphans = [job_id for job_id, exists in zip(batch, pipe.execute()) if not exists]
+            if orphans:
+                r.zrem(key, *orphans)
+                removed += len(orphans)
+    return removed
+
+def rebuild_index(data_dir: Path = DATA_DIR, default_owner=None, batch_size: int = 500) -> int:
+    """
+    Перестраивает индекс по содержимому DATA_DIR/jobs, возвращает число задач.
+    Задачам без owner_id в meta.json назначается default_owner (если задан).
+
+    Индекс не очищается: каждая запись обновляется атомарно по файлам задачи
+    (поля, которых в файлах нет, — число попыток суммаризации и т. п. —
+    сохраняются), затем удаляются записи задач без каталога и их следы в
+    zset, а счётчики пересчитываются. API и воркеры работают во время
+    перестроения и видят либо старую, либо новую запись задачи.
+    """
+    r = get_redis()
+
+    total = 0
+    for job_dir in paths.iter_job_dirs(data_dir):
+        _upsert_record(r, _record_from_dir(job_dir, default_owner))
+        total += 1
+
+    # Записи задач, каталогов которых больше нет
+    for key in r.scan_iter(match="job:*", count=1000):
+        job_id = key[len("job:"):]
+        if ":" not in job_id and not paths.job_dir(job_id, data_dir).exists():
+            delete_job(job_id)
+
+    for scope in _scopes_in_index(r):
+        _drop_orphans(r, scope, batch_size)
+        r.eval(_RECOUNT_LUA, 0, scope, *STATUSES)
+    return total
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["rebuild"]:
+        default_owner = None
+        if "--default-owner" in args:
+            default_owner = args[args.index("--default-owner") + 1]
+        count = rebuild_index(default_owner=default_owner)
+        print(f"Индекс перестроен: {count} задач")
+    else:
+        print("Использование: python -m tasks.job_index rebuild [--default-owner USER_ID]")
+        sys.exit(1)
@@ -0,0 +1,250 @@
+"""
+HTTP-клиент к LLM API для асинхронной суммаризации.
+
+Один httpx.AsyncClient на event loop с пулом соединений (HTTP/2, если
+установлен пакет h2) — десятки одновременных запросов идут по нескольким
+долгоживущим соединениям вместо нового TLS-рукопожатия на каждый запрос.
+
+Глобальный лимит частоты запросов (LLM_RATE_LIMIT в минуту) общий для всех
+воркеров: это GCRA в Redis, ключ llm:rate.
+
+Ответы 408/429/5xx и сетевые ошибки повторяются с экспоненциальной задержкой
+со случайным разбросом (full jitter); Retry-After от провайдера соблюдается.
+Если повторы исчерпаны или провайдер просит ждать дольше LLM_RETRY_MAX_DELAY,
+поднимается LLMRetryableError — задачу стоит отложить, а не ронять.
+
+Circuit breaker общий для всех воркеров (hash llm:breaker): после
+LLM_BREAKER_THRESHOLD подряд неудачных запросов (5xx и сетевые ошибки) запросы
+к провайдеру не отправляются LLM_BREAKER_COOLDOWN секунд. После паузы breaker
+полуоткрыт: пробный запрос отправляет только тот воркер, который атомарно взял
+ключ llm:breaker:probe (SET NX PX), остальные ждут его результата. Успех
+пробы закрывает breaker, неудача снова открывает его на LLM_BREAKER_COOLDOWN.
+"""
+
+import os
+import time
+import uuid
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from tasks import job_index
+
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "0"))  # запросов в минуту на все воркеры, 0 — без лимита
+LLM_RATE_BURST = max(int(os.getenv("LLM_RATE_BURST", "5")), 1)
+
+LLM_MAX_ATTEMPTS = max(int(os.getenv("LLM_MAX_ATTEMPTS", "4")), 1)
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+LLM_BREAKER_THRESHOLD = max(int(os.getenv("LLM_BREAKER_THRESHOLD", "5")), 1)
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "60"))
+
+RATE_KEY = "llm:rate"
+BREAKER_KEY = "llm:breaker"
+PROBE_KEY = "llm:breaker:probe"
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+class LLMRetryableError(Exception):
+    """Временная ошибка провайдера: запрос имеет смысл повторить через retry_after секунд"""
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitOpenError(LLMRetryableError):
+    """Breaker открыт — запрос к провайдеру даже не отправлялся"""
+
+# GCRA: в ключе хранится теоретическое время прихода следующего запроса (мс).
+# Возвращает 0, если запрос можно отправить сейчас, иначе сколько мс подождать.
+_RATE_LUA = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or ARGV[1])
+if tat < now then tat = now end
+local allow_at = tat - burst
+if allow_at > now then return math.ceil(allow_at - now) end
+redis.call('SET', KEYS[1], tat + interval, 'PX', math.ceil(tat + interval - now) + 1000)
+return 0
+"""
+
+# Снимает ключ пробы, только если он всё ещё наш (проба могла истечь и достаться другому)
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+_client = None
+_client_loop = None
+_rate_script = None
+_release_script = None
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def get_client() -> httpx.AsyncClient:
+    """Клиент текущего event loop (у синхронного summarize_job каждый вызов — свой loop)"""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        http2 = LLM_HTTP2 and _http2_available()
+        if LLM_HTTP2 and not http2:
+            print("Пакет h2 не установлен, клиент LLM работает по HTTP/1.1")
+        _client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        )
+        _client_loop = loop
+    return _client
+
+async def aclose():
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+async def acquire_rate_slot():
+    """Ждёт, пока глобальный лимит частоты разрешит очередной запрос"""
+    global _rate_script
+    if LLM_RATE_LIMIT <= 0:
+        return
+    if _rate_script is None:
+        _rate_script = job_index.get_redis().register_script(_RATE_LUA)
+
+    interval = 60000.0 / LLM_RATE_LIMIT
+    while True:
+        wait_ms = float(await asyncio.to_thread(
+            _rate_script, keys=[RATE_KEY], args=[int(time.time() * 1000), interval, interval * (LLM_RATE_BURST - 1)]))
+        if wait_ms <= 0:
+            return
+        await asyncio.sleep(wait_ms / 1000)
+
+def _open_until() -> float:
+    return float(job_index.get_redis().hget(BREAKER_KEY, "open_until") or 0)
+
+def breaker_open_for() -> float:
+    """
+    Сколько секунд не стоит обращаться к провайдеру (0 — можно): пока breaker
+    открыт, и пока в полуоткрытом состоянии идёт чужая проба
+    """
+    open_until = _open_until()
+    if open_until > time.time():
+        return open_until - time.time()
+    if open_until:
+        probe_ms = job_index.get_redis().pttl(PROBE_KEY)
+        if probe_ms > 0:
+            return probe_ms / 1000
+    return 0.0
+
+def _claim_probe(timeout: float):
+    """Токен пробы, если breaker полуоткрыт и проба досталась нам; None — проба у другого"""
+    token = uuid.uuid4().hex
+    if job_index.get_redis().set(PROBE_KEY, token, nx=True, px=int((timeout + 5) * 1000)):
+        return token
+    return None
+
+def _release_probe(token: str):
+    global _release_script
+    if _release_script is None:
+        _release_script = job_index.get_redis().register_script(_RELEASE_LUA)
+    _release_script(keys=[PROBE_KEY], args=[token])
+
+def _record_failure(probe: bool = False):
+    r = job_index.get_redis()
+    failures = r.hincrby(BREAKER_KEY, "failures", 1)
+    if probe or failures >= LLM_BREAKER_THRESHOLD:
+        r.hset(BREAKER_KEY, "open_until", time.time() + LLM_BREAKER_COOLDOWN)
+        reason = "пробный запрос не прошёл" if probe else f"{failures} ошибок подряд"
+        print(f"LLM: {reason}, breaker открыт на {LLM_BREAKER_COOLDOWN:.0f}s")
+
+def _record_success(probe: bool = False):
+    job_index.get_redis().hset(BREAKER_KEY, mapping={"failures": 0, "open_until": 0})
+    if probe:
+        print("LLM: пробный запрос прошёл, breaker закрыт")
+
+def _retry_after(resp: httpx.Response):
+    """Значение заголовка Retry-After в секундах (число или HTTP-дата) или None"""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int, base: float = LLM_RETRY_BASE_DELAY, cap: float = LLM_RETRY_MAX_DELAY) -> float:
+    """Экспоненциальная задержка с full jitter: случайное значение от 0 до base * 2^attempt"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+async def chat_completion(url: str, api_key: str, payload: dict, timeout: float, on_retry=None) -> str:
+    """
+    Отправляет запрос /chat/completions и возвращает текст ответа модели.
+    Временные ошибки повторяются; on_retry(attempt, delay, reason) вызывается
+    (в потоке) перед каждым повтором. Постоянные ошибки (400, 401, ...) поднимаются сразу.
+    Обращения к Redis (breaker, лимит частоты) синхронные — они выполняются
+    через asyncio.to_thread, чтобы не останавливать event loop воркера.
+    """
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        probe = None
+        open_until = await asyncio.to_thread(_open_until)
+        if open_until > time.time():
+            open_for = open_until - time.time()
+            raise CircuitOpenError(f"LLM circuit breaker is open for {open_for:.0f}s", retry_after=open_for)
+        if open_until:
+            # Полуоткрыт: к провайдеру идёт только один пробный запрос на все воркеры
+            probe = await asyncio.to_thread(_claim_probe, timeout)
+            if probe is None:
+                wait = await asyncio.to_thread(breaker_open_for)
+                raise CircuitOpenError("LLM circuit breaker is half-open, probe in flight",
+                                       retry_after=wait or LLM_RETRY_BASE_DELAY)
+
+        try:
+            await acquire_rate_slot()
+            retry_after = None
+            try:
+                resp = await get_client().post(
+                    url,
+                    headers={"Authorization": f"Bearer {api_key}"},
+                    json=payload,
+                    timeout=timeout
+                )
+            except httpx.TransportError as e:
+                reason = f"{type(e).__name__}: {e}"
+                await asyncio.to_thread(_record_failure, probe is not None)
+            else:
+                if resp.status_code not in RETRYABLE_STATUSES:
+                    resp.raise_for_status()
+                    await asyncio.to_thread(_record_success, probe is not None)
+                    return resp.json()["choices"][0]["message"]["content"].strip()
+
+                reason = f"HTTP {resp.status_code}"
+                retry_after = _retry_after(resp)
+                if resp.status_code >= 500:
+                    await asyncio.to_thread(_record_failure, probe is not None)
+        finally:
+            if probe is not None:
+                _release_probe(probe)  # и при отмене задачи — поэтому без await
+
+        delay = retry_after + random.uniform(0, LLM_RETRY_BASE_DELAY) if retry_after is not None \
+            else backoff_delay(attempt)
+        if attempt == LLM_MAX_ATTEMPTS - 1 or delay > LLM_RETRY_MAX_DELAY:
+            raise LLMRetryableError(f"LLM request failed after {attempt + 1} attempts: {reason}",
+                                    retry_after=delay)
+
+        print(f"LLM: {reason}, повтор {attempt + 1}/{LLM_MAX_ATTEMPTS - 1} через {delay:.1f}s")
+        if on_retry is not None:
+            await asyncio.to_thread(on_retry, attempt + 1, delay, reason)
+        await asyncio.sleep(delay)
@@ -0,0 +1,78 @@
+"""
+Перенос задач из плоской раскладки jobs/<job_id> в шарды jobs/ab/cd/<job_id>.
+
+Работает без остановки сервисов: каталог задачи переносится одним
+os.rename (атомарно в пределах файловой системы), а все модули находят
+каталог через tasks.paths.job_dir, который смотрит и в шарды, и в старое
+место. Переносятся только завершённые задачи (summarized/error), которые
+не менялись последние --min-idle секунд, и задачи без записи в индексе —
+чтобы не выдернуть каталог из-под воркера, который в него пишет. Задачи,
+пропущенные сейчас, переносятся следующим запуском.
+
+Запуск:
+    python -m tasks.migrate_layout [--dry-run] [--min-idle 300] [--pause 0]
+"""
+
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+
+from tasks import job_index, paths
+
+DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
+
+def _is_idle(job_dir: Path, record: dict, min_idle: float, now: float) -> bool:
+    if record is None:
+        updated_at = job_dir.stat().st_mtime
+    elif record["status"] not in job_index.TERMINAL_STATUSES:
+        return False
+    else:
+        updated_at = record.get("updated_at", 0)
+    return now - updated_at >= min_idle
+
+def migrate(data_dir: Path = DATA_DIR, min_idle: float = 300, pause: float = 0,
+            dry_run: bool = False) -> dict:
+    """Переносит задачи в шарды, возвращает {"moved", "skipped_active", "conflicts"}"""
+    report = {"moved": 0, "skipped_active": 0, "conflicts": 0}
+    for legacy in list(paths.iter_legacy_dirs(data_dir)):
+        job_id = legacy.name
+        if not _is_idle(legacy, job_index.get_job(job_id), min_idle, time.time()):
+            report["skipped_active"] += 1
+            continue
+
+        target = paths.sharded_dir(job_id, data_dir)
+        if target.exists():
+            print(f"⚠️  {job_id}: {target} уже существует, пропускаю")
+            report["conflicts"] += 1
+            continue
+
+        if not dry_run:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(legacy, target)
+        report["moved"] += 1
+        if report["moved"] % 1000 == 0:
+            print(f"  перенесено {report['moved']}...")
+        if pause:
+            time.sleep(pause)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос задач в шардированную раскладку jobs/ab/cd/<job_id>")
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать")
+    parser.add_argument("--min-idle", type=float, default=300,
+                        help="сколько секунд задача должна быть без изменений")
+    parser.add_argument("--pause", type=float, default=0, help="пауза между переносами, сек")
+    args = parser.parse_args()
+
+    report = migrate(DATA_DIR, args.min_idle, args.pause, args.dry_run)
+    action = "Будет перенесено" if args.dry_run else "Перенесено"
+    print(f"{action}: {report['moved']}, пропущено активных: {report['skipped_active']}, "
+          f"конфликтов: {report['conflicts']}")
+    if report["skipped_active"]:
+        print("Активные задачи будут перенесены следующим запуском")
+    sys.exit(1 if report["conflicts"] else 0)
+
+if __name__ == "__main__":
+    main()
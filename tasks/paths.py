@@ -0,0 +1,64 @@
+"""
+Раскладка каталогов задач в DATA_DIR.
+
+Задачи лежат в шардированных каталогах jobs/ab/cd/<job_id> (ab и cd — первые
+символы job_id), чтобы в одном каталоге не копились сотни тысяч записей.
+Старая плоская раскладка jobs/<job_id> продолжает читаться: job_dir()
+возвращает её, пока задача не перенесена командой
+    python -m tasks.migrate_layout
+Новые задачи создаются сразу в шардах.
+"""
+
+import os
+from pathlib import Path
+
+DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
+
+SHARD_WIDTH = 2
+
+def jobs_root(data_dir: Path = None) -> Path:
+    return (data_dir or DATA_DIR) / "jobs"
+
+def sharded_dir(job_id: str, data_dir: Path = None) -> Path:
+    key = job_id.ljust(SHARD_WIDTH * 2, "_")
+    return jobs_root(data_dir) / key[:SHARD_WIDTH] / key[SHARD_WIDTH:SHARD_WIDTH * 2] / job_id
+
+def legacy_dir(job_id: str, data_dir: Path = None) -> Path:
+    return jobs_root(data_dir) / job_id
+
+def job_dir(job_id: str, data_dir: Path = None) -> Path:
+    """Каталог задачи: шардированный, либо плоский для ещё не перенесённой задачи"""
+    sharded = sharded_dir(job_id, data_dir)
+    if sharded.exists():
+        return sharded
+    legacy = legacy_dir(job_id, data_dir)
+    if legacy.is_dir():
+        return legacy
+    return sharded
+
+def is_shard_name(name: str) -> bool:
+    return len(name) == SHARD_WIDTH
+
+def iter_legacy_dirs(data_dir: Path = None):
+    """Каталоги задач в старой плоской раскладке"""
+    root = jobs_root(data_dir)
+    if not root.exists():
+        return
+    for entry in root.iterdir():
+        if entry.is_dir() and not is_shard_name(entry.name):
+            yield entry
+
+def iter_job_dirs(data_dir: Path = None):
+    """Все каталоги задач — в шардах и в плоской раскладке"""
+    root = jobs_root(data_dir)
+    if not root.exists():
+        return
+    for entry in root.iterdir():
+        if not entry.is_dir():
+            continue
+        if not is_shard_name(entry.name):
+            yield entry
+            continue
+        for second in entry.iterdir():
+            if second.is_dir():
+                yield from (job for job in second.iterdir() if job.is_dir())
@@ -0,0 +1,259 @@
+"""
+Сборка мусора в DATA_DIR: удаление файлов задач по срокам хранения.
+
+Что удаляется:
+  input_converted.wav  — отладочный WAV, сразу после окончания транскрипции
+                         (RETENTION_CONVERTED_WAV_HOURS, по умолчанию 0);
+  transcript.partial.jsonl — промежуточные сегменты, оставшиеся от задач,
+                         обработанных до того, как сервер начал удалять их сам;
+  .*.tmp в каталоге    — брошенные временные файлы атомарной записи
+                         (старше STORAGE_TMP_MAX_AGE, см. tasks/storage.py);
+  input.*              — исходное аудио успешно завершённой задачи через
+                         RETENTION_AUDIO_DAYS дней (по умолчанию 0 — хранить
+                         всегда, удаление включается явно); аудио задач с
+                         ошибкой не удаляется — оно нужно для повтора, а
+                         задача запоминается в gc:audio:pending и её аудио
+                         удаляется, когда повтор завершится успешно;
+  plaud-upload-*       — копии загрузок во временном каталоге сервера
+                         транскрибации, на которые не ссылается очередь
+                         (старше GC_TMP_MAX_AGE).
+Транскрипты и резюме не удаляются.
+
+Задачи обходятся по индексу (jobs:by_created) в порядке создания, а не
+обходом DATA_DIR: для каждого правила в Redis хранится курсор — время
+создания задачи, до которой всё уже убрано, поэтому каждый проход смотрит
+только новые задачи. Число файловых операций в секунду ограничено
+GC_MAX_OPS_PER_SEC, чтобы GC не отнимал диск у транскрипции.
+
+Освобождённое место копится в hash gc:stats (его показывает /queue
+сервера транскрибации) и печатается после каждого прохода.
+
+Запуск: поток в сервере транскрибации (GC_ENABLED) или вручную
+    python -m tasks.retention [--once]
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+from pathlib import Path
+
+from tasks import job_index, paths, storage, transcript_store
+
+DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
+GC_ENABLED = os.getenv("GC_ENABLED", "true").lower() == "true"
+GC_INTERVAL = float(os.getenv("GC_INTERVAL", "3600"))
+GC_MAX_OPS_PER_SEC = float(os.getenv("GC_MAX_OPS_PER_SEC", "200"))  # 0 — без ограничения
+GC_TMP_MAX_AGE = float(os.getenv("GC_TMP_MAX_AGE", str(24 * 3600)))
+RETENTION_AUDIO_DAYS = float(os.getenv("RETENTION_AUDIO_DAYS", "0"))
+RETENTION_CONVERTED_WAV_HOURS = float(os.getenv("RETENTION_CONVERTED_WAV_HOURS", "0"))
+# Задача, которая столько времени не вышла из uploaded/transcribing, считается брошенной
+GC_STUCK_AFTER = float(os.getenv("GC_STUCK_AFTER", str(24 * 3600)))
+
+UPLOAD_TMP_PREFIX = "plaud-upload-"
+UPLOAD_TMP_DIR = Path(os.getenv("TRANSCRIBE_TMP_DIR", tempfile.gettempdir()))
+
+PAYLOAD_KEY = "transcribe:payload"  # очередь сервера транскрибации (workers/transcribe/server.py)
+CURSOR_KEY = "gc:cursor"   # hash правило -> created_at последней обработанной задачи
+# zset job_id -> created_at: курсор правила audio прошёл эти задачи (ошибка или зависшая
+# транскрипция), а их аудио оставлено до успешного повтора
+AUDIO_PENDING_KEY = "gc:audio:pending"
+STATS_KEY = "gc:stats"
+LOCK_KEY = "gc:lock"
+BATCH_SIZE = 500
+
+KINDS = ("converted_wav", "partial", "tmp", "audio", "upload_tmp")
+
+class Throttle:
+    """Не больше rate файловых операций в секунду"""
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = time.monotonic()
+
+    def tick(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+        self.next_at = max(self.next_at, now) + self.interval
+
+def _new_report() -> dict:
+    return {"files": 0, "bytes": 0, **{f"{kind}_bytes": 0 for kind in KINDS}}
+
+def _remove(path: Path, kind: str, report: dict, throttle: Throttle, dry_run: bool):
+    throttle.tick()
+    try:
+        size = path.stat().st_size
+        if not dry_run:
+            path.unlink()
+    except FileNotFoundError:
+        return
+    report["files"] += 1
+    report["bytes"] += size
+    report[f"{kind}_bytes"] += size
+
+def _finished_transcribing(record: dict, now: float) -> bool:
+    if record["status"] not in ("uploaded", "transcribing"):
+        return True
+    return now - record.get("updated_at", 0) >= GC_STUCK_AFTER
+
+def _sweep(rule: str, max_created: float, handle, throttle: Throttle, dry_run: bool = False) -> int:
+    """
+    Вызывает handle(job_id, record) для задач, созданных после курсора правила
+    и не позже max_created. handle возвращает False, если задачу пока трогать
+    рано, — тогда курсор останавливается на ней до следующего прохода.
+    """
+    r = job_index.get_redis()
+    cursor = float(r.hget(CURSOR_KEY, rule) or 0)
+    seen = 0
+    while True:
+        items = r.zrangebyscore(f"{job_index.GLOBAL_SCOPE}:by_created", f"({cursor!r}", max_created,
+                                start=0, num=BATCH_SIZE, withscores=True)
+        for job_id, created_at in items:
+            record = job_index.get_job(job_id)
+            if record is not None:
+                throttle.tick()
+                if not handle(job_id, record):
+                    if not dry_run:
+                        r.hset(CURSOR_KEY, rule, repr(cursor))
+                    return seen
+            cursor = created_at
+            seen += 1
+        if not dry_run:
+            r.hset(CURSOR_KEY, rule, repr(cursor))
+        if len(items) < BATCH_SIZE:
+            return seen
+
+def collect_jobs(report: dict, throttle: Throttle, data_dir: Path = DATA_DIR, dry_run: bool = False):
+    """Проходы по задачам: отладочный WAV и временные файлы, затем исходное аудио"""
+    now = time.time()
+
+    def after_transcription(job_id: str, record: dict) -> bool:
+        if not _finished_transcribing(record, now):
+            return False
+        if now - record.get("updated_at", 0) < RETENTION_CONVERTED_WAV_HOURS * 3600:
+            return False
+        job_dir = paths.job_dir(job_id, data_dir)
+        if not job_dir.is_dir():
+            return True
+        for path in job_dir.iterdir():
+            if path.name == "input_converted.wav":
+                _remove(path, "converted_wav", report, throttle, dry_run)
+            elif path.name == transcript_store.PARTIAL_NAME:
+                _remove(path, "partial", report, throttle, dry_run)
+            elif path.name.startswith(".") and path.name.endswith(storage.TMP_SUFFIX):
+                if now - path.stat().st_mtime > storage.STORAGE_TMP_MAX_AGE:
+                    _remove(path, "tmp", report, throttle, dry_run)
+        return True
+
+    def expired_audio(job_id: str, record: dict) -> bool:
+        if not _finished_transcribing(record, now):
+            return False
+        # Задачу с ошибкой повторяют (manage_jobs.py, восстановление после сбоя) — по исходному аудио.
+        # Курсор её проходит, а повтор проверяется по gc:audio:pending
+        if record["status"] in ("error", "uploaded", "transcribing"):
+            if not dry_run:
+                job_index.get_redis().zadd(AUDIO_PENDING_KEY, {job_id: record["created_at"]})
+            return True
+        input_path = storage.find_input(paths.job_dir(job_id, data_dir))
+        if input_path is not None:
+            _remove(input_path, "audio", report, throttle, dry_run)
+        return True
+
+    _sweep("converted_wav", now, after_transcription, throttle, dry_run)
+    if RETENTION_AUDIO_DAYS > 0:
+        _sweep("audio", now - RETENTION_AUDIO_DAYS * 86400, expired_audio, throttle, dry_run)
+        collect_pending_audio(report, throttle, data_dir, dry_run)
+
+def collect_pending_audio(report: dict, throttle: Throttle, data_dir: Path = DATA_DIR, dry_run: bool = False):
+    """Аудио задач из gc:audio:pending, которые после повтора завершились успешно"""
+    r = job_index.get_redis()
+    for job_id, _ in list(r.zscan_iter(AUDIO_PENDING_KEY, count=BATCH_SIZE)):
+        throttle.tick()
+        record = job_index.get_job(job_id)
+        if record is not None and record["status"] in ("error", "uploaded", "transcribing"):
+            continue
+        if record is not None:
+            input_path = storage.find_input(paths.job_dir(job_id, data_dir))
+            if input_path is not None:
+                _remove(input_path, "audio", report, throttle, dry_run)
+        if not dry_run:
+            r.zrem(AUDIO_PENDING_KEY, job_id)
+
+def _queued_uploads() -> set:
+    paths_in_queue = set()
+    for raw in job_index.get_redis().hvals(PAYLOAD_KEY):
+        try:
+            paths_in_queue.add(json.loads(raw)["path"])
+        except (ValueError, KeyError):
+            pass
+    return paths_in_queue
+
+def collect_upload_tmp(report: dict, throttle: Throttle, dry_run: bool = False):
+    """Копии загрузок сервера транскрибации, на которые не ссылается очередь"""
+    now = time.time()
+    referenced = _queued_uploads()
+    for path in UPLOAD_TMP_DIR.glob(f"{UPLOAD_TMP_PREFIX}*"):
+        throttle.tick()
+        try:
+            if str(path) in referenced or now - path.stat().st_mtime < GC_TMP_MAX_AGE:
+                continue
+        except FileNotFoundError:
+            continue
+        _remove(path, "upload_tmp", report, throttle, dry_run)
+
+def run_once(data_dir: Path = DATA_DIR, dry_run: bool = False) -> dict:
+    """Один проход GC, возвращает отчёт об освобождённом месте"""
+    report = _new_report()
+    throttle = Throttle(GC_MAX_OPS_PER_SEC)
+    started = time.monotonic()
+
+    # Задачи общие для всех серверов — их убирает тот, кто взял блокировку
+    r = job_index.get_redis()
+    if dry_run or r.set(LOCK_KEY, "1", nx=True, ex=max(int(GC_INTERVAL), 60)):
+        collect_jobs(report, throttle, data_dir, dry_run)
+    # Временный каталог у каждого сервера свой
+    collect_upload_tmp(report, throttle, dry_run)
+
+    report["seconds"] = round(time.monotonic() - started, 1)
+    if not dry_run and report["files"]:
+        pipe = r.pipeline(transaction=False)
+        for key in ("files", "bytes", *(f"{kind}_bytes" for kind in KINDS)):
+            pipe.hincrby(STATS_KEY, key, report[key])
+        pipe.hset(STATS_KEY, mapping={"last_run_at": time.time(), "last_reclaimed_bytes": report["bytes"]})
+        pipe.execute()
+    return report
+
+def stats() -> dict:
+    raw = job_index.get_redis().hgetall(STATS_KEY)
+    out = {key: int(raw.get(key, 0)) for key in ("files", "bytes", *(f"{kind}_bytes" for kind in KINDS))}
+    out["last_run_at"] = float(raw["last_run_at"]) if "last_run_at" in raw else None
+    out["last_reclaimed_bytes"] = int(raw.get("last_reclaimed_bytes", 0))
+    return out
+
+def format_report(report: dict) -> str:
+    mb = lambda n: f"{n / 1024 / 1024:.1f} МБ"
+    return (f"GC: удалено файлов {report['files']}, освобождено {mb(report['bytes'])} "
+            f"(аудио {mb(report['audio_bytes'])}, WAV {mb(report['converted_wav_bytes'])}, "
+            f"временные {mb(report['tmp_bytes'] + report['upload_tmp_bytes'] + report['partial_bytes'])}) "
+            f"за {report['seconds']}s")
+
+def run_forever():
+    while True:
+        try:
+            report = run_once()
+            if report["files"]:
+                print(format_report(report))
+        except Exception as e:
+            print(f"Ошибка GC: {e}")
+        time.sleep(GC_INTERVAL)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    dry_run = "--dry-run" in args
+    if "--once" in args or dry_run:
+        print(format_report(run_once(dry_run=dry_run)))
+    else:
+        run_forever()
@@ -0,0 +1,145 @@
+"""
+Атомарная запись файлов задачи и проверка после сбоя.
+
+Артефакты (transcript.*, summary.*, meta.json, загруженное аудио) пишутся
+во временный файл рядом с целевым, затем fsync и os.replace — читатель видит
+либо старую версию файла, либо новую целиком, но никогда не обрезанную.
+STORAGE_FSYNC=false отключает fsync (быстрее, но после падения ОС файл может
+оказаться пустым — для тестовых стендов).
+
+check_jobs() проходит по каталогам задач после перезапуска: удаляет брошенные
+временные файлы и находит задачи, чей статус в индексе говорит «готово», а
+транскрипт/summary.json отсутствуют или не совпадают по размеру с
+записанным в индекс (обрезаны при сбое до перехода на атомарную запись).
+Что с ними делать, решает вызывающий (сервер транскрибации ставит их заново
+в очередь).
+"""
+
+import os
+import json
+import time
+import uuid
+from pathlib import Path
+from contextlib import contextmanager
+
+from tasks import job_index, paths
+
+DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
+STORAGE_FSYNC = os.getenv("STORAGE_FSYNC", "true").lower() == "true"
+# Временные файлы моложе этого возраста могут дописываться прямо сейчас
+STORAGE_TMP_MAX_AGE = float(os.getenv("STORAGE_TMP_MAX_AGE", "3600"))
+
+TMP_SUFFIX = ".tmp"
+
+def _tmp_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}{TMP_SUFFIX}")
+
+def fsync_dir(path: Path):
+    """Сбрасывает на диск запись каталога (сам rename)"""
+    if not STORAGE_FSYNC:
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_open(path: Path, mode: str = "w", encoding: str = None):
+    """
+    Открывает временный файл; при успешном выходе из блока он сбрасывается
+    на диск и переименовывается в path, при исключении — удаляется.
+    """
+    path = Path(path)
+    tmp = _tmp_path(path)
+    if "b" not in mode and encoding is None:
+        encoding = "utf-8"
+    f = open(tmp, mode, encoding=encoding)
+    try:
+        yield f
+        f.flush()
+        if STORAGE_FSYNC:
+            os.fsync(f.fileno())
+        f.close()
+        os.replace(tmp, path)
+    except BaseException:
+        f.close()
+        tmp.unlink(missing_ok=True)
+        raise
+    fsync_dir(path.parent)
+
+def write_bytes(path: Path, data: bytes):
+    with atomic_open(path, "wb") as f:
+        f.write(data)
+
+def write_text(path: Path, text: str, encoding: str = "utf-8"):
+    with atomic_open(path, "w", encoding=encoding) as f:
+        f.write(text)
+
+def write_json(path: Path, data):
+    write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+
+def copy_file(src: Path, dst: Path, chunk_size: int = 1024 * 1024):
+    with open(src, "rb") as fin, atomic_open(dst, "wb") as fout:
+        while True:
+            chunk = fin.read(chunk_size)
+            if not chunk:
+                break
+            fout.write(chunk)
+
+def find_input(job_dir: Path):
+    """Загруженное аудио задачи (input.<ext>) или None"""
+    for path in job_dir.glob("input.*"):
+        if path.is_file():
+            return path
+    return None
+
+def _intact(path: Path, expected_size, parse=None) -> bool:
+    """Файл есть и совпадает с размером из индекса; без размера — разбирается parse (по умолчанию как JSON)"""
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        return False
+    if expected_size is not None:
+        return size == expected_size
+    try:
+        if parse is not None:
+            parse(path)
+        else:
+            json.loads(path.read_text("utf-8"))
+        return True
+    except Exception:
+        return False
+
+def check_jobs(data_dir: Path = DATA_DIR, on_job=None) -> dict:
+    """
+    Проверка после перезапуска. Возвращает
+    {"tmp_removed": N, "retranscribe": [job_id, ...], "resummarize": [job_id, ...]}.
+    on_job(job_id) вызывается перед проверкой каждого каталога (например, чтобы
+    продлевать блокировку при долгом обходе); исключение из него прерывает обход.
+    """
+    from tasks import transcript_store  # transcript_store пишет через этот модуль
+
+    report = {"tmp_removed": 0, "retranscribe": [], "resummarize": []}
+    now = time.time()
+    for job_dir in paths.iter_job_dirs(data_dir):
+        if on_job is not None:
+            on_job(job_dir.name)
+        for tmp in job_dir.glob(f".*{TMP_SUFFIX}"):
+            try:
+                if now - tmp.stat().st_mtime > STORAGE_TMP_MAX_AGE:
+                    tmp.unlink()
+                    report["tmp_removed"] += 1
+            except FileNotFoundError:
+                pass
+
+        record = job_index.get_job(job_dir.name)
+        if not record or record["status"] not in ("transcribed", "summarized"):
+            continue
+        transcript_file = transcript_store.path_of(job_dir) or job_dir / transcript_store.COMPACT_NAME
+        if not _intact(transcript_file, record.get("transcript_size"), transcript_store.load_file):
+            report["retranscribe"].append(job_dir.name)
+        elif record["status"] == "summarized" and \
+                not _intact(job_dir / "summary.json", record.get("summary_size")):
+            report["resummarize"].append(job_dir.name)
+    return report
@@ -1,16 +1,54 @@
-import os, json, requests
+import os, json, time, asyncio, contextvars
 from pathlib import Path
 
+from tasks import job_index, summary_cache, llm, storage, paths, transcript_store, summary_queue
+
 DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_MODEL   = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
 
-API_URL = "https://api.deepseek.com/v1/chat/completions"
+# Можно направить на локальную заглушку: workers/summarize/stub_llm.py
+API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+SUMMARY_REQUEST_TIMEOUT = float(os.getenv("SUMMARY_REQUEST_TIMEOUT", "90"))
+
+# Длинные транскрипты суммаризируются map-reduce: текст режется по границам
+# сегментов на окна не длиннее SUMMARY_WINDOW_TOKENS, окна суммаризируются
+# параллельно (до SUMMARY_MAP_CONCURRENCY запросов на задачу), затем частичные резюме
+# сливаются в одно. Токены оцениваются грубо — по числу символов.
+SUMMARY_WINDOW_TOKENS = int(os.getenv("SUMMARY_WINDOW_TOKENS", "8000"))
+SUMMARY_MAP_CONCURRENCY = max(int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4")), 1)
+# Сколько уровней группового слияния допускается, прежде чем слить всё одним урезанным запросом
+SUMMARY_MAX_MERGE_LEVELS = max(int(os.getenv("SUMMARY_MAX_MERGE_LEVELS", "3")), 1)
+CHARS_PER_TOKEN = 3
+
+# Временные сбои LLM (повторы внутри запроса исчерпаны, breaker открыт) не роняют
+# задачу: она откладывается в zset sum:delayed и через паузу возвращается в очередь
+# асинхронным воркером. После SUMMARY_MAX_ATTEMPTS запусков задача помечается ошибкой.
+SUMMARY_MAX_ATTEMPTS = max(int(os.getenv("SUMMARY_MAX_ATTEMPTS", "8")), 1)
+SUMMARY_RETRY_BASE_DELAY = float(os.getenv("SUMMARY_RETRY_BASE_DELAY", "30"))
+SUMMARY_RETRY_MAX_DELAY = float(os.getenv("SUMMARY_RETRY_MAX_DELAY", "1800"))
+DELAYED_KEY = "sum:delayed"  # zset job_id -> время, когда вернуть задачу в очередь
+
+_current_job = contextvars.ContextVar("summary_job_id", default=None)
 
 def _jdir(job_id: str) -> Path:
-    d = DATA_DIR / "jobs" / job_id
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+    # Без mkdir: суммаризация удалённой задачи не должна воскрешать её каталог
+    return paths.job_dir(job_id, DATA_DIR)
+
+# Версии шаблонов промптов входят в ключ кэша резюме (tasks/summary_cache.py).
+# Поднимать версию при любом изменении соответствующего шаблона, иначе вернутся старые ответы.
+PROMPT_VERSION = "ru-v1"
+MAP_PROMPT_VERSION = "ru-map-v1"
+MERGE_PROMPT_VERSION = "ru-merge-v1"
+
+SUMMARY_SCHEMA = (
+    "{\n"
+    "  \"meeting_summary\": \"...\",\n"
+    "  \"key_points\": [\"...\"],\n"
+    "  \"action_items\": [{\"owner\":\"\",\"task\":\"\",\"due\":\"\"}],\n"
+    "  \"risks\": [\"...\"]\n"
+    "}"
+)
 
 def _make_prompt_ru(transcript_text: str) -> list:
     system = (
@@ -37,28 +75,294 @@ def _make_prompt_ru(transcript_text: str) -> list:
         {"role": "user", "content": user},
     ]
 
-def summarize_job(job_id: str):
+def _make_window_prompt_ru(window_text: str, index: int, total: int) -> list:
+    system = (
+        "Ты помощник, делающий структурированные резюме русскоязычных встреч. "
+        "Отвечай кратко и по делу. Верни строго JSON без лишнего текста."
+    )
+    user = (
+        f"Это фрагмент {index} из {total} транскрипта одной длинной встречи. "
+        "Сделай резюме только этого фрагмента: meeting_summary (2–4 предложения), "
+        "key_points, action_items (owner, task, due), risks.\n\n"
+        f"Верни строго JSON вида:\n{SUMMARY_SCHEMA}\n\n"
+        f"Фрагмент транскрипта:\n{window_text}"
+    )
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+
+def _make_merge_prompt_ru(partials: list) -> list:
+    system = (
+        "Ты помощник, делающий структурированные резюме русскоязычных встреч. "
+        "Отвечай кратко и по делу. Верни строго JSON без лишнего текста."
+    )
+    user = (
+        "Ниже резюме последовательных фрагментов одной встречи (JSON, по порядку). "
+        "Объедини их в одно резюме всей встречи:\n"
+        "1) meeting_summary (5–8 предложений)\n"
+        "2) key_points (без повторов)\n"
+        "3) action_items (owner, task, due; дубликаты объединить)\n"
+        "4) risks (без повторов)\n\n"
+        f"Верни строго JSON вида:\n{SUMMARY_SCHEMA}\n\n"
+        f"Резюме фрагментов:\n{json.dumps(partials, ensure_ascii=False)}"
+    )
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def split_windows(segments: list, budget: int = SUMMARY_WINDOW_TOKENS) -> list:
+    """Склеивает тексты сегментов в окна не длиннее budget токенов, не разрывая сегменты"""
+    windows = []
+    current, current_tokens = [], 0
+    for seg in segments:
+        text = (seg.get("text") or "").strip()
+        if not text:
+            continue
+        tokens = _estimate_tokens(text)
+        if current and current_tokens + tokens > budget:
+            windows.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        windows.append(" ".join(current))
+    return windows
+
+async def _call_llm(messages: list) -> str:
     if not DEEPSEEK_API_KEY:
         raise RuntimeError("DEEPSEEK_API_KEY is not set")
 
-    jdir = _jdir(job_id)
-    tj = jdir / "transcript.json"
-    if not tj.exists():
-        raise FileNotFoundError("transcript.json not found")
+    def on_retry(attempt, delay, reason):
+        job_id = _current_job.get()
+        if job_id:
+            job_index.increment(job_id, "llm_retries")
+
+    return await llm.chat_completion(
+        API_URL, DEEPSEEK_API_KEY,
+        {"model": DEEPSEEK_MODEL, "messages": messages, "temperature": 0.2},
+        timeout=SUMMARY_REQUEST_TIMEOUT,
+        on_retry=on_retry
+    )
+
+def _parse_summary(content: str):
+    """Ответ LLM как резюме по SUMMARY_SCHEMA или None, если это не JSON-объект с meeting_summary"""
+    try:
+        summary = json.loads(content)
+    except Exception:
+        return None
+    if isinstance(summary, dict) and "meeting_summary" in summary:
+        return summary
+    return None
+
+async def _cached_call(text: str, prompt_version: str, messages: list) -> str:
+    """
+    Вызов LLM через кэш резюме: ключ — текст, модель и версия промпта.
+    Кэшируются только ответы, разобравшиеся по схеме: обрезанный или не-JSON
+    ответ не должен возвращаться повторам задачи вместо нового запроса.
+    """
+    cache_key = summary_cache.cache_key(text, DEEPSEEK_MODEL, prompt_version)
+    # Синхронный Redis — в потоке, чтобы не останавливать остальные задачи воркера
+    cached = await asyncio.to_thread(summary_cache.get, cache_key)
+    if cached is not None:
+        return cached["content"]
+    content = await _call_llm(messages)
+    if _parse_summary(content) is not None:
+        await asyncio.to_thread(summary_cache.put, cache_key, {"content": content})
+    return content
+
+async def _gather_limited(coros: list) -> list:
+    """
+    Выполняет корутины параллельно, не больше SUMMARY_MAP_CONCURRENCY одновременно.
+    Первая ошибка отменяет остальные вызовы: задача всё равно будет отложена
+    или упадёт, и её запросы к LLM не должны продолжаться после этого.
+    """
+    semaphore = asyncio.Semaphore(SUMMARY_MAP_CONCURRENCY)
+
+    async def run(coro):
+        try:
+            async with semaphore:
+                return await coro
+        finally:
+            coro.close()  # не начатая из-за отмены корутина, без предупреждения "never awaited"
+
+    tasks = [asyncio.create_task(run(c)) for c in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def _parse_partial(content: str) -> dict:
+    return _parse_summary(content) or {"meeting_summary": content}
+
+def _group_partials(partials: list) -> list:
+    """
+    Группы частичных резюме не длиннее окна. В группе минимум два резюме, даже
+    если вместе они больше окна, — иначе уровень слияния не уменьшит их число.
+    """
+    groups, current = [], []
+    for partial in partials:
+        if len(current) >= 2 and \
+                _estimate_tokens(json.dumps(current + [partial], ensure_ascii=False)) > SUMMARY_WINDOW_TOKENS:
+            groups.append(current)
+            current = []
+        current.append(partial)
+    if len(current) == 1 and groups:
+        groups[-1].append(current[0])
+    else:
+        groups.append(current)
+    return groups
+
+def _truncate_partials(partials: list) -> list:
+    """Урезает резюме так, чтобы все вместе поместились в одно окно"""
+    max_chars = max(SUMMARY_WINDOW_TOKENS * CHARS_PER_TOKEN // len(partials), 1)
+    out = []
+    for partial in partials:
+        if len(json.dumps(partial, ensure_ascii=False)) <= max_chars:
+            out.append(partial)
+        else:
+            out.append({"meeting_summary": str(partial.get("meeting_summary", ""))[:max_chars]})
+    return out
+
+async def _merge(partials: list) -> str:
+    """
+    Сливает частичные резюме. Если все они не помещаются в одно окно,
+    сливает их группами и повторяет уровнем выше, пока не останется одна группа.
+    Если за SUMMARY_MAX_MERGE_LEVELS уровней не сошлось (резюме слишком длинные
+    для окна), оставшиеся урезаются и сливаются одним запросом.
+    """
+    def merge_group(group):
+        text = json.dumps(group, ensure_ascii=False)
+        return _cached_call(text, MERGE_PROMPT_VERSION, _make_merge_prompt_ru(group))
+
+    for _ in range(SUMMARY_MAX_MERGE_LEVELS):
+        groups = _group_partials(partials)
+        if len(groups) == 1:
+            return await merge_group(groups[0])
+        if len(groups) >= len(partials):
+            break
 
-    transcript = json.loads(tj.read_text("utf-8"))
+        print(f"Слияние {len(partials)} частичных резюме в {len(groups)} групп")
+        partials = [_parse_partial(c) for c in await _gather_limited([merge_group(g) for g in groups])]
+
+    print(f"Слияние не сошлось, {len(partials)} частичных резюме сливаются одним урезанным запросом")
+    return await merge_group(_truncate_partials(partials))
+
+async def summarize_transcript(transcript: dict) -> str:
+    """
+    Возвращает ответ LLM (строку с JSON) для транскрипта. Короткий транскрипт
+    уходит одним запросом, длинный — через map-reduce по окнам сегментов.
+    """
     text = transcript.get("text", "")
+    if _estimate_tokens(text) <= SUMMARY_WINDOW_TOKENS:
+        return await _cached_call(text, PROMPT_VERSION, _make_prompt_ru(text))
 
-    messages = _make_prompt_ru(text)
+    # Итоговый результат тоже кэшируется целиком, чтобы повтор не проходил map-reduce заново
+    cache_key = summary_cache.cache_key(text, DEEPSEEK_MODEL, f"{PROMPT_VERSION}+{MAP_PROMPT_VERSION}")
+    cached = await asyncio.to_thread(summary_cache.get, cache_key)
+    if cached is not None:
+        return cached["content"]
 
-    resp = requests.post(
-        API_URL,
-        headers={"Authorization": f"Bearer {DEEPSEEK_API_KEY}"},
-        json={"model": DEEPSEEK_MODEL, "messages": messages, "temperature": 0.2},
-        timeout=90
-    )
-    resp.raise_for_status()
-    content = resp.json()["choices"][0]["message"]["content"].strip()
+    windows = split_windows(transcript.get("segments") or [{"text": text}])
+    print(f"Длинный транскрипт (~{_estimate_tokens(text)} токенов): {len(windows)} окон")
+
+    results = await _gather_limited([
+        _cached_call(window, MAP_PROMPT_VERSION, _make_window_prompt_ru(window, index, len(windows)))
+        for index, window in enumerate(windows, 1)
+    ])
+    partials = [_parse_partial(c) for c in results]
+
+    content = await _merge(partials) if len(partials) > 1 else json.dumps(partials[0], ensure_ascii=False)
+    # Итог с испорченным частичным резюме не кэшируется — повтор переспросит это окно
+    if all(_parse_summary(c) is not None for c in results) and _parse_summary(content) is not None:
+        await asyncio.to_thread(summary_cache.put, cache_key, {"content": content})
+    return content
+
+def summarize_job(job_id: str):
+    """Синхронная точка входа для rq worker и повторов из manage_jobs.py"""
+    async def run():
+        try:
+            return await summarize_job_async(job_id)
+        finally:
+            await llm.aclose()
+
+    return asyncio.run(run())
+
+async def summarize_job_async(job_id: str):
+    """
+    Точка входа асинхронного воркера (tasks/summarize_worker.py). Задача сама
+    укладывается в таймаут RQ: по истечении SUMMARY_JOB_TIMEOUT минус запас
+    она откладывается, как при временной ошибке LLM, а не обрывается воркером.
+    Синхронные вызовы Redis и записи файлов идут через asyncio.to_thread —
+    в воркере одновременно выполняются десятки задач на одном event loop.
+    """
+    _current_job.set(job_id)
+    attempts = await asyncio.to_thread(job_index.increment, job_id, "summary_attempts")
+    if not attempts:
+        # increment возвращает 0 только для задачи без записи в индексе
+        raise LookupError(f"job {job_id} not found in the job index")
+    deadline = summary_queue.SUMMARY_JOB_TIMEOUT - summary_queue.SUMMARY_TIMEOUT_MARGIN
+    try:
+        return await asyncio.wait_for(_summarize(job_id), timeout=max(deadline, 1))
+    except asyncio.TimeoutError:
+        error = llm.LLMRetryableError(f"summary did not finish in {deadline}s")
+        if attempts < SUMMARY_MAX_ATTEMPTS:
+            return await asyncio.to_thread(park_job, job_id, attempts, error)
+        await asyncio.to_thread(job_index.set_status, job_id, "error",
+                                error=f"summarize: {error} (attempts: {attempts})")
+        raise
+    except asyncio.CancelledError:
+        # Воркер остановлен или оборвал задачу — она вернётся в очередь из sum:delayed.
+        # Задача уже отменена, ждать потока нельзя — короткая синхронная запись
+        park_job(job_id, attempts, llm.LLMRetryableError("summary was cancelled"))
+        raise
+    except llm.LLMRetryableError as e:
+        if attempts < SUMMARY_MAX_ATTEMPTS:
+            return await asyncio.to_thread(park_job, job_id, attempts, e)
+        await asyncio.to_thread(job_index.set_status, job_id, "error",
+                                error=f"summarize: {e} (attempts: {attempts})")
+        raise
+    except Exception as e:
+        await asyncio.to_thread(job_index.set_status, job_id, "error", error=f"summarize: {e}")
+        raise
+
+def park_job(job_id: str, attempts: int, error: Exception) -> dict:
+    """Откладывает задачу до следующей попытки вместо того, чтобы уронить её"""
+    delay = max(getattr(error, "retry_after", None) or 0,
+                llm.backoff_delay(attempts, SUMMARY_RETRY_BASE_DELAY, SUMMARY_RETRY_MAX_DELAY))
+    retry_at = time.time() + delay
+    job_index.get_redis().zadd(DELAYED_KEY, {job_id: retry_at})
+    job_index.set_status(job_id, "transcribed", summary_retry_at=retry_at, summary_error=str(error))
+    print(f"Суммаризация job_id {job_id} отложена на {delay:.0f}s (попытка {attempts}): {error}")
+    return {"ok": False, "retry_at": retry_at}
+
+def promote_delayed(limit: int = 100) -> list:
+    """
+    Забирает из sum:delayed задачи, чьё время пришло. ZREM атомарен, поэтому
+    при нескольких воркерах каждую задачу возвращает в очередь только один.
+    """
+    r = job_index.get_redis()
+    due = r.zrangebyscore(DELAYED_KEY, 0, time.time(), start=0, num=limit)
+    return [job_id for job_id in due if r.zrem(DELAYED_KEY, job_id)]
+
+def _save_summary(job_id: str, jdir: Path, summary_json: dict, content: str):
+    storage.write_json(jdir / "summary.json", summary_json)
+    storage.write_text(jdir / "summary.txt", summary_json.get("meeting_summary", content))
+    job_index.set_status(job_id, "summarized", has_summary=True,
+                         summary_size=(jdir / "summary.json").stat().st_size)
+    job_index.reset_fields(job_id, *summary_queue.RETRY_FIELDS)
+
+async def _summarize(job_id: str):
+    jdir = await asyncio.to_thread(_jdir, job_id)
+    transcript = await asyncio.to_thread(transcript_store.load, jdir)
+    content = await summarize_transcript(transcript)
 
     # Попытка распарсить в JSON (если LLM вернёт JSON как строку)
     try:
@@ -67,9 +371,6 @@ def summarize_job(job_id: str):
         # fallback — завернем как поле raw
         summary_json = {"raw": content}
 
-    (jdir / "summary.json").write_text(json.dumps(summary_json, ensure_ascii=False, indent=2), "utf-8")
-    (jdir / "summary.txt").write_text(
-        summary_json.get("meeting_summary", content),
-        "utf-8"
-    )
+    # Запись с fsync (tasks/storage.py) — в потоке
+    await asyncio.to_thread(_save_summary, job_id, jdir, summary_json, content)
     return {"ok": True}
@@ -0,0 +1,201 @@
+"""
+Асинхронный воркер очереди суммаризации.
+
+Заменяет `rq worker sum`: задачи по-прежнему берутся из RQ-очереди `sum`
+(её наполняют сервер транскрибации и manage_jobs.py), но выполняются как
+корутины в одном процессе — до SUMMARY_WORKER_CONCURRENCY задач одновременно
+поверх общего пула соединений к LLM (tasks/llm.py). Пока одни задачи ждут
+ответа модели, остальные уже отправляют свои запросы.
+
+Статусы и реестры RQ (started/finished/failed) ведутся так же, как у
+обычного rq worker, поэтому manage_jobs.py видит упавшие задачи как раньше.
+Воркер регистрируется в RQ под именем WORKER_NAME (heartbeat, состояние
+busy/idle, текущая задача), поэтому он есть и в списке воркеров manage_jobs.py.
+Обращения к Redis в RQ синхронные — они выполняются через asyncio.to_thread.
+
+Воркер же возвращает в очередь отложенные после сбоев LLM задачи (sum:delayed)
+и не берёт новые задачи, пока открыт circuit breaker провайдера.
+
+Запуск:
+    python -m tasks.summarize_worker
+"""
+
+import os
+import socket
+import signal
+import asyncio
+import traceback
+
+from redis import Redis
+from rq import Queue, Worker
+from rq.exceptions import DequeueTimeout
+from rq.job import Job, JobStatus
+from rq.registry import StartedJobRegistry
+from rq.utils import utcnow
+
+from tasks import llm, summary_queue
+from tasks.summarize import summarize_job_async, promote_delayed
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
+QUEUE_NAME = summary_queue.QUEUE_NAME
+SUMMARY_WORKER_CONCURRENCY = max(int(os.getenv("SUMMARY_WORKER_CONCURRENCY", "16")), 1)
+DEQUEUE_TIMEOUT = 5
+PROMOTE_INTERVAL = 2
+RESULT_TTL = 500
+HEARTBEAT_INTERVAL = 60
+WORKER_NAME = f"async-sum:{socket.gethostname()}:{os.getpid()}"
+
+# Функции, которые воркер выполняет как корутины; остальные задачи очереди — в потоке
+ASYNC_FUNCS = {summary_queue.FUNC_NAME: summarize_job_async}
+
+def _start_job(connection: Redis, job: Job, started: StartedJobRegistry):
+    with connection.pipeline() as pipe:
+        job.prepare_for_execution(WORKER_NAME, pipe)
+        started.add(job, (job.timeout or 180) + 60, pipeline=pipe)
+        pipe.execute()
+
+def _fail_job(connection: Redis, job: Job, started: StartedJobRegistry, exc_string: str):
+    job.ended_at = utcnow()
+    with connection.pipeline() as pipe:
+        job.set_status(JobStatus.FAILED, pipeline=pipe)
+        job._handle_failure(exc_string, pipeline=pipe)
+        started.remove(job, pipeline=pipe)
+        pipe.execute()
+
+def _finish_job(connection: Redis, job: Job, started: StartedJobRegistry, result):
+    job.ended_at = utcnow()
+    job._result = result
+    result_ttl = job.get_result_ttl(RESULT_TTL)
+    with connection.pipeline() as pipe:
+        job._handle_success(result_ttl, pipeline=pipe)
+        job.cleanup(result_ttl, pipeline=pipe, remove_from_queue=False)
+        started.remove(job, pipeline=pipe)
+        pipe.execute()
+
+async def run_job(connection: Redis, job: Job, queue: Queue):
+    started = StartedJobRegistry(queue=queue)
+    await asyncio.to_thread(_start_job, connection, job, started)
+
+    print(f"Начинаю задачу {job.id}: {job.func_name}{job.args}")
+    try:
+        func = ASYNC_FUNCS.get(job.func_name)
+        if func is not None:
+            work = func(*job.args, **job.kwargs)
+        else:
+            work = asyncio.to_thread(job.func, *job.args, **job.kwargs)
+        # Таймаут задачи RQ соблюдается и для корутин, иначе зависший запрос держит слот
+        result = await asyncio.wait_for(work, timeout=job.timeout if job.timeout and job.timeout > 0 else None)
+    except Exception:
+        exc_string = traceback.format_exc()
+        print(f"Задача {job.id} завершилась ошибкой:\n{exc_string}")
+        await asyncio.to_thread(_fail_job, connection, job, started, exc_string)
+        return
+
+    await asyncio.to_thread(_finish_job, connection, job, started, result)
+    print(f"Задача {job.id} выполнена")
+
+def _report_state(worker: Worker, running: dict):
+    """Состояние воркера для rq info и manage_jobs.py: busy и последняя начатая задача или idle"""
+    with worker.connection.pipeline() as pipe:
+        if running:
+            worker.set_state("busy", pipeline=pipe)
+            worker.set_current_job_id(next(reversed(running.values())), pipeline=pipe)
+        else:
+            worker.set_state("idle", pipeline=pipe)
+            worker.set_current_job_id(None, pipeline=pipe)
+        worker.heartbeat(pipeline=pipe)
+        pipe.execute()
+
+async def heartbeat_loop(worker: Worker, running: dict, stopping: asyncio.Event):
+    """Продлевает регистрацию воркера в RQ, пока он работает"""
+    while not stopping.is_set():
+        try:
+            await asyncio.to_thread(_report_state, worker, running)
+        except Exception as e:
+            print(f"Ошибка heartbeat воркера: {e}")
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def promote_loop(queue: Queue, stopping: asyncio.Event):
+    """Возвращает в очередь отложенные задачи, у которых подошло время повтора"""
+    while not stopping.is_set():
+        try:
+            for job_id in await asyncio.to_thread(promote_delayed):
+                await asyncio.to_thread(summary_queue.enqueue, queue, job_id)
+                print(f"Отложенная задача {job_id} возвращена в очередь")
+        except Exception as e:
+            print(f"Ошибка возврата отложенных задач: {e}")
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=PROMOTE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def main():
+    # RQ хранит задачи в pickle — соединение без decode_responses
+    connection = Redis.from_url(REDIS_URL)
+    queue = Queue(QUEUE_NAME, connection=connection)
+    worker = Worker([queue], connection=connection, name=WORKER_NAME)
+    slots = asyncio.Semaphore(SUMMARY_WORKER_CONCURRENCY)
+    running = {}  # task -> id задачи RQ, в порядке запуска
+    stopping = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    print(f"Асинхронный воркер {WORKER_NAME}: очередь '{QUEUE_NAME}', "
+          f"до {SUMMARY_WORKER_CONCURRENCY} задач одновременно")
+    await asyncio.to_thread(worker.register_birth)
+    promoter = asyncio.create_task(promote_loop(queue, stopping))
+    heartbeat = asyncio.create_task(heartbeat_loop(worker, running, stopping))
+
+    reports = set()
+
+    def job_done(task):
+        running.pop(task, None)
+        slots.release()
+        if not running:
+            report = asyncio.create_task(asyncio.to_thread(_report_state, worker, running))
+            reports.add(report)
+            report.add_done_callback(reports.discard)
+
+    while not stopping.is_set():
+        await slots.acquire()
+        # Провайдер недоступен — задачи остаются в очереди, а не сгорают одна за другой
+        open_for = await asyncio.to_thread(llm.breaker_open_for)
+        if open_for > 0:
+            slots.release()
+            await asyncio.sleep(min(open_for, DEQUEUE_TIMEOUT))
+            continue
+        try:
+            item = await asyncio.to_thread(Queue.dequeue_any, [queue], DEQUEUE_TIMEOUT, connection=connection)
+        except DequeueTimeout:
+            item = None
+        except Exception as e:
+            print(f"Ошибка чтения очереди: {e}")
+            item = None
+            await asyncio.sleep(1)
+        if item is None:
+            slots.release()
+            continue
+
+        job, job_queue = item
+        task = asyncio.create_task(run_job(connection, job, job_queue))
+        first = not running
+        running[task] = job.id
+        task.add_done_callback(job_done)
+        if first:
+            await asyncio.to_thread(_report_state, worker, running)
+
+    print(f"Останавливаюсь, дожидаюсь {len(running)} задач...")
+    if running:
+        await asyncio.gather(*list(running), return_exceptions=True)
+    await promoter
+    await heartbeat
+    await asyncio.to_thread(worker.register_death)
+    await llm.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Кэш результатов суммаризации.
+
+Ключ — SHA-256 текста транскрипта + модель LLM + версия шаблона промпта,
+так что повторная суммаризация того же текста (retry, повторная загрузка,
+retry_failed_job из manage_jobs.py) не обращается к API. Смена модели или
+PROMPT_VERSION автоматически даёт новые ключи.
+
+Ключи Redis:
+    sumcache:<hash>   — JSON с ответом LLM, с TTL
+    sumcache:lru      — zset hash -> время последнего обращения; по нему
+                        вытесняются самые старые записи сверх лимита
+    sumcache:stats    — hash hits / misses
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from tasks import job_index
+
+SUMMARY_CACHE_ENABLED = os.getenv("SUMMARY_CACHE_ENABLED", "true").lower() == "true"
+SUMMARY_CACHE_TTL_DAYS = int(os.getenv("SUMMARY_CACHE_TTL_DAYS", "30"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "10000"))
+
+LRU_KEY = "sumcache:lru"
+STATS_KEY = "sumcache:stats"
+
+def cache_key(text: str, model: str, prompt_version: str) -> str:
+    digest = hashlib.sha256()
+    for part in (model, prompt_version, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def get(key: str):
+    """Возвращает сохранённый результат или None"""
+    if not SUMMARY_CACHE_ENABLED:
+        return None
+
+    r = job_index.get_redis()
+    raw = r.get(f"sumcache:{key}")
+    pipe = r.pipeline()
+    if raw is None:
+        pipe.zrem(LRU_KEY, key)
+        pipe.hincrby(STATS_KEY, "misses", 1)
+    else:
+        pipe.zadd(LRU_KEY, {key: time.time()})
+        pipe.hincrby(STATS_KEY, "hits", 1)
+    pipe.execute()
+    return json.loads(raw) if raw is not None else None
+
+def put(key: str, value: dict):
+    """Сохраняет результат и вытесняет самые давно использованные записи сверх лимита"""
+    if not SUMMARY_CACHE_ENABLED:
+        return
+
+    r = job_index.get_redis()
+    pipe = r.pipeline()
+    pipe.set(f"sumcache:{key}", json.dumps(value, ensure_ascii=False), ex=SUMMARY_CACHE_TTL_DAYS * 86400)
+    pipe.zadd(LRU_KEY, {key: time.time()})
+    pipe.zcard(LRU_KEY)
+    size = pipe.execute()[-1]
+
+    overflow = size - SUMMARY_CACHE_MAX_ENTRIES
+    if SUMMARY_CACHE_MAX_ENTRIES and overflow > 0:
+        evicted = [k for k, _ in r.zpopmin(LRU_KEY, overflow)]
+        if evicted:
+            r.delete(*[f"sumcache:{k}" for k in evicted])
+            print(f"Кэш резюме: вытеснено {len(evicted)} записей")
+
+def stats() -> dict:
+    r = job_index.get_redis()
+    raw = r.hgetall(STATS_KEY)
+    hits = int(raw.get("hits", 0))
+    misses = int(raw.get("misses", 0))
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": round(hits / total, 4) if total else None,
+            "entries": r.zcard(LRU_KEY), "max_entries": SUMMARY_CACHE_MAX_ENTRIES or None}
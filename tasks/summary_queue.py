@@ -0,0 +1,29 @@
+"""
+Постановка задач суммаризации в RQ-очередь sum.
+
+Модуль без зависимостей от httpx/LLM-клиента — его импортирует и сервер
+транскрибации. Таймаут задачи RQ рассчитан на бюджет повторов tasks/llm.py:
+LLM_MAX_ATTEMPTS запросов по SUMMARY_REQUEST_TIMEOUT секунд с паузами до
+LLM_RETRY_MAX_DELAY между ними, а map-reduce длинного транскрипта делает
+несколько таких вызовов подряд (окна, затем слияние). Дефолтный таймаут RQ
+(180 с) обрывал задачу раньше, чем повторы успевали закончиться, и она
+падала вместо того, чтобы отложиться в sum:delayed.
+"""
+
+import os
+
+QUEUE_NAME = os.getenv("SUMMARY_QUEUE", "sum")
+FUNC_NAME = "tasks.summarize.summarize_job"
+
+# Те же переменные окружения и значения по умолчанию, что в tasks/llm.py и tasks/summarize.py
+_LLM_CALL_BUDGET = max(int(os.getenv("LLM_MAX_ATTEMPTS", "4")), 1) * (
+    float(os.getenv("SUMMARY_REQUEST_TIMEOUT", "90")) + float(os.getenv("LLM_RETRY_MAX_DELAY", "30")))
+SUMMARY_JOB_TIMEOUT = int(os.getenv("SUMMARY_JOB_TIMEOUT", str(int(3 * _LLM_CALL_BUDGET))))
+# Поля записи задачи (tasks/job_index.py) с состоянием повторов суммаризации; сбрасываются
+# после успеха и при ручном повторе (manage_jobs.py), чтобы бюджет повторов начинался заново
+RETRY_FIELDS = ("summary_attempts", "summary_retry_at", "summary_error")
+# Задача сама останавливается и откладывается за столько секунд до таймаута RQ
+SUMMARY_TIMEOUT_MARGIN = 30
+
+def enqueue(queue, job_id: str):
+    return queue.enqueue(FUNC_NAME, job_id, job_timeout=SUMMARY_JOB_TIMEOUT)
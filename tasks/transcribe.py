@@ -1,9 +1,12 @@
-import os, json, subprocess
+import os
 from pathlib import Path
 from faster_whisper import WhisperModel
 from redis import Redis
 from rq import Queue
 
+from tasks import job_index, paths, transcript_store, summary_queue
+from tasks.audio import decode_audio, SAMPLE_RATE
+
 DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
 WHISPER_MODEL = os.getenv("WHISPER_MODEL", "medium")
 WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "cpu")
@@ -28,59 +31,34 @@ model = WhisperModel(
 print("Whisper модель инициализирована")
 
 def _jdir(job_id: str) -> Path:
-    d = DATA_DIR / "jobs" / job_id
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+    # Каталог создаётся при загрузке; здесь не создаётся, чтобы не воскресить удалённую задачу
+    return paths.job_dir(job_id, DATA_DIR)
 
-def convert_to_wav(input_path: Path, output_path: Path):
-    """Конвертирует аудиофайл в WAV формат для лучшей совместимости с Whisper"""
-    try:
-        print(f"Конвертация {input_path} в {output_path}")
-        cmd = [
-            "ffmpeg", "-y",  # -y для перезаписи существующего файла
-            "-i", str(input_path),
-            "-acodec", "pcm_s16le",  # 16-bit PCM
-            "-ar", "16000",  # 16kHz sample rate
-            "-ac", "1",  # mono
-            str(output_path)
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        
-        if result.returncode != 0:
-            print(f"FFmpeg error: {result.stderr}")
-            return False
-            
-        print(f"Конвертация успешна: {output_path}")
-        return True
-    except Exception as e:
-        print(f"Conversion error: {e}")
-        return False
+def _job_gone(job_id: str, jdir: Path) -> bool:
+    """Задача удалена (DELETE /history) — результаты не пишутся"""
+    return not jdir.is_dir() or job_index.get_job(job_id) is None
 
 def transcribe_job(job_id: str, audio_path: str, language: str = "ru"):
     jdir = _jdir(job_id)
     audio_path = Path(audio_path)
+    if _job_gone(job_id, jdir):
+        print(f"Задача {job_id} удалена, транскрипция пропущена")
+        return {"ok": False}
     
     print(f"Начинаю транскрипцию job_id: {job_id}")
     print(f"Исходный аудиофайл: {audio_path}")
     
-    # Конвертируем в WAV если это не WAV файл
-    wav_path = audio_path
-    if audio_path.suffix.lower() != '.wav':
-        wav_path = jdir / "input_converted.wav"
-        if not convert_to_wav(audio_path, wav_path):
-            # Если конвертация не удалась, пробуем оригинальный файл
-            wav_path = audio_path
-            print(f"Using original file: {audio_path}")
-
-    print(f"Обрабатываю аудиофайл: {wav_path}")
+    job_index.set_status(job_id, "transcribing")
     
     try:
+        # Декодируем в память, без промежуточного input_converted.wav
+        audio = decode_audio(audio_path, debug_wav=jdir / "input_converted.wav")
+        print(f"Аудио декодировано: {len(audio) / SAMPLE_RATE:.1f}s")
         print("Запускаю Whisper транскрипцию...")
         
         # Оптимизированные параметры для ускорения обработки
         segments, info = model.transcribe(
-            str(wav_path),
+            audio,
             language=language,
             vad_filter=True,  # Включаем VAD фильтр для ускорения
             beam_size=1,  # Уменьшаем beam size для ускорения
@@ -116,16 +94,18 @@ def transcribe_job(job_id: str, audio_path: str, language: str = "ru"):
         print(f"Результат транскрипции: {segment_count} сегментов, длина текста: {len(out['text'])}")
         print(f"Полный текст: '{out['text']}'")
 
-        (jdir / "transcript.json").write_text(json.dumps(out, ensure_ascii=False, indent=2), "utf-8")
-        (jdir / "transcript.txt").write_text(out["text"], "utf-8")
+        if _job_gone(job_id, jdir):
+            print(f"Задача {job_id} удалена во время транскрипции, результат не сохраняется")
+            return {"ok": False}
+        transcript_size = transcript_store.save(jdir, out)
+        job_index.set_status(job_id, "transcribed", has_transcript=True, transcript_size=transcript_size)
         
         print("Файлы транскрипции сохранены")
 
         # очередь на суммаризацию
         r = Redis.from_url(REDIS_URL)
-        q = Queue("sum", connection=r)
-        # Use string path to avoid circular import issues
-        q.enqueue("tasks.summarize.summarize_job", job_id)
+        q = Queue(summary_queue.QUEUE_NAME, connection=r)
+        summary_queue.enqueue(q, job_id)
         print("Задача добавлена в очередь суммаризации")
         return {"ok": True}
         
@@ -134,7 +114,10 @@ def transcribe_job(job_id: str, audio_path: str, language: str = "ru"):
         import traceback
         traceback.print_exc()
         # Создаем пустой результат в случае ошибки
+        if _job_gone(job_id, jdir):
+            print(f"Задача {job_id} удалена, ошибка не сохраняется")
+            return {"ok": False}
         out = {"language": language, "text": "", "segments": [], "error": str(e)}
-        (jdir / "transcript.json").write_text(json.dumps(out, ensure_ascii=False, indent=2), "utf-8")
-        (jdir / "transcript.txt").write_text("", "utf-8")
+        transcript_store.save(jdir, out)
+        job_index.set_status(job_id, "error", error=str(e))
         return {"ok": False, "error": str(e)}
@@ -0,0 +1,336 @@
+"""
+Компактное хранение транскриптов: transcript.seg вместо transcript.json + transcript.txt.
+
+Формат transcript.seg (little-endian):
+    b"PLSEG" версия:u8 кодек:u8          кодек 1 — zlib, 2 — zstd
+    n:u32 header_len:u32 header          header — JSON: language, error, text
+                                         (если текст не склеивается из сегментов)
+    start:float64[n] end:float64[n]      таймкоды сегментов столбцами
+    text_len:u32[n]                      длина текста каждого сегмента в байтах
+    block_segments:u32 block_len:u32[m]  m = ceil(n / block_segments) — размеры блоков
+    блоки текстов                        тексты block_segments сегментов подряд (UTF-8),
+                                         каждый блок сжат независимо
+
+Версия 1 (читается по-прежнему) вместо блоков хранит все тексты одним
+сжатым потоком — чтобы достать окно сегментов, его приходилось распаковывать
+целиком.
+
+Полный текст не хранится отдельно — он склеивается из сегментов, id сегмента
+равен его номеру. Сжатие zstd, если установлен пакет zstandard, иначе zlib.
+
+Старые каталоги с transcript.json читаются как раньше. TRANSCRIPT_FORMAT=json
+возвращает запись в JSON (например, для отката на старую версию сервиса).
+
+Клиенты получают тот же JSON, что и раньше: render_json() собирает его прямо
+из столбцов, без промежуточного dict и без разбора файла как JSON.
+render_projection() отдаёт часть транскрипта (текст, окно сегментов по
+номерам или по времени): столбцы таймкодов и длин текстов служат индексом,
+поэтому распаковываются только блоки, в которые попало окно сегментов.
+"""
+
+import os
+import sys
+import json
+import zlib
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from json.encoder import encode_basestring
+
+from tasks import storage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TRANSCRIPT_FORMAT = os.getenv("TRANSCRIPT_FORMAT", "compact")
+
+COMPACT_NAME = "transcript.seg"
+JSON_NAME = "transcript.json"
+TEXT_NAME = "transcript.txt"
+# Сегменты по мере распознавания (для /partial); удаляется после сохранения итогового транскрипта
+PARTIAL_NAME = "transcript.partial.jsonl"
+
+MAGIC = b"PLSEG"
+VERSION = 2
+VERSIONS = (1, 2)
+# Сегментов в блоке текстов: ~10-20 КБ текста, сжатие почти как у единого потока
+BLOCK_SEGMENTS = 128
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+_PREFIX = struct.Struct("<5sBBII")
+_U32 = struct.Struct("<I")
+_SEGMENT_KEYS = {"id", "start", "end", "text"}
+
+def path_of(job_dir: Path):
+    """Файл транскрипта задачи (компактный или JSON) или None"""
+    for name in (COMPACT_NAME, JSON_NAME):
+        path = job_dir / name
+        if path.exists():
+            return path
+    return None
+
+def exists(job_dir: Path) -> bool:
+    return path_of(job_dir) is not None
+
+def _array(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def _to_bytes(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _compressor():
+    """(кодек, функция сжатия): zstd, если установлен zstandard, иначе zlib"""
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=9).compress
+    return CODEC_ZLIB, lambda data: zlib.compress(data, 6)
+
+def _decompress(codec: int, data: bytes) -> bytes:
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("transcript.seg is zstd-compressed, install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown transcript codec: {codec}")
+
+def _joined_text(texts: list) -> str:
+    return " ".join(texts).strip()
+
+def _compactable(transcript: dict) -> bool:
+    segments = transcript.get("segments") or []
+    return all(set(seg) <= _SEGMENT_KEYS and seg.get("id", i) == i for i, seg in enumerate(segments))
+
+def encode(transcript: dict) -> bytes:
+    segments = transcript.get("segments") or []
+    texts = [seg.get("text", "") for seg in segments]
+    header = {k: v for k, v in transcript.items() if k not in ("segments", "text")}
+    if transcript.get("text", "") != _joined_text(texts):
+        header["text"] = transcript.get("text", "")
+
+    encoded_texts = [text.encode("utf-8") for text in texts]
+    codec, compress = _compressor()
+    blocks = [compress(b"".join(encoded_texts[i:i + BLOCK_SEGMENTS]))
+              for i in range(0, len(encoded_texts), BLOCK_SEGMENTS)]
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    return b"".join([
+        _PREFIX.pack(MAGIC, VERSION, codec, len(segments), len(header_bytes)),
+        header_bytes,
+        _to_bytes(array("d", (float(seg["start"]) for seg in segments))),
+        _to_bytes(array("d", (float(seg["end"]) for seg in segments))),
+        _to_bytes(array("I", (len(t) for t in encoded_texts))),
+        _U32.pack(BLOCK_SEGMENTS),
+        _to_bytes(array("I", (len(block) for block in blocks))),
+        *blocks,
+    ])
+
+class _Texts:
+    """Тексты сегментов transcript.seg: блок распаковывается при первом обращении к его сегментам"""
+
+    def __init__(self, codec: int, lengths: array, block_segments: int, blocks: list):
+        self.codec = codec
+        self.lengths = lengths
+        self.block_segments = block_segments
+        self.blocks = blocks
+        self._decoded = {}
+
+    def _block(self, index: int) -> bytes:
+        if index not in self._decoded:
+            first = index * self.block_segments
+            data = _decompress(self.codec, self.blocks[index])
+            if len(data) != sum(self.lengths[first:first + self.block_segments]):
+                raise ValueError("transcript.seg is truncated")
+            self._decoded[index] = data
+        return self._decoded[index]
+
+    def slice(self, first: int, last: int) -> list:
+        """Тексты сегментов first..last-1"""
+        texts, size = [], self.block_segments
+        for index in range(first // size, (last - 1) // size + 1 if last > first else 0):
+            start = index * size
+            lo, hi = max(first, start), min(last, start + size)
+            data, offset = self._block(index), sum(self.lengths[start:lo])
+            for length in self.lengths[lo:hi]:
+                texts.append(data[offset:offset + length].decode("utf-8"))
+                offset += length
+        return texts
+
+def _read_columns(data: bytes) -> tuple:
+    """(header, starts, ends, lengths, texts) из содержимого transcript.seg, тексты не распаковываются"""
+    magic, version, codec, n, header_len = _PREFIX.unpack_from(data)
+    if magic != MAGIC or version not in VERSIONS:
+        raise ValueError("Not a transcript.seg file")
+    pos = _PREFIX.size
+    header = json.loads(data[pos:pos + header_len])
+    pos += header_len
+    starts = _array("d", data[pos:pos + 8 * n]); pos += 8 * n
+    ends = _array("d", data[pos:pos + 8 * n]); pos += 8 * n
+    lengths = _array("I", data[pos:pos + 4 * n]); pos += 4 * n
+    view = memoryview(data)
+    if version == 1:
+        return header, starts, ends, lengths, _Texts(codec, lengths, max(n, 1), [view[pos:]])
+
+    (block_segments,), pos = _U32.unpack_from(data, pos), pos + _U32.size
+    if not block_segments:
+        raise ValueError("Not a transcript.seg file")
+    count = -(-n // block_segments)
+    block_lens = _array("I", data[pos:pos + 4 * count]); pos += 4 * count
+    blocks = []
+    for length in block_lens:
+        blocks.append(view[pos:pos + length])
+        pos += length
+    if len(block_lens) != count or pos != len(data):
+        raise ValueError("transcript.seg is truncated")
+    return header, starts, ends, lengths, _Texts(codec, lengths, block_segments, blocks)
+
+def _decode_columns(data: bytes) -> tuple:
+    """(header, starts, ends, texts) из содержимого transcript.seg"""
+    header, starts, ends, lengths, texts = _read_columns(data)
+    return header, starts, ends, texts.slice(0, len(lengths))
+
+def decode(data: bytes) -> dict:
+    header, starts, ends, texts = _decode_columns(data)
+    transcript = {"language": header.get("language"), "text": header.get("text", _joined_text(texts))}
+    transcript.update({k: v for k, v in header.items() if k not in ("language", "text")})
+    transcript["segments"] = [
+        {"id": i, "start": starts[i], "end": ends[i], "text": texts[i]} for i in range(len(texts))
+    ]
+    return transcript
+
+def save(job_dir: Path, transcript: dict) -> int:
+    """
+    Атомарно сохраняет транскрипт, возвращает размер файла (transcript_size в индексе).
+    Файлы другого формата удаляются, чтобы не читалась устаревшая версия.
+    """
+    if TRANSCRIPT_FORMAT == "json" or not _compactable(transcript):
+        path = job_dir / JSON_NAME
+        storage.write_json(path, transcript)
+        storage.write_text(job_dir / TEXT_NAME, transcript.get("text", ""))
+        (job_dir / COMPACT_NAME).unlink(missing_ok=True)
+    else:
+        path = job_dir / COMPACT_NAME
+        storage.write_bytes(path, encode(transcript))
+        (job_dir / JSON_NAME).unlink(missing_ok=True)
+        (job_dir / TEXT_NAME).unlink(missing_ok=True)
+    return path.stat().st_size
+
+def load_file(path: Path) -> dict:
+    if path.name == COMPACT_NAME:
+        return decode(path.read_bytes())
+    return json.loads(path.read_text("utf-8"))
+
+def load(job_dir: Path) -> dict:
+    """Транскрипт задачи в прежнем JSON-виде; FileNotFoundError, если его нет"""
+    path = path_of(job_dir)
+    if path is None:
+        raise FileNotFoundError(f"transcript not found in {job_dir}")
+    return load_file(path)
+
+def read_header(job_dir: Path) -> dict:
+    """language/error без распаковки сегментов (для JSON-файла — весь транскрипт)"""
+    path = path_of(job_dir)
+    if path is None:
+        raise FileNotFoundError(f"transcript not found in {job_dir}")
+    if path.name != COMPACT_NAME:
+        return json.loads(path.read_text("utf-8"))
+    with path.open("rb") as f:
+        prefix = f.read(_PREFIX.size)
+        magic, version, _, _, header_len = _PREFIX.unpack(prefix)
+        if magic != MAGIC or version not in VERSIONS:
+            raise ValueError("Not a transcript.seg file")
+        return json.loads(f.read(header_len))
+
+def render_json(job_dir: Path) -> bytes:
+    """
+    JSON транскрипта для ответа клиенту. JSON-файл отдаётся как есть (только
+    проверяется, что он разбирается), transcript.seg рендерится прямо из столбцов.
+    """
+    path = path_of(job_dir)
+    if path is None:
+        raise FileNotFoundError(f"transcript not found in {job_dir}")
+    if path.name != COMPACT_NAME:
+        data = path.read_bytes()
+        json.loads(data)
+        return data
+
+    header, starts, ends, texts = _decode_columns(path.read_bytes())
+    head = {"language": header.get("language"), "text": header.get("text", _joined_text(texts))}
+    head.update({k: v for k, v in header.items() if k not in ("language", "text")})
+    return _render(head, 0, starts, ends, texts)
+
+def _render(head: dict, first: int, starts, ends, texts: list, extra: dict = None) -> bytes:
+    head_json = json.dumps(head, ensure_ascii=False)
+    # Сегментов тысячи — строки экранируются C-функцией json, без вызова json.dumps на каждый
+    segments = ",".join([
+        '{"id": %d, "start": %r, "end": %r, "text": %s}' % (first + i, starts[first + i], ends[first + i],
+                                                           encode_basestring(text))
+        for i, text in enumerate(texts)
+    ])
+    tail = "".join(f", {json.dumps(k)}: {json.dumps(v)}" for k, v in (extra or {}).items())
+    return (head_json[:-1] + ', "segments": [' + segments + "]" + tail + "}").encode("utf-8")
+
+def select_range(starts, ends, offset: int = 0, limit: int = None,
+                 t_from: float = None, t_to: float = None) -> tuple:
+    """
+    Окно сегментов (first, last, next_offset): номера от offset, не больше limit,
+    пересекающиеся с интервалом [t_from, t_to) секунд. Таймкоды сегментов Whisper
+    возрастают, поэтому границы по времени ищутся бинарным поиском.
+    next_offset — номер, с которого продолжать, или None, если окно исчерпано.
+    """
+    lo, hi = 0, len(starts)
+    if t_from is not None:
+        lo = bisect_right(ends, t_from)
+    if t_to is not None:
+        hi = bisect_left(starts, t_to)
+    first = max(lo, offset)
+    last = hi if limit is None else min(hi, first + limit)
+    last = max(first, last)
+    return first, last, (last if last < hi else None)
+
+def render_projection(job_dir: Path, text: bool = True, segments: bool = True, offset: int = 0,
+                      limit: int = None, t_from: float = None, t_to: float = None) -> bytes:
+    """
+    JSON части транскрипта: language (и error), text, если text, и окно
+    сегментов (см. select_range) с segments_total и next_offset, если segments.
+    Для transcript.seg распаковываются только блоки с сегментами окна (для
+    text без сохранённого в заголовке текста — все блоки, файлов версии 1 —
+    весь поток текстов); старый transcript.json приходится разобрать целиком.
+    """
+    path = path_of(job_dir)
+    if path is None:
+        raise FileNotFoundError(f"transcript not found in {job_dir}")
+
+    if path.name != COMPACT_NAME:
+        transcript = json.loads(path.read_bytes())
+        all_segments = transcript.pop("segments", None) or []
+        if not text:
+            transcript.pop("text", None)
+        if segments:
+            first, last, next_offset = select_range([s["start"] for s in all_segments],
+                                                    [s["end"] for s in all_segments],
+                                                    offset, limit, t_from, t_to)
+            transcript.update(segments=all_segments[first:last], segments_total=len(all_segments),
+                              next_offset=next_offset)
+        return json.dumps(transcript, ensure_ascii=False).encode("utf-8")
+
+    header, starts, ends, lengths, texts = _read_columns(path.read_bytes())
+    head = {"language": header.get("language")}
+    if text:
+        head["text"] = header.get("text") if "text" in header else \
+            _joined_text(texts.slice(0, len(lengths)))
+    head.update({k: v for k, v in header.items() if k not in ("language", "text")})
+    if not segments:
+        return json.dumps(head, ensure_ascii=False).encode("utf-8")
+
+    first, last, next_offset = select_range(starts, ends, offset, limit, t_from, t_to)
+    return _render(head, first, starts, ends, texts.slice(first, last),
+                   {"segments_total": len(lengths), "next_offset": next_offset})
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Тест индекса задач в Redis (tasks/job_index.py) на fakeredis:
+переходы статусов, счётчики и постраничная история.
+
+Нужен fakeredis (pip install fakeredis). Запуск: python test_job_index.py или pytest test_job_index.py
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+sys.path.append(str(Path(__file__).parent))
+
+import fakeredis
+
+from tasks import job_index
+
+def fresh_redis():
+    """Пустой fakeredis вместо общего соединения индекса"""
+    job_index._redis = fakeredis.FakeRedis(decode_responses=True)
+    return job_index._redis
+
+def test_set_status_transitions():
+    fresh_redis()
+    job_index.create_job("a", owner_id="1")
+    assert job_index.set_status("a", "transcribing", progress=0.5)
+    assert job_index.set_status("a", "transcribed", has_transcript=True)
+    assert job_index.set_status("a", "summarized", has_summary=True)
+
+    # Запоздавшее событие не откатывает готовую задачу
+    assert not job_index.set_status("a", "error", error="late")
+    record = job_index.get_job("a")
+    assert record["status"] == "summarized"
+    assert record["has_summary"] is True and record["progress"] == 0.5
+    assert "error" not in record and "summarized_at" in record
+
+    # force — для восстановления после сбоя
+    assert job_index.set_status("a", "transcribed", force=True)
+    assert job_index.get_job("a")["status"] == "transcribed"
+
+    assert not job_index.set_status("missing", "transcribing")
+    try:
+        job_index.set_status("a", "unknown")
+        assert False, "неизвестный статус принят"
+    except ValueError:
+        pass
+
+def test_counts_follow_status():
+    fresh_redis()
+    job_index.create_job("a", owner_id="1")
+    job_index.create_job("b", owner_id="1")
+    job_index.create_job("c", owner_id="2")
+    job_index.set_status("a", "error", error="boom")
+
+    assert job_index.job_counts()["uploaded"] == 2
+    assert job_index.job_counts()["error"] == 1
+    assert job_index.job_counts("1") == {"uploaded": 1, "transcribing": 0, "transcribed": 0,
+                                         "summarized": 0, "error": 1}
+
+    assert job_index.delete_job("a")
+    assert not job_index.delete_job("a")
+    assert job_index.get_job("a") is None
+    assert job_index.job_counts("1")["error"] == 0
+
+def test_increment_and_reset_fields():
+    fresh_redis()
+    job_index.create_job("a")
+    assert job_index.increment("a", "summary_attempts") == 1
+    assert job_index.increment("a", "summary_attempts") == 2
+    assert job_index.increment("missing", "summary_attempts") == 0
+    assert job_index.get_redis().exists("job:missing") == 0
+
+    job_index.reset_fields("a", "summary_attempts")
+    assert "summary_attempts" not in job_index.get_job("a")
+
+def test_list_jobs_cursor_with_equal_timestamps():
+    fresh_redis()
+    # Половина задач с одним created_at: курсор должен различать их по job_id
+    for i in range(25):
+        job_index.create_job(f"job-{i:02d}", owner_id="1", created_at=1000.0 if i < 12 else 1000.0 + i)
+    job_index.create_job("other", owner_id="2", created_at=5000.0)
+
+    seen, cursor = [], None
+    while True:
+        jobs, cursor = job_index.list_jobs(limit=5, cursor=cursor, owner_id="1", batch_size=3)
+        seen.extend(job["job_id"] for job in jobs)
+        if cursor is None:
+            break
+
+    assert len(seen) == 25 and len(set(seen)) == 25
+    assert seen[:13] == [f"job-{i:02d}" for i in range(24, 11, -1)]
+    assert seen[13:] == sorted((f"job-{i:02d}" for i in range(12)), reverse=True)
+
+    everything, cursor = job_index.list_jobs(limit=None, owner_id="1")
+    assert [job["job_id"] for job in everything] == seen and cursor is None
+
+def test_list_jobs_filters_and_fields():
+    fresh_redis()
+    for i in range(6):
+        job_index.create_job(f"j{i}", owner_id="1", created_at=float(i),
+                             language="ru" if i % 2 else "en", filename=f"{i}.wav")
+    job_index.set_status("j1", "transcribing")
+    job_index.set_status("j3", "error", error="boom")
+
+    jobs, _ = job_index.list_jobs(status="processing", owner_id="1", fields=["status"])
+    assert [job["job_id"] for job in jobs] == ["j5", "j4", "j2", "j1", "j0"]
+    assert all(set(job) == {"job_id", "status"} for job in jobs)
+
+    jobs, _ = job_index.list_jobs(status="error", owner_id="1")
+    assert [job["job_id"] for job in jobs] == ["j3"]
+
+    jobs, _ = job_index.list_jobs(language="ru", owner_id="1", fields=["filename"])
+    assert jobs == [{"job_id": "j5", "filename": "5.wav"}, {"job_id": "j3", "filename": "3.wav"},
+                    {"job_id": "j1", "filename": "1.wav"}]
+
+    try:
+        job_index.list_jobs(cursor="garbage")
+        assert False, "битый курсор принят"
+    except ValueError:
+        pass
+
+if __name__ == "__main__":
+    print("=== Тест индекса задач ===\n")
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
+    print("\n🎉 Все тесты прошли успешно!")
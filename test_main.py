@@ -10,7 +10,7 @@ from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 # Import our modules
-from database import get_db, init_db
+from database import get_sync_db, init_db
 from models import User
 from auth import verify_password, get_password_hash, create_access_token, decode_access_token
 
@@ -33,7 +33,7 @@ def test():
 async def login_user(
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_sync_db)
 ):
     """Аутентификация пользователя"""
     try:
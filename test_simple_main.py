@@ -21,7 +21,7 @@ import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent / "api"))
 
-from database import get_db, init_db
+from database import get_sync_db, init_db
 from models import User
 from auth import verify_password, get_password_hash, create_access_token, decode_access_token
 
@@ -44,7 +44,7 @@ app.add_middleware(
 async def startup_event():
     init_db()
 
-def require_auth(authorization: str = Header(default=None), db: Session = Depends(get_db)):
+def require_auth(authorization: str = Header(default=None), db: Session = Depends(get_sync_db)):
     """
     Проверяет JWT токен в заголовке Authorization: Bearer <token>.
     Токен должен быть валидным JWT токеном с информацией о пользователе.
@@ -67,7 +67,7 @@ def require_auth(authorization: str = Header(default=None), db: Session = Depend
     # иначе — 401
     raise HTTPException(status_code=401, detail="Unauthorized")
 
-def require_admin(authorization: str = Header(default=None), db: Session = Depends(get_db)):
+def require_admin(authorization: str = Header(default=None), db: Session = Depends(get_sync_db)):
     """
     Проверяет JWT токен в заголовке Authorization: Bearer <token>.
     Токен должен быть валидным JWT токеном с информацией о пользователе.
@@ -96,7 +96,7 @@ def read_root():
     return {"Hello": "World"}
 
 @app.get("/healthz")
-def health_check(authorization: str = Header(default=None), db: Session = Depends(get_db)):
+def health_check(authorization: str = Header(default=None), db: Session = Depends(get_sync_db)):
     """Health check endpoint"""
     require_auth(authorization, db)
     return {"status": "ok"}
@@ -105,7 +105,7 @@ def health_check(authorization: str = Header(default=None), db: Session = Depend
 async def login_user(
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_sync_db)
 ):
     """Аутентификация пользователя"""
     try:
@@ -158,7 +158,7 @@ async def login_user(
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.get("/auth/me")
-def get_current_user(authorization: str = Header(default=None), db: Session = Depends(get_db)):
+def get_current_user(authorization: str = Header(default=None), db: Session = Depends(get_sync_db)):
     """Получить информацию о текущем пользователе"""
     require_auth(authorization, db)
     
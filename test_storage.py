@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Тест атомарной записи и проверки задач после сбоя (tasks/storage.py)
+на fakeredis и временном DATA_DIR.
+
+Нужен fakeredis (pip install fakeredis). Запуск: python test_storage.py или pytest test_storage.py
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+os.environ.setdefault("STORAGE_FSYNC", "false")
+sys.path.append(str(Path(__file__).parent))
+
+import fakeredis
+
+from tasks import job_index, paths, storage, transcript_store
+
+def fresh_redis():
+    """Пустой fakeredis вместо общего соединения индекса"""
+    job_index._redis = fakeredis.FakeRedis(decode_responses=True)
+    return job_index._redis
+
+def test_atomic_write_keeps_old_version_on_error():
+    job_dir = Path(tempfile.mkdtemp())
+    target = job_dir / "summary.json"
+    storage.write_json(target, {"meeting_summary": "старое"})
+
+    try:
+        with storage.atomic_open(target) as f:
+            f.write('{"meeting_summary": "обре')
+            raise RuntimeError("сбой посреди записи")
+    except RuntimeError:
+        pass
+
+    assert json.loads(target.read_text("utf-8")) == {"meeting_summary": "старое"}
+    assert list(job_dir.glob(f".*{storage.TMP_SUFFIX}")) == []
+
+    storage.write_bytes(job_dir / "input.wav", b"audio")
+    assert storage.find_input(job_dir) == job_dir / "input.wav"
+
+def _make_job(data_dir: Path, job_id: str, status: str, **fields) -> Path:
+    job_dir = paths.job_dir(job_id, data_dir)
+    job_dir.mkdir(parents=True)
+    job_index.create_job(job_id, status=status, **fields)
+    return job_dir
+
+def test_check_jobs_finds_broken_results():
+    fresh_redis()
+    data_dir = Path(tempfile.mkdtemp())
+    transcript = {"language": "ru", "text": "привет", "segments": [
+        {"id": 0, "start": 0.0, "end": 1.0, "text": "привет"}]}
+
+    ok = _make_job(data_dir, "ok", "transcribed")
+    size = transcript_store.save(ok, transcript)
+    job_index.set_status("ok", "transcribed", transcript_size=size)
+
+    # Транскрипт обрезан: размер не совпадает с записанным в индекс
+    cut = _make_job(data_dir, "cut", "transcribed")
+    size = transcript_store.save(cut, transcript)
+    job_index.set_status("cut", "transcribed", transcript_size=size)
+    data = (cut / transcript_store.COMPACT_NAME).read_bytes()
+    (cut / transcript_store.COMPACT_NAME).write_bytes(data[:-3])
+
+    # Готовая задача без summary.json
+    nosum = _make_job(data_dir, "nosum", "transcribed")
+    job_index.set_status("nosum", "summarized", transcript_size=transcript_store.save(nosum, transcript),
+                         summary_size=10)
+
+    # Незавершённая задача без файлов не проверяется
+    _make_job(data_dir, "pending", "uploaded")
+
+    stale = ok / f".transcript.seg.dead{storage.TMP_SUFFIX}"
+    stale.write_bytes(b"x")
+    old = time.time() - storage.STORAGE_TMP_MAX_AGE - 10
+    os.utime(stale, (old, old))
+    fresh = ok / f".summary.json.live{storage.TMP_SUFFIX}"
+    fresh.write_bytes(b"x")
+
+    report = storage.check_jobs(data_dir)
+    assert report == {"tmp_removed": 1, "retranscribe": ["cut"], "resummarize": ["nosum"]}
+    assert not stale.exists() and fresh.exists()
+
+if __name__ == "__main__":
+    print("=== Тест хранилища задач ===\n")
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
+    print("\n🎉 Все тесты прошли успешно!")
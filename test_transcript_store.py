@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Тест компактного формата транскрипта (tasks/transcript_store.py):
+кодирование transcript.seg, чтение старых файлов и окна сегментов.
+
+Запуск: python test_transcript_store.py или pytest test_transcript_store.py
+"""
+
+import os
+import sys
+import json
+import tempfile
+from array import array
+from pathlib import Path
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+sys.path.append(str(Path(__file__).parent))
+
+from tasks import transcript_store
+
+def make_transcript(n: int = 300) -> dict:
+    segments = [{"id": i, "start": i * 2.0, "end": i * 2.0 + 1.5, "text": f" фраза {i}"} for i in range(n)]
+    return {"language": "ru", "text": " ".join(s["text"] for s in segments).strip(), "segments": segments}
+
+def test_roundtrip():
+    transcript = make_transcript()
+    assert transcript_store.decode(transcript_store.encode(transcript)) == transcript
+
+    # Текст, который не склеивается из сегментов, и пустой транскрипт
+    odd = dict(make_transcript(3), text="другой текст", error="partial")
+    assert transcript_store.decode(transcript_store.encode(odd)) == odd
+    empty = {"language": "en", "text": "", "segments": []}
+    assert transcript_store.decode(transcript_store.encode(empty)) == empty
+
+def test_truncated_file_is_rejected():
+    data = transcript_store.encode(make_transcript())
+    try:
+        transcript_store.decode(data[:-10])
+        assert False, "обрезанный файл прочитан"
+    except ValueError:
+        pass
+
+def test_save_and_render():
+    job_dir = Path(tempfile.mkdtemp())
+    transcript = make_transcript()
+    size = transcript_store.save(job_dir, transcript)
+    assert size == (job_dir / transcript_store.COMPACT_NAME).stat().st_size
+    assert transcript_store.load(job_dir) == transcript
+    assert json.loads(transcript_store.render_json(job_dir)) == transcript
+    assert transcript_store.read_header(job_dir) == {"language": "ru"}
+
+    # Сегменты с лишними полями сохраняются в JSON, компактный файл удаляется
+    extra = make_transcript(2)
+    extra["segments"][0]["words"] = []
+    transcript_store.save(job_dir, extra)
+    assert not (job_dir / transcript_store.COMPACT_NAME).exists()
+    assert transcript_store.load(job_dir) == extra
+
+def test_projection_decodes_only_window_blocks():
+    job_dir = Path(tempfile.mkdtemp())
+    transcript = make_transcript(1000)
+    transcript_store.save(job_dir, transcript)
+
+    decoded = []
+    decompress = transcript_store._decompress
+    transcript_store._decompress = lambda codec, data: decoded.append(codec) or decompress(codec, data)
+    try:
+        window = json.loads(transcript_store.render_projection(job_dir, text=False, offset=300, limit=20))
+    finally:
+        transcript_store._decompress = decompress
+    assert window["segments"] == transcript["segments"][300:320]
+    assert window["segments_total"] == 1000 and window["next_offset"] == 320
+    assert "text" not in window
+    assert len(decoded) == 1
+
+    # Окно по времени и хвост транскрипта
+    window = json.loads(transcript_store.render_projection(job_dir, t_from=10.0, t_to=16.0))
+    assert [s["id"] for s in window["segments"]] == [5, 6, 7]
+    assert window["text"] == transcript["text"] and window["next_offset"] is None
+    window = json.loads(transcript_store.render_projection(job_dir, offset=998, limit=5))
+    assert [s["id"] for s in window["segments"]] == [998, 999] and window["next_offset"] is None
+
+def test_reads_version_1():
+    transcript = make_transcript()
+    texts = [s["text"].encode("utf-8") for s in transcript["segments"]]
+    codec, compress = transcript_store._compressor()
+    header = json.dumps({"language": "ru"}).encode("utf-8")
+    data = b"".join([
+        transcript_store._PREFIX.pack(transcript_store.MAGIC, 1, codec, len(texts), len(header)),
+        header,
+        transcript_store._to_bytes(array("d", (s["start"] for s in transcript["segments"]))),
+        transcript_store._to_bytes(array("d", (s["end"] for s in transcript["segments"]))),
+        transcript_store._to_bytes(array("I", (len(t) for t in texts))),
+        compress(b"".join(texts)),
+    ])
+    assert transcript_store.decode(data) == transcript
+
+    job_dir = Path(tempfile.mkdtemp())
+    (job_dir / transcript_store.COMPACT_NAME).write_bytes(data)
+    window = json.loads(transcript_store.render_projection(job_dir, text=False, offset=150, limit=2))
+    assert window["segments"] == transcript["segments"][150:152]
+
+if __name__ == "__main__":
+    print("=== Тест формата транскрипта ===\n")
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
+    print("\n🎉 Все тесты прошли успешно!")
@@ -0,0 +1,119 @@
+"""
+Локальная заглушка LLM с OpenAI-совместимым /v1/chat/completions.
+
+Нужна, чтобы гонять суммаризацию (включая map-reduce длинных транскриптов)
+без ключа DeepSeek и без сети. Ответ детерминированный: резюме собирается
+из первых предложений последнего сообщения пользователя в той же JSON-схеме,
+что возвращает настоящая модель.
+
+Для проверки повторов и circuit breaker заглушка может отвечать ошибками:
+--fail-rate 0.3 --fail-status 503 --retry-after 2.
+
+Запуск:
+    python workers/summarize/stub_llm.py --port 8010 --delay 0.5 --max-tokens 16000
+и в .env:
+    DEEPSEEK_API_URL=http://localhost:8010/v1/chat/completions
+    DEEPSEEK_API_KEY=stub
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHARS_PER_TOKEN = 3
+
+def _summarize(text: str) -> dict:
+    # Для запроса слияния отдаём объединение частичных резюме
+    if "Резюме фрагментов:\n" in text:
+        try:
+            partials = json.loads(text.split("Резюме фрагментов:\n", 1)[1])
+            return {
+                "meeting_summary": " ".join(p.get("meeting_summary", "") for p in partials)[:2000],
+                "key_points": [k for p in partials for k in p.get("key_points", [])][:20],
+                "action_items": [a for p in partials for a in p.get("action_items", [])][:20],
+                "risks": [r for p in partials for r in p.get("risks", [])][:20],
+            }
+        except ValueError:
+            pass
+
+    body = re.split(r"[Тт]ранскрипта?:\n", text)[-1]
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", body) if s.strip()]
+    return {
+        "meeting_summary": " ".join(sentences[:3])[:500],
+        "key_points": [s[:120] for s in sentences[:3]],
+        "action_items": [],
+        "risks": [],
+    }
+
+class Handler(BaseHTTPRequestHandler):
+    delay = 0.0
+    max_tokens = 0
+    fail_rate = 0.0
+    fail_status = 503
+    retry_after = None
+
+    def _reply(self, code: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            return self._reply(404, {"error": {"message": "not found"}})
+
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = request.get("messages", [])
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // CHARS_PER_TOKEN
+        if self.max_tokens and prompt_tokens > self.max_tokens:
+            return self._reply(400, {"error": {
+                "message": f"context length exceeded: {prompt_tokens} > {self.max_tokens} tokens"}})
+
+        time.sleep(self.delay)
+        if self.fail_rate and random.random() < self.fail_rate:
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else None
+            return self._reply(self.fail_status, {"error": {"message": "stub failure"}}, headers)
+
+        user_text = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        content = json.dumps(_summarize(user_text), ensure_ascii=False)
+        self._reply(200, {
+            "id": f"stub-{time.time_ns()}",
+            "object": "chat.completion",
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // CHARS_PER_TOKEN},
+        })
+
+    def log_message(self, fmt, *args):
+        print(f"stub_llm: {fmt % args}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка LLM для офлайн-тестов суммаризации")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--delay", type=float, default=0.0, help="задержка ответа, сек")
+    parser.add_argument("--max-tokens", type=int, default=0,
+                        help="размер контекста: длиннее — ошибка 400 (0 — без ограничения)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="доля запросов, отвечающих ошибкой")
+    parser.add_argument("--fail-status", type=int, default=503, help="код ответа при ошибке")
+    parser.add_argument("--retry-after", type=int, default=None, help="заголовок Retry-After при ошибке, сек")
+    args = parser.parse_args()
+
+    Handler.delay = args.delay
+    Handler.max_tokens = args.max_tokens
+    Handler.fail_rate = args.fail_rate
+    Handler.fail_status = args.fail_status
+    Handler.retry_after = args.retry_after
+    print(f"Заглушка LLM слушает http://{args.host}:{args.port}/v1/chat/completions")
+    ThreadingHTTPServer((args.host, args.port), Handler).serve_forever()
+
+if __name__ == "__main__":
+    main()
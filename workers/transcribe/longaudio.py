@@ -0,0 +1,108 @@
+"""
+Параллельная транскрипция длинных записей.
+
+Аудио режется по паузам (VAD) на куски примерно по LONG_AUDIO_CHUNK_SECONDS,
+куски распознаются в пуле процессов — у каждого процесса своя модель Whisper
+и свой бюджет потоков, — а сегменты склеиваются обратно со сдвигом времени.
+На CPU-сервере это загружает все ядра одной длинной записью.
+"""
+
+import os
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+
+import numpy as np
+from faster_whisper import WhisperModel
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+SAMPLE_RATE = 16000
+
+LONG_AUDIO_MIN_SECONDS = float(os.getenv("LONG_AUDIO_MIN_SECONDS", "900"))
+LONG_AUDIO_CHUNK_SECONDS = float(os.getenv("LONG_AUDIO_CHUNK_SECONDS", "300"))
+LONG_AUDIO_PROCESSES = max(int(os.getenv("LONG_AUDIO_PROCESSES", str(os.cpu_count() or 1))), 1)
+LONG_AUDIO_CPU_THREADS = int(os.getenv("LONG_AUDIO_CPU_THREADS",
+                                       str(max((os.cpu_count() or 1) // LONG_AUDIO_PROCESSES, 1))))
+
+Segment = namedtuple("Segment", ["start", "end", "text"])
+
+_pool = None
+_model = None  # модель внутри процесса пула
+
+def _init_worker(model_name: str, device: str, compute_type: str, cpu_threads: int):
+    global _model
+    _model = WhisperModel(model_name, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+
+def _transcribe_chunk(args) -> list:
+    audio, offset, language, options = args
+    segments, _ = _model.transcribe(audio, language=language, **options)
+    return [Segment(seg.start + offset, seg.end + offset, seg.text) for seg in segments]
+
+def get_pool(model_name: str, device: str, compute_type: str) -> ProcessPoolExecutor:
+    """Пул процессов создаётся один раз, модели в процессах загружаются при старте"""
+    global _pool
+    if _pool is None:
+        print(f"Запускаю пул длинных записей: {LONG_AUDIO_PROCESSES} процессов "
+              f"по {LONG_AUDIO_CPU_THREADS} потоков CPU")
+        _pool = ProcessPoolExecutor(
+            max_workers=LONG_AUDIO_PROCESSES,
+            # spawn, а не fork: форк процесса с потоками CTranslate2 небезопасен
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, device, compute_type, LONG_AUDIO_CPU_THREADS),
+        )
+    return _pool
+
+def split_on_silence(audio: np.ndarray, chunk_seconds: float = LONG_AUDIO_CHUNK_SECONDS) -> list:
+    """
+    Делит аудио на куски (start, end) в отсчётах. Разрез ставится посередине
+    паузы между фрагментами речи, как только кусок набрал chunk_seconds.
+    Тишина в начале и в конце записи отбрасывается.
+    """
+    chunk_samples = int(chunk_seconds * SAMPLE_RATE)
+    speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=500))
+
+    chunks = []
+    chunk_start = None
+    prev_end = None
+    for ts in speech:
+        if chunk_start is None:
+            chunk_start = ts["start"]
+        elif ts["start"] - chunk_start >= chunk_samples:
+            cut = (prev_end + ts["start"]) // 2
+            chunks.append((chunk_start, cut))
+            chunk_start = cut
+        prev_end = ts["end"]
+
+    if chunk_start is not None:
+        chunks.append((chunk_start, min(prev_end + SAMPLE_RATE // 2, len(audio))))
+    return chunks
+
+def transcribe_parallel(audio: np.ndarray, language: str, options: dict,
+                        model_name: str, device: str, compute_type: str):
+    """
+    Распознаёт куски аудио параллельно. Возвращает (segments, info), как
+    model.transcribe: segments — генератор в порядке времени, который отдаёт
+    сегменты куска, как только готовы он и все куски до него.
+    """
+    chunks = split_on_silence(audio)
+    print(f"Длинная запись: {len(audio) / SAMPLE_RATE:.0f}s, {len(chunks)} кусков")
+
+    pool = get_pool(model_name, device, compute_type)
+    work = [(audio[start:end], start / SAMPLE_RATE, language, options) for start, end in chunks]
+    info = SimpleNamespace(duration=len(audio) / SAMPLE_RATE, language=language)
+
+    def segments():
+        global _pool
+        try:
+            for chunk_segments in pool.map(_transcribe_chunk, work):
+                yield from chunk_segments
+        except BrokenProcessPool:
+            # Процесс пула упал (например, не загрузилась модель) — следующая задача создаст пул заново
+            _pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    return segments(), info
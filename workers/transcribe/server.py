@@ -1,16 +1,23 @@
 import os
 import json
-import subprocess
+import asyncio
+import time
+import uuid
+import socket
+import threading
 import tempfile
 from pathlib import Path
 from typing import Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query
 from pydantic import BaseModel
 from faster_whisper import WhisperModel
 from redis import Redis
 from rq import Queue
 
+from tasks import job_index, dedup, storage, paths, retention, transcript_store, summary_queue
+from tasks.audio import decode_audio, SAMPLE_RATE
+import longaudio
+
 # Настройки
 DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
 WHISPER_MODEL = os.getenv("WHISPER_MODEL", "medium")
@@ -18,6 +25,95 @@ WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "cpu")
 WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
 SERVER_PORT = int(os.getenv("TRANSCRIBE_SERVER_PORT", "8002"))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Как часто (в секундах) публиковать прогресс транскрипции
+PROGRESS_INTERVAL = float(os.getenv("TRANSCRIBE_PROGRESS_INTERVAL", "2"))
+
+# Пул транскрипции: TRANSCRIBE_SLOTS задач выполняются одновременно, у каждой свой
+# бюджет потоков CPU; остальные ждут в очереди Redis (переживает перезапуск сервера)
+TRANSCRIBE_SLOTS = max(int(os.getenv("TRANSCRIBE_SLOTS", "1")), 1)
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", str(max((os.cpu_count() or 1) // TRANSCRIBE_SLOTS, 1))))
+TRANSCRIBE_QUEUE_MAX = int(os.getenv("TRANSCRIBE_QUEUE_MAX", "0"))  # 0 — очередь без ограничения
+DEFAULT_PRIORITY = 5  # 0 — самый высокий приоритет, 9 — самый низкий
+
+QUEUE_KEY = "transcribe:queue"        # zset job_id -> priority * 1e12 + порядковый номер (FIFO внутри приоритета)
+PAYLOAD_KEY = "transcribe:payload"    # hash job_id -> параметры задачи
+RUNNING_KEY = "transcribe:running"    # hash job_id -> какой слот и с какого времени обрабатывает
+SEQ_KEY = "transcribe:seq"
+RECOVERY_LOCK_KEY = "transcribe:recovery"
+RECOVERY_LOCK_TTL = 120  # продлевается во время обхода каждые RECOVERY_LOCK_TTL / 3 секунд
+HEARTBEAT_KEY = "transcribe:worker:{}"  # живой сервер продлевает свой ключ каждые WORKER_LEASE_TTL / 3 секунд
+# Стабильный идентификатор сервера (уникальный для каждого экземпляра): по нему сервер
+# после перезапуска сразу забирает свои прерванные задачи. Без него используется hostname,
+# который в docker меняется при пересоздании контейнера, — тогда задачи подхватываются
+# по истечении аренды WORKER_LEASE_TTL.
+WORKER_NAME = os.getenv("WORKER_ID") or socket.gethostname()
+WORKER_LEASE_TTL = max(float(os.getenv("WORKER_LEASE_TTL", "90")), 3)
+CLAIM_POLL_INTERVAL = 0.5
+# Сколько раз задача может упасть в слоте вне process_transcription (сбой Redis и т. п.)
+# и вернуться в очередь, прежде чем будет помечена ошибкой
+SLOT_MAX_FAILURES = 3
+
+# Слот -> задача, которую он обрабатывает (None — слот забирает задачу из очереди).
+# По нему heartbeat отличает свои задачи в running, над которыми никто не работает
+_slot_jobs = {}
+
+# Блокировка проверки файлов продлевается и снимается только её владельцем (по токену):
+# сервер, чья блокировка истекла, не может снять или продлить блокировку другого
+_EXTEND_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Забирает задачу с наименьшим приоритетом из очереди и записывает её в running
+# одной операцией — падение сервера между ними не может потерять задачу
+_CLAIM_LUA = """
+local item = redis.call('ZPOPMIN', KEYS[1])
+if #item == 0 then return nil end
+local job_id = item[1]
+local payload = redis.call('HGET', KEYS[2], job_id)
+if not payload then return {job_id, ''} end
+redis.call('HSET', KEYS[3], job_id, cjson.encode({
+    job_id = job_id, slot = tonumber(ARGV[2]), worker = ARGV[1], started_at = tonumber(ARGV[3])}))
+return {job_id, payload}
+"""
+
+# Возвращает задачу из running в очередь, если запись не изменилась и (без force)
+# аренда сервера, который её обрабатывал, истекла
+_RECLAIM_LUA = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then return 0 end
+if ARGV[3] ~= '1' and redis.call('EXISTS', KEYS[4]) == 1 then return 0 end
+redis.call('HDEL', KEYS[1], ARGV[1])
+if redis.call('HEXISTS', KEYS[3], ARGV[1]) == 1 then
+    redis.call('ZADD', KEYS[2], tonumber(ARGV[4]), ARGV[1])
+end
+return 1
+"""
+
+# Длинные записи (от LONG_AUDIO_MIN_SECONDS) режутся по паузам и распознаются
+# в пуле процессов — см. longaudio.py
+LONG_AUDIO_MODE = os.getenv("LONG_AUDIO_MODE", "false").lower() == "true"
+
+# Оптимизированные параметры для ускорения обработки
+TRANSCRIBE_OPTIONS = dict(
+    vad_filter=True,
+    beam_size=1,
+    no_speech_threshold=0.6,
+    compression_ratio_threshold=2.4,
+    log_prob_threshold=-1.0,
+    temperature=0.0,
+    condition_on_previous_text=False,
+    initial_prompt=None,
+    word_timestamps=False
+)
 
 # Инициализируем модель один раз при запуске сервера
 print(f"Инициализация Whisper модели: {WHISPER_MODEL} на {WHISPER_DEVICE}")
@@ -32,7 +128,9 @@ try:
     model = WhisperModel(
         WHISPER_MODEL,
         device=WHISPER_DEVICE,
-        compute_type=WHISPER_COMPUTE_TYPE
+        compute_type=WHISPER_COMPUTE_TYPE,
+        cpu_threads=WHISPER_CPU_THREADS,
+        num_workers=TRANSCRIBE_SLOTS  # позволяет слотам вызывать transcribe параллельно
     )
     print("Whisper модель инициализирована и готова к работе!")
 except Exception as e:
@@ -47,6 +145,11 @@ class TranscriptionRequest(BaseModel):
     job_id: str
     language: str = "ru"
 
+class LocalTranscriptionRequest(TranscriptionRequest):
+    path: str  # путь к аудио относительно DATA_DIR
+    priority: int = DEFAULT_PRIORITY
+    sha256: Optional[str] = None  # хэш аудио, посчитанный API при загрузке
+
 class TranscriptionResponse(BaseModel):
     job_id: str
     status: str
@@ -55,39 +158,52 @@ class TranscriptionResponse(BaseModel):
     segments: Optional[list] = None
 
 def _jdir(job_id: str) -> Path:
-    d = DATA_DIR / "jobs" / job_id
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+    # Каталог создаётся при загрузке; здесь не создаётся, чтобы не воскресить удалённую задачу
+    return paths.job_dir(job_id, DATA_DIR)
 
-def convert_to_wav(input_path: Path, output_path: Path):
-    """Конвертирует аудиофайл в WAV формат для лучшей совместимости с Whisper"""
-    try:
-        print(f"Конвертация {input_path} в {output_path}")
-        cmd = [
-            "ffmpeg", "-y",
-            "-i", str(input_path),
-            "-acodec", "pcm_s16le",
-            "-ar", "16000",
-            "-ac", "1",
-            str(output_path)
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        
-        if result.returncode != 0:
-            print(f"FFmpeg error: {result.stderr}")
-            return False
-            
-        print(f"Конвертация успешна: {output_path}")
-        return True
-    except Exception as e:
-        print(f"Conversion error: {e}")
+def _job_gone(job_id: str, jdir: Path) -> bool:
+    """Задача удалена (DELETE /history) — результаты не пишутся"""
+    return not jdir.is_dir() or job_index.get_job(job_id) is None
+
+def _mark_processing(job_id: str):
+    # Статус задачи хранится только в индексе (tasks/job_index.py), meta.json не переписывается
+    job_index.set_status(job_id, "transcribing")
+
+def _enqueue_summary(job_id: str):
+    r = Redis.from_url(REDIS_URL)
+    q = Queue(summary_queue.QUEUE_NAME, connection=r)
+    summary_queue.enqueue(q, job_id)
+    print("Задача добавлена в очередь суммаризации")
+
+def reuse_transcript(job_id: str, language: str, sha256: Optional[str]) -> bool:
+    """
+    Если это аудио уже распознавалось с теми же языком и моделью, копирует
+    готовый транскрипт (и резюме, если оно есть) вместо запуска Whisper
+    """
+    if model is None:
+        return False
+    source_id = dedup.lookup(sha256, language, WHISPER_MODEL, WHISPER_COMPUTE_TYPE)
+    if not source_id or source_id == job_id:
         return False
 
-def process_transcription(job_id: str, audio_path: Path, language: str = "ru"):
+    print(f"Аудио job_id {job_id} уже распознано в {source_id}, переиспользую транскрипт")
+    fields = dedup.copy_results(source_id, job_id)  # с deduplicated_from
+    summary_size = fields.pop("summary_size", None)
+    job_index.set_status(job_id, "transcribed", has_transcript=True, progress=1.0, **fields)
+
+    if summary_size is not None:
+        job_index.set_status(job_id, "summarized", has_summary=True, summary_size=summary_size)
+    else:
+        _enqueue_summary(job_id)
+    return True
+
+def process_transcription(job_id: str, audio_path: Path, language: str = "ru", sha256: Optional[str] = None):
     """Обрабатывает транскрипцию в фоновом режиме"""
     try:
         jdir = _jdir(job_id)
+        if _job_gone(job_id, jdir):
+            print(f"Задача {job_id} удалена, транскрипция пропущена")
+            return
         print(f"Начинаю транскрипцию job_id: {job_id}")
         print(f"Исходный аудиофайл: {audio_path}")
         
@@ -105,30 +221,18 @@ def process_transcription(job_id: str, audio_path: Path, language: str = "ru"):
                 }]
             }
         else:
-            # Конвертируем в WAV если это не WAV файл
-            wav_path = audio_path
-            if audio_path.suffix.lower() != '.wav':
-                wav_path = jdir / "input_converted.wav"
-                if not convert_to_wav(audio_path, wav_path):
-                    wav_path = audio_path
-                    print(f"Using original file: {audio_path}")
-
-            print(f"Обрабатываю аудиофайл: {wav_path}")
-            
-            # Оптимизированные параметры для ускорения обработки
-            segments, info = model.transcribe(
-                str(wav_path),
-                language=language,
-                vad_filter=True,
-                beam_size=1,
-                no_speech_threshold=0.6,
-                compression_ratio_threshold=2.4,
-                log_prob_threshold=-1.0,
-                temperature=0.0,
-                condition_on_previous_text=False,
-                initial_prompt=None,
-                word_timestamps=False
-            )
+            # Декодируем в память: ffmpeg -> PCM в stdout -> float32 массив,
+            # без промежуточного input_converted.wav на диске
+            audio = decode_audio(audio_path, debug_wav=jdir / "input_converted.wav")
+            print(f"Аудио декодировано: {len(audio) / SAMPLE_RATE:.1f}s")
+
+            if LONG_AUDIO_MODE and len(audio) >= longaudio.LONG_AUDIO_MIN_SECONDS * SAMPLE_RATE:
+                segments, info = longaudio.transcribe_parallel(
+                    audio, language, TRANSCRIBE_OPTIONS,
+                    WHISPER_MODEL, WHISPER_DEVICE, WHISPER_COMPUTE_TYPE
+                )
+            else:
+                segments, info = model.transcribe(audio, language=language, **TRANSCRIBE_OPTIONS)
         
             print(f"Whisper вернул info: {info}")
             print(f"Начинаю обработку сегментов...")
@@ -136,17 +240,31 @@ def process_transcription(job_id: str, audio_path: Path, language: str = "ru"):
             out = {"language": language, "text": "", "segments": []}
             parts = []
             segment_count = 0
+            last_progress = 0.0
             
-            for i, seg in enumerate(segments):
-                print(f"Обрабатываю сегмент {i}: {seg.start:.2f}s - {seg.end:.2f}s: '{seg.text}'")
-                parts.append(seg.text)
-                out["segments"].append({
-                    "id": i,
-                    "start": seg.start,
-                    "end": seg.end,
-                    "text": seg.text
-                })
-                segment_count += 1
+            # Сегменты дописываются в transcript.partial.jsonl по мере декодирования,
+            # чтобы клиенты могли читать транскрипт до окончания работы Whisper
+            with (jdir / transcript_store.PARTIAL_NAME).open("w", encoding="utf-8") as partial:
+                for i, seg in enumerate(segments):
+                    print(f"Обрабатываю сегмент {i}: {seg.start:.2f}s - {seg.end:.2f}s: '{seg.text}'")
+                    parts.append(seg.text)
+                    segment = {
+                        "id": i,
+                        "start": seg.start,
+                        "end": seg.end,
+                        "text": seg.text
+                    }
+                    out["segments"].append(segment)
+                    partial.write(json.dumps(segment, ensure_ascii=False) + "\n")
+                    partial.flush()
+                    segment_count += 1
+
+                    now = time.monotonic()
+                    if info.duration and now - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = now
+                        job_index.set_status(job_id, "transcribing",
+                                             progress=round(min(seg.end / info.duration, 1.0), 4),
+                                             partial_segments=segment_count)
                 
             out["text"] = " ".join(parts).strip()
         
@@ -155,25 +273,23 @@ def process_transcription(job_id: str, audio_path: Path, language: str = "ru"):
         else:
             print(f"Результат транскрипции (заглушка): {len(out['segments'])} сегментов, длина текста: {len(out['text'])}")
 
-        # Сохраняем результаты
-        (jdir / "transcript.json").write_text(json.dumps(out, ensure_ascii=False, indent=2), "utf-8")
-        (jdir / "transcript.txt").write_text(out["text"], "utf-8")
+        # Сохраняем результаты, если задачу не удалили, пока шло распознавание
+        if _job_gone(job_id, jdir):
+            print(f"Задача {job_id} удалена во время транскрипции, результат не сохраняется")
+            return
+        transcript_size = transcript_store.save(jdir, out)
+        job_index.set_status(job_id, "transcribed", has_transcript=True, progress=1.0,
+                             partial_segments=len(out["segments"]),
+                             transcript_size=transcript_size)
+        # Сегменты теперь в итоговом транскрипте — /partial берёт их оттуда
+        (jdir / transcript_store.PARTIAL_NAME).unlink(missing_ok=True)
         
         print("Файлы транскрипции сохранены")
+        if model is not None:
+            dedup.remember(sha256, language, WHISPER_MODEL, WHISPER_COMPUTE_TYPE, job_id)
 
         # Добавляем задачу в очередь суммаризации
-        r = Redis.from_url(REDIS_URL)
-        q = Queue("sum", connection=r)
-        q.enqueue("tasks.summarize.summarize_job", job_id)
-        print("Задача добавлена в очередь суммаризации")
-        
-        # Обновляем meta.json
-        meta_file = jdir / "meta.json"
-        if meta_file.exists():
-            meta = json.loads(meta_file.read_text())
-            meta["transcription_status"] = "completed"
-            meta["transcription_text"] = out["text"]
-            meta_file.write_text(json.dumps(meta, ensure_ascii=False, indent=2), "utf-8")
+        _enqueue_summary(job_id)
         
         print(f"Транскрипция job_id {job_id} завершена успешно")
         
@@ -184,17 +300,204 @@ def process_transcription(job_id: str, audio_path: Path, language: str = "ru"):
         
         # Создаем пустой результат в случае ошибки
         jdir = _jdir(job_id)
+        if _job_gone(job_id, jdir):
+            print(f"Задача {job_id} удалена, ошибка не сохраняется")
+            return
         out = {"language": language, "text": "", "segments": [], "error": str(e)}
-        (jdir / "transcript.json").write_text(json.dumps(out, ensure_ascii=False, indent=2), "utf-8")
-        (jdir / "transcript.txt").write_text("", "utf-8")
-        
-        # Обновляем meta.json с ошибкой
-        meta_file = jdir / "meta.json"
-        if meta_file.exists():
-            meta = json.loads(meta_file.read_text())
-            meta["transcription_status"] = "error"
-            meta["transcription_error"] = str(e)
-            meta_file.write_text(json.dumps(meta, ensure_ascii=False, indent=2), "utf-8")
+        transcript_store.save(jdir, out)
+        job_index.set_status(job_id, "error", error=str(e))
+        (jdir / transcript_store.PARTIAL_NAME).unlink(missing_ok=True)
+
+def check_admission():
+    """Отклоняет задачу, только если очередь ограничена и уже заполнена"""
+    if TRANSCRIBE_QUEUE_MAX and job_index.get_redis().zcard(QUEUE_KEY) >= TRANSCRIBE_QUEUE_MAX:
+        raise HTTPException(status_code=503, detail="Transcription queue is full",
+                            headers={"Retry-After": "30"})
+
+def enqueue_transcription(job_id: str, audio_path: Path, language: str,
+                          priority: int = DEFAULT_PRIORITY, sha256: Optional[str] = None,
+                          temp_file: bool = False) -> int:
+    """
+    Ставит задачу в очередь пула, возвращает глубину очереди.
+    temp_file — аудио во временной копии загрузки, её удаляют после транскрипции.
+    """
+    r = job_index.get_redis()
+    payload = {"job_id": job_id, "path": str(audio_path), "language": language,
+               "priority": priority, "sha256": sha256, "temp_file": temp_file,
+               "enqueued_at": time.time()}
+    seq = r.incr(SEQ_KEY)
+    pipe = r.pipeline(transaction=True)
+    pipe.hset(PAYLOAD_KEY, job_id, json.dumps(payload, ensure_ascii=False))
+    pipe.zadd(QUEUE_KEY, {job_id: priority * 10**12 + seq})
+    pipe.zcard(QUEUE_KEY)
+    depth = pipe.execute()[-1]
+    print(f"Задача {job_id} поставлена в очередь транскрипции (приоритет {priority}, глубина {depth})")
+    return depth
+
+def _release_failed(r: Redis, reclaim, job_id: str, payload: dict, error: Exception):
+    """
+    Задача упала в слоте до или после process_transcription: убирается из
+    running и возвращается в очередь, после SLOT_MAX_FAILURES — помечается ошибкой
+    """
+    failures = payload.get("failures", 0) + 1
+    running = r.hget(RUNNING_KEY, job_id)
+    if payload and failures < SLOT_MAX_FAILURES:
+        payload["failures"] = failures
+        r.hset(PAYLOAD_KEY, job_id, json.dumps(payload, ensure_ascii=False))
+        if running is not None:
+            reclaim(keys=[RUNNING_KEY, QUEUE_KEY, PAYLOAD_KEY, HEARTBEAT_KEY.format(WORKER_NAME)],
+                    args=[job_id, running, "1", payload.get("priority", DEFAULT_PRIORITY) * 10**12])
+        print(f"Задача {job_id} возвращена в очередь после сбоя ({failures}/{SLOT_MAX_FAILURES})")
+        return
+    job_index.set_status(job_id, "error", force=True, error=f"transcription slot failed: {error}")
+    pipe = r.pipeline(transaction=True)
+    pipe.hdel(RUNNING_KEY, job_id)
+    pipe.hdel(PAYLOAD_KEY, job_id)
+    pipe.execute()
+
+def _slot_loop(slot: int):
+    """Слот пула: забирает задачи из очереди по одной и транскрибирует их"""
+    r = job_index.get_redis()
+    claim = r.register_script(_CLAIM_LUA)
+    reclaim = r.register_script(_RECLAIM_LUA)
+    while True:
+        _slot_jobs[slot] = None
+        job_id, payload = None, {}
+        try:
+            item = claim(keys=[QUEUE_KEY, PAYLOAD_KEY, RUNNING_KEY], args=[WORKER_NAME, slot, time.time()])
+            if not item:
+                _slot_jobs.pop(slot, None)
+                time.sleep(CLAIM_POLL_INTERVAL)
+                continue
+            job_id, raw = item
+            _slot_jobs[slot] = job_id
+            if not raw:
+                continue
+            payload = json.loads(raw)
+
+            print(f"Слот {slot}: начинаю job_id {job_id}")
+            _mark_processing(job_id)
+            process_transcription(job_id, Path(payload["path"]), payload["language"], payload.get("sha256"))
+            if payload.get("temp_file"):
+                Path(payload["path"]).unlink(missing_ok=True)
+
+            pipe = r.pipeline(transaction=True)
+            pipe.hdel(RUNNING_KEY, job_id)
+            pipe.hdel(PAYLOAD_KEY, job_id)
+            pipe.execute()
+        except Exception as e:
+            print(f"Слот {slot}: ошибка обработки очереди: {e}")
+            if job_id is not None:
+                try:
+                    _release_failed(r, reclaim, job_id, payload, e)
+                except Exception as release_error:
+                    # Redis недоступен — задачу вернёт heartbeat (_requeue_interrupted)
+                    print(f"Слот {slot}: не удалось вернуть задачу {job_id}: {release_error}")
+            time.sleep(1)
+        finally:
+            _slot_jobs.pop(slot, None)
+
+def _requeue_interrupted(own_only: bool = False):
+    """
+    Возвращает в очередь прерванные задачи: при старте — свои (этот WORKER_ID
+    обрабатывал их до перезапуска), а также задачи серверов с истёкшей арендой
+    (сервер упал или контейнер пересоздан с другим hostname) и свои задачи,
+    над которыми не работает ни один слот (слот не смог вернуть их после сбоя).
+    """
+    r = job_index.get_redis()
+    reclaim = r.register_script(_RECLAIM_LUA)
+    for job_id, raw in r.hgetall(RUNNING_KEY).items():
+        entry = json.loads(raw)
+        worker = entry.get("worker")
+        own = worker == WORKER_NAME
+        if own_only and not own:
+            continue
+        if own and not own_only and entry.get("slot") in _slot_jobs and \
+                _slot_jobs.get(entry.get("slot")) in (None, job_id):
+            continue
+        payload = json.loads(r.hget(PAYLOAD_KEY, job_id) or "{}")
+        priority = payload.get("priority", DEFAULT_PRIORITY) * 10**12
+        if reclaim(keys=[RUNNING_KEY, QUEUE_KEY, PAYLOAD_KEY, HEARTBEAT_KEY.format(worker)],
+                   args=[job_id, raw, "1" if own else "0", priority]):
+            print(f"Возвращаю в очередь прерванную задачу {job_id} (сервер {worker})")
+
+def _heartbeat_loop():
+    """Продлевает аренду этого сервера и подбирает задачи серверов, чья аренда истекла"""
+    r = job_index.get_redis()
+    while True:
+        try:
+            r.set(HEARTBEAT_KEY.format(WORKER_NAME), time.time(), ex=int(WORKER_LEASE_TTL))
+            _requeue_interrupted()
+        except Exception as e:
+            print(f"Ошибка продления аренды сервера: {e}")
+        time.sleep(WORKER_LEASE_TTL / 3)
+
+def _recover_artifacts():
+    """
+    Проверка файлов задач после перезапуска (tasks/storage.py): задачи с
+    отсутствующим или обрезанным транскриптом распознаются заново, с
+    обрезанным summary.json — заново суммаризируются. При нескольких
+    серверах проверку выполняет тот, кто первым взял блокировку; пока обход
+    идёт, она продлевается, а если всё же потеряна — обход прерывается.
+    """
+    r = job_index.get_redis()
+    token = f"{WORKER_NAME}:{uuid.uuid4().hex}"
+    if not r.set(RECOVERY_LOCK_KEY, token, nx=True, ex=RECOVERY_LOCK_TTL):
+        return
+    extend = r.register_script(_EXTEND_LOCK_LUA)
+    renewed = time.monotonic()
+
+    def keep_lock(*_):
+        nonlocal renewed
+        if time.monotonic() - renewed < RECOVERY_LOCK_TTL / 3:
+            return
+        if not extend(keys=[RECOVERY_LOCK_KEY], args=[token, RECOVERY_LOCK_TTL * 1000]):
+            raise RuntimeError("recovery lock expired and was taken by another server")
+        renewed = time.monotonic()
+
+    try:
+        report = storage.check_jobs(DATA_DIR, on_job=keep_lock)
+        for job_id in report["retranscribe"]:
+            keep_lock()
+            record = job_index.get_job(job_id) or {}
+            audio_path = storage.find_input(paths.job_dir(job_id, DATA_DIR))
+            if audio_path is None:
+                job_index.set_status(job_id, "error", force=True,
+                                     error="transcript is damaged and input audio is missing")
+                continue
+            print(f"Транскрипт задачи {job_id} повреждён, распознаю заново")
+            job_index.set_status(job_id, "uploaded", force=True,
+                                 has_transcript=False, has_summary=False, progress=0.0)
+            enqueue_transcription(job_id, audio_path, record.get("language") or "ru",
+                                  sha256=record.get("audio_sha256"))
+        for job_id in report["resummarize"]:
+            keep_lock()
+            print(f"Резюме задачи {job_id} повреждено, суммаризирую заново")
+            job_index.set_status(job_id, "transcribed", force=True, has_summary=False)
+            _enqueue_summary(job_id)
+        print(f"Проверка файлов задач: удалено временных файлов {report['tmp_removed']}, "
+              f"повторная транскрипция {len(report['retranscribe'])}, "
+              f"повторная суммаризация {len(report['resummarize'])}")
+    except Exception as e:
+        print(f"Ошибка проверки файлов задач: {e}")
+    finally:
+        try:
+            r.register_script(_RELEASE_LOCK_LUA)(keys=[RECOVERY_LOCK_KEY], args=[token])
+        except Exception as e:
+            print(f"Ошибка снятия блокировки проверки файлов: {e}")
+
+@app.on_event("startup")
+def start_pool():
+    job_index.get_redis().set(HEARTBEAT_KEY.format(WORKER_NAME), time.time(), ex=int(WORKER_LEASE_TTL))
+    _requeue_interrupted(own_only=True)
+    threading.Thread(target=_heartbeat_loop, daemon=True, name="transcribe-heartbeat").start()
+    # Обход DATA_DIR может занять время — не задерживаем старт пула
+    threading.Thread(target=_recover_artifacts, daemon=True, name="transcribe-recovery").start()
+    if retention.GC_ENABLED:
+        threading.Thread(target=retention.run_forever, daemon=True, name="retention-gc").start()
+    for slot in range(TRANSCRIBE_SLOTS):
+        threading.Thread(target=_slot_loop, args=(slot,), daemon=True, name=f"transcribe-slot-{slot}").start()
+    print(f"Пул транскрипции запущен: {TRANSCRIBE_SLOTS} слотов по {WHISPER_CPU_THREADS} потоков CPU")
 
 @app.get("/")
 async def root():
@@ -204,78 +507,113 @@ async def root():
 async def health_check():
     return {"status": "healthy", "model_loaded": True}
 
+def _store_upload(job_id: str, file: UploadFile) -> Path:
+    """Копирует загруженное аудио во временный файл чанками, не читая его целиком в память"""
+    # Каталог задачи создаётся здесь, при приёме загрузки (при общем томе он уже есть)
+    paths.job_dir(job_id, DATA_DIR).mkdir(parents=True, exist_ok=True)
+    # Префикс нужен GC (tasks/retention.py), чтобы найти копии, брошенные при сбое
+    with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix,
+                                     prefix=retention.UPLOAD_TMP_PREFIX,
+                                     dir=retention.UPLOAD_TMP_DIR) as temp_file:
+        file.file.seek(0)
+        while True:
+            chunk = file.file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            temp_file.write(chunk)
+        return Path(temp_file.name)
+
 @app.post("/transcribe", response_model=TranscriptionResponse)
 async def transcribe_audio(
-    background_tasks: BackgroundTasks,
     job_id: str = Query(..., description="Job ID for transcription"),
     language: str = Query("ru", description="Language for transcription"),
+    priority: int = Query(DEFAULT_PRIORITY, ge=0, le=9, description="0 — самый высокий приоритет"),
+    sha256: Optional[str] = Query(None, description="SHA-256 аудио для дедупликации"),
     file: UploadFile = File(...)
 ):
     """Принимает аудиофайл и запускает транскрипцию в фоновом режиме"""
     
     if not file.filename:
         raise HTTPException(status_code=400, detail="Audio file is required")
+    # Копирование результатов с fsync и запросы к Redis — не в event loop
+    if await asyncio.to_thread(reuse_transcript, job_id, language, sha256):
+        return TranscriptionResponse(job_id=job_id, status="deduplicated",
+                                     message="Transcript reused from an identical earlier upload")
+    await asyncio.to_thread(check_admission)
     
     try:
-        # Создаем временный файл для загруженного аудио
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file.flush()
-            temp_path = Path(temp_file.name)
+        # Запись на диск — в потоке, чтобы большая загрузка не останавливала event loop
+        temp_path = await asyncio.to_thread(_store_upload, job_id, file)
         
-        # Запускаем транскрипцию в фоновом режиме
-        background_tasks.add_task(process_transcription, job_id, temp_path, language)
-        
-        # Обновляем meta.json
-        jdir = _jdir(job_id)
-        meta_file = jdir / "meta.json"
-        if meta_file.exists():
-            meta = json.loads(meta_file.read_text())
-        else:
-            meta = {}
-        
-        meta["transcription_status"] = "processing"
-        meta["transcription_started"] = True
-        meta_file.write_text(json.dumps(meta, ensure_ascii=False, indent=2), "utf-8")
+        # Ставим транскрипцию в очередь пула
+        depth = await asyncio.to_thread(enqueue_transcription, job_id, temp_path, language,
+                                        priority, sha256, temp_file=True)
         
         return TranscriptionResponse(
             job_id=job_id,
             status="accepted",
-            message="Audio file received and transcription started"
+            message=f"Audio file received and queued for transcription (queue depth: {depth})"
         )
         
     except Exception as e:
         print(f"Error processing upload for job_id {job_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/transcribe/local", response_model=TranscriptionResponse)
+async def transcribe_local(request: LocalTranscriptionRequest):
+    """Ставит в очередь транскрипцию файла, который уже лежит на общем томе DATA_DIR"""
+    audio_path = (DATA_DIR / request.path).resolve()
+    if not audio_path.is_relative_to(DATA_DIR.resolve()):
+        raise HTTPException(status_code=400, detail="Path must be inside DATA_DIR")
+    if not audio_path.is_file():
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    if not 0 <= request.priority <= 9:
+        raise HTTPException(status_code=400, detail="Priority must be between 0 and 9")
+    if await asyncio.to_thread(reuse_transcript, request.job_id, request.language, request.sha256):
+        return TranscriptionResponse(job_id=request.job_id, status="deduplicated",
+                                     message="Transcript reused from an identical earlier upload")
+    check_admission()
+
+    depth = enqueue_transcription(request.job_id, audio_path, request.language,
+                                  request.priority, request.sha256)
+
+    return TranscriptionResponse(
+        job_id=request.job_id,
+        status="accepted",
+        message=f"Queued for transcription from shared storage (queue depth: {depth})"
+    )
+
+@app.get("/queue")
+async def queue_status():
+    """Состояние пула транскрипции: глубина очереди и занятые слоты"""
+    r = job_index.get_redis()
+    running = [json.loads(v) for v in r.hvals(RUNNING_KEY)]
+    return {
+        "depth": r.zcard(QUEUE_KEY),
+        "max_depth": TRANSCRIBE_QUEUE_MAX or None,
+        "slots": TRANSCRIBE_SLOTS,
+        "cpu_threads_per_slot": WHISPER_CPU_THREADS,
+        "running": running,
+        "dedup": dedup.stats(),
+        "gc": retention.stats()
+    }
+
 @app.get("/status/{job_id}")
 async def get_transcription_status(job_id: str):
-    """Проверяет статус транскрипции для конкретного job_id"""
+    """Проверяет статус транскрипции для конкретного job_id (без чтения транскрипта)"""
     try:
-        jdir = _jdir(job_id)
-        transcript_file = jdir / "transcript.json"
-        meta_file = jdir / "meta.json"
-        
-        if not jdir.exists():
+        record = job_index.get_job(job_id)
+        if not record:
             return {"job_id": job_id, "status": "not_found"}
-        
-        if transcript_file.exists():
-            transcript = json.loads(transcript_file.read_text())
-            return {
-                "job_id": job_id,
-                "status": "completed",
-                "text": transcript.get("text", ""),
-                "segments": transcript.get("segments", [])
-            }
-        
-        if meta_file.exists():
-            meta = json.loads(meta_file.read_text())
-            if meta.get("transcription_status") == "processing":
-                return {"job_id": job_id, "status": "processing"}
-            elif meta.get("transcription_status") == "error":
-                return {"job_id": job_id, "status": "error", "error": meta.get("transcription_error")}
-        
+
+        stage = record["status"]
+        if stage in ("transcribed", "summarized"):
+            return {"job_id": job_id, "status": "completed"}
+        if stage == "transcribing":
+            return {"job_id": job_id, "status": "processing"}
+        if stage == "error":
+            return {"job_id": job_id, "status": "error", "error": record.get("error")}
+
         return {"job_id": job_id, "status": "pending"}
         
     except Exception as e: